@@ -0,0 +1,204 @@
+import datetime
+import os
+import re
+import zipfile
+from os import path
+from typing import List, Dict, Set, BinaryIO, NamedTuple
+
+# File of an archive. Path is the path which has to be passed to `open` of the archive.
+ArchiveFile = NamedTuple('ArchiveFile', [('name', str), ('path', str), ('size', int), ('mtime_ns', int)])
+
+# Message files of threads (messages/inbox/johndoe_a1b2c3/message_1.json).
+MESSAGE_FILE = re.compile(r'messages/([^/]+)/([^/]+)/(message_(\d+)\.json)')
+MESSAGE_FILE_NAME = re.compile(r'message_(\d+)\.json')
+
+
+class Archive:
+    """
+    Facebook export which can be either unzipped directory or ZIP file. Paths inside
+    of the archive are specified by their parts (`'messages', 'inbox'` for example).
+    """
+
+    def isdir(self, *parts: str) -> bool:
+        raise NotImplementedError
+
+    def isfile(self, *parts: str) -> bool:
+        raise NotImplementedError
+
+    def listdir(self, *parts: str) -> List[str]:
+        raise NotImplementedError
+
+    def file_path(self, *parts: str) -> str:
+        """
+        Returns path of file which can be passed to `open`.
+        """
+        raise NotImplementedError
+
+    def thread_files(self, thread_dir: str) -> List[ArchiveFile]:
+        """
+        Returns message files (`message_N.json`) of thread in specified directory (relative
+        to messages folder) ordered by their number. Media files are never listed.
+        """
+        raise NotImplementedError
+
+    def rescan(self) -> None:
+        """
+        Forgets results of previous scans, so changes of the archive are visible.
+        """
+
+    def open(self, file_path: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def reopen(self) -> None:
+        """
+        Reopens underlying files (used by forked worker processes, which must not share
+        file positions with the parent process).
+        """
+
+
+class DirectoryArchive(Archive):
+    """
+    Unzipped Facebook export.
+    """
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+
+        # Files of threads are scanned once and shared by listing of threads, cache
+        # and parser, which saves round-trips on network file systems.
+        self.scanned_threads: Dict[str, List[ArchiveFile]] = {}
+
+    def isdir(self, *parts):
+        return path.isdir(path.join(self.root_path, *parts))
+
+    def isfile(self, *parts):
+        return path.isfile(path.join(self.root_path, *parts))
+
+    def listdir(self, *parts):
+        return os.listdir(path.join(self.root_path, *parts))
+
+    def file_path(self, *parts):
+        return path.join(self.root_path, *parts)
+
+    def thread_files(self, thread_dir):
+        files = self.scanned_threads.get(thread_dir)
+        if files is not None:
+            return files
+
+        numbered = []
+        try:
+            with os.scandir(path.join(self.root_path, 'messages', thread_dir)) as entries:
+                for entry in entries:
+                    # Names are checked first, so media files are not even stat-ed.
+                    match = MESSAGE_FILE_NAME.fullmatch(entry.name)
+                    if match is None or not entry.is_file():
+                        continue
+
+                    stat = entry.stat()
+                    numbered.append((int(match.group(1)),
+                                     ArchiveFile(entry.name, entry.path, stat.st_size, stat.st_mtime_ns)))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+        files = self.scanned_threads[thread_dir] = [file for _, file in sorted(numbered)]
+        return files
+
+    def rescan(self):
+        self.scanned_threads = {}
+
+    def open(self, file_path):
+        return open(file_path, 'rb')
+
+
+class ZipArchive(Archive):
+    """
+    Facebook export read directly from ZIP file without unzipping it.
+
+    Entries are enumerated from the central directory of the ZIP file once. Only
+    message files of threads are ever decompressed (photos, videos and other media
+    are skipped) and they are decompressed as a stream while being parsed.
+    """
+
+    def __init__(self, zip_path: str):
+        self.zip_path = zip_path
+        self.zip = zipfile.ZipFile(zip_path)
+
+        self.entries: Dict[str, zipfile.ZipInfo] = {}
+        self.directories: Dict[str, Set[str]] = {'': set()}
+        self.threads: Dict[str, List[zipfile.ZipInfo]] = {}
+
+        names = [info.filename for info in self.zip.infolist()]
+
+        # Some tools put the whole export into single top-level folder.
+        self.prefix = ''
+        if not any(name.startswith('messages/') for name in names):
+            prefixes = {name[:name.index('messages/')] for name in names if '/messages/' in name}
+            if prefixes:
+                self.prefix = min(prefixes, key=len)
+
+        for info in self.zip.infolist():
+            if not info.filename.startswith(self.prefix) or info.is_dir():
+                continue
+
+            name = info.filename[len(self.prefix):]
+            self.entries[name] = info
+
+            # Directories are not always stored as entries, so they are derived from names.
+            parts = name.split('/')
+            for i in range(len(parts)):
+                self.directories.setdefault('/'.join(parts[:i]), set()).add(parts[i])
+
+            match = MESSAGE_FILE.fullmatch(name)
+            if match is not None:
+                self.threads.setdefault(f'{match.group(1)}/{match.group(2)}', []).append(info)
+
+        for infos in self.threads.values():
+            infos.sort(key=lambda info: int(MESSAGE_FILE.fullmatch(info.filename[len(self.prefix):]).group(4)))
+
+    def __getstate__(self):
+        # Opened ZIP file can not be sent to worker processes.
+        state = self.__dict__.copy()
+        state['zip'] = None
+        return state
+
+    @staticmethod
+    def name(parts) -> str:
+        return '/'.join(parts)
+
+    def isdir(self, *parts):
+        return self.name(parts) in self.directories and self.name(parts) not in self.entries
+
+    def isfile(self, *parts):
+        return self.name(parts) in self.entries
+
+    def listdir(self, *parts):
+        return sorted(self.directories.get(self.name(parts), ()))
+
+    def file_path(self, *parts):
+        return self.name(parts)
+
+    def thread_files(self, thread_dir):
+        files = []
+        for info in self.threads.get(thread_dir.replace(os.sep, '/'), ()):
+            mtime = datetime.datetime(*info.date_time).timestamp()
+            files.append(ArchiveFile(info.filename.rsplit('/', 1)[1], info.filename[len(self.prefix):],
+                                     info.file_size, int(mtime) * 1000000000))
+        return files
+
+    def open(self, file_path):
+        if self.zip is None:
+            self.zip = zipfile.ZipFile(self.zip_path)
+        return self.zip.open(self.entries[file_path])
+
+    def reopen(self):
+        self.zip = zipfile.ZipFile(self.zip_path)
+
+
+def open_archive(root_path: str) -> Archive:
+    """
+    Opens Facebook export on specified path, which can be either unzipped directory
+    or ZIP file.
+    """
+    if path.isfile(root_path) and zipfile.is_zipfile(root_path):
+        return ZipArchive(root_path)
+    return DirectoryArchive(root_path)
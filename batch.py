@@ -0,0 +1,286 @@
+"""
+Unattended processing of many Facebook exports. Exports are parsed and their statistics
+are computed by shared pool of worker processes, largest export first, so the pool is not
+left waiting for one large export at the end. Failure of one export does not affect the
+others.
+
+Usage:
+    python batch.py /path/to/exports [--output /path/to/results] [--workers 4] [--format json] [--cache]
+    python batch.py /path/to/manifest.json [...]
+
+Directory is searched for exports (unzipped directories and ZIP files). Manifest is JSON
+list of exports:
+
+    [{"path": "alice.zip", "name": "Alice Doe"}, {"path": "bob", "output": "bob-2019"}]
+
+`path` is relative to the manifest, optional `name` is used for exports without profile
+information (such exports are skipped as failed when no name is provided, nobody is asked)
+and optional `output` is the name of the directory with results (name of the export by default).
+
+Results of each export are written to its own directory (report, metrics, index of files
+which could not be parsed and log of the processing), summary of all exports with throughput to `batch-report.json`.
+Export whose worker process is killed (by OOM killer for example) is reported as failed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from os import path
+from time import perf_counter
+from typing import List, NamedTuple, Optional, Iterator
+
+from archive import open_archive
+from cache import default_cache_path
+from main import FacebookStatistics
+from output import FILE_EXTENSIONS
+
+ExportJob = NamedTuple('ExportJob', [('name', str), ('path', str), ('my_name', Optional[str]), ('size', int)])
+
+ExportResult = NamedTuple('ExportResult', [('name', str), ('path', str), ('ok', bool), ('error', Optional[str]),
+                                           ('bytes', int), ('conversations', int), ('messages', int),
+                                           ('files_with_errors', int), ('parse_seconds', float),
+                                           ('statistics_seconds', float), ('seconds', float)])
+
+
+def is_export(root_path: str) -> bool:
+    """
+    Returns whether specified path is Facebook export (directory or ZIP file with messages).
+    """
+    try:
+        return open_archive(root_path).isdir('messages')
+    except OSError:
+        return False
+
+
+def export_size(root_path: str) -> int:
+    """
+    Returns size of the export in bytes, which is used to order exports. Only message files
+    are counted for unzipped exports.
+    """
+    if path.isfile(root_path):
+        return path.getsize(root_path)
+
+    archive = open_archive(root_path)
+    return sum(thread_file.size
+               for subfolder in archive.listdir('messages') if archive.isdir('messages', subfolder)
+               for thread in archive.listdir('messages', subfolder)
+               for thread_file in archive.thread_files(path.join(subfolder, thread)))
+
+
+def load_manifest(manifest_path: str) -> List[dict]:
+    """
+    Loads exports listed in manifest, their paths are resolved relative to the manifest.
+    """
+    with open(manifest_path, encoding='utf-8') as f:
+        exports = json.load(f)
+
+    manifest_directory = path.dirname(path.abspath(manifest_path))
+    for export in exports:
+        if 'path' not in export:
+            raise ValueError(f'Export without path in manifest {manifest_path}: {export}')
+        export['path'] = path.join(manifest_directory, export['path'])
+    return exports
+
+
+def find_exports(directory: str) -> List[dict]:
+    return [{'path': path.join(directory, name)} for name in sorted(os.listdir(directory))
+            if is_export(path.join(directory, name))]
+
+
+def create_jobs(source: str) -> List[ExportJob]:
+    """
+    Creates jobs for exports in specified directory or manifest, ordered from the largest
+    export.
+    """
+    exports = find_exports(source) if path.isdir(source) else load_manifest(source)
+
+    jobs = []
+    names = set()
+    for export in exports:
+        name = export.get('output') or path.splitext(path.basename(path.normpath(export['path'])))[0]
+        while name in names:
+            name += '_'
+        names.add(name)
+
+        size = export_size(export['path']) if is_export(export['path']) else 0
+        jobs.append(ExportJob(name, export['path'], export.get('name'), size))
+
+    return sorted(jobs, key=lambda job: -job.size)
+
+
+def process_export(task) -> ExportResult:
+    """
+    Parses one export and writes its report, metrics, index of errors and log to its own
+    directory. Runs in worker process, all exceptions are returned in the result.
+    """
+    job, output_directory, output_format, use_cache = task
+    export_directory = path.join(output_directory, job.name)
+    os.makedirs(export_directory, exist_ok=True)
+
+    time_start = perf_counter()
+    conversations = messages = files_with_errors = 0
+    parse_seconds = statistics_seconds = 0.0
+    error = None
+
+    with open(path.join(export_directory, 'messenger-stats.log'), mode='w', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log):
+        try:
+            if not is_export(job.path):
+                raise ValueError(f'{job.path} does not contain sub-folder messages!')
+            if job.my_name is None and not open_archive(job.path).isdir('profile_information'):
+                raise ValueError(f'{job.path} does not contain profile information and no name was provided!')
+
+            stats = FacebookStatistics(job.path, my_name=job.my_name,
+                                       cache_path=default_cache_path(job.path) if use_cache else None,
+                                       metrics_path=path.join(export_directory, 'messenger-stats-metrics.json'),
+                                       errors_path=path.join(export_directory, 'messenger-stats-errors.jsonl'))
+            stats.parse_all_messages()
+            parse_seconds = perf_counter() - time_start
+            conversations = len(stats.conversations)
+            messages = stats.instrumentation.stage_metrics('parse_all').messages
+            files_with_errors = len(stats.errors)
+
+            report = stats.compute_stats(stats.conversations, per_conversation=lambda c: len(c) >= 100)
+            report_path = path.join(export_directory, 'messenger-stats-report.' +
+                                    FILE_EXTENSIONS.get(output_format, output_format))
+            with open(report_path, mode='w', encoding='utf-8', newline='') as f:
+                stats.write_report(report, output_format, f)
+            statistics_seconds = perf_counter() - time_start - parse_seconds
+
+            stats.dump_metrics()
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+
+    return ExportResult(job.name, job.path, error is None, error, job.size, conversations, messages,
+                        files_with_errors, parse_seconds, statistics_seconds, perf_counter() - time_start)
+
+
+def crashed_export(job: ExportJob, output_directory: str, seconds: float) -> ExportResult:
+    """
+    Returns result of export whose worker process was terminated, the error is appended
+    to log of the export.
+    """
+    error = 'Worker process processing the export was terminated abruptly (out of memory?).'
+    export_directory = path.join(output_directory, job.name)
+    os.makedirs(export_directory, exist_ok=True)
+    with open(path.join(export_directory, 'messenger-stats.log'), mode='a', encoding='utf-8') as log:
+        print(error, file=log)
+    return ExportResult(job.name, job.path, False, error, job.size, 0, 0, 0, 0.0, 0.0, seconds)
+
+
+def process_exports(tasks: List[tuple], workers: int) -> Iterator[ExportResult]:
+    """
+    Processes exports by pool of worker processes and yields their results in the order
+    in which they are finished. At most `workers` exports are submitted at once, so when
+    worker process dies, only exports which were being processed are affected. These are
+    then processed again one by one, so only the export which kills its worker fails.
+    """
+    pending = list(tasks)
+    while pending:
+        suspects = []
+        # Each worker process handles one export only, so memory of large exports is returned
+        # to the system as soon as they are processed.
+        with ProcessPoolExecutor(workers, max_tasks_per_child=1) as executor:
+            running = {}
+            try:
+                while pending or running:
+                    while pending and len(running) < workers:
+                        task = pending.pop(0)
+                        running[executor.submit(process_export, task)] = (task, perf_counter())
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        del running[future]
+                        yield result
+            except BrokenProcessPool:
+                for future, (task, time_start) in running.items():
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        suspects.append((task, time_start))
+                    else:
+                        yield future.result()
+
+        for task, time_start in suspects:
+            with ProcessPoolExecutor(1) as executor:
+                try:
+                    yield executor.submit(process_export, task).result()
+                except BrokenProcessPool:
+                    job, output_directory = task[:2]
+                    yield crashed_export(job, output_directory, perf_counter() - time_start)
+
+
+def run_batch(jobs: List[ExportJob], output_directory: str, output_format: str = 'json', workers: int = None,
+              use_cache: bool = False) -> dict:
+    """
+    Processes specified exports by pool of worker processes and writes summary of all exports
+    to `batch-report.json` in the output directory.
+
+    :param jobs: exports to process (in the order in which they are scheduled)
+    :param output_directory: directory for results of the exports
+    :param output_format: format of the reports (text, json, csv or html)
+    :param workers: number of worker processes (number of CPUs by default)
+    :param use_cache: whether parsed threads should be cached next to the exports
+    :return: summary of the batch
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+
+    time_start = perf_counter()
+    results: List[ExportResult] = []
+    tasks = [(job, output_directory, output_format, use_cache) for job in jobs]
+    for result in process_exports(tasks, workers):
+        results.append(result)
+        status = 'OK' if result.ok else 'FAILED'
+        print(f'({len(results)}/{len(jobs)}) {status} {result.name}: {result.messages} messages ' +
+              f'in {round(result.seconds, 3)} seconds, {result.files_with_errors} files with errors')
+    seconds = perf_counter() - time_start
+
+    succeeded = [result for result in results if result.ok]
+    total_bytes = sum(result.bytes for result in succeeded)
+    total_messages = sum(result.messages for result in succeeded)
+    busy_seconds = sum(result.seconds for result in results)
+
+    summary = {
+        'exports': len(results),
+        'succeeded': len(succeeded),
+        'failed': [result.name for result in results if not result.ok],
+        'workers': workers,
+        'seconds': round(seconds, 6),
+        'bytes': total_bytes,
+        'messages': total_messages,
+        'files_with_errors': sum(result.files_with_errors for result in results),
+        'megabytes_per_second': round(total_bytes / (1 << 20) / seconds, 2) if seconds else None,
+        'messages_per_second': round(total_messages / seconds) if seconds else None,
+        # Share of time the workers were busy, low utilization means badly balanced pool.
+        'utilization': round(busy_seconds / (seconds * workers), 3) if seconds else None,
+        'results': [result._asdict() for result in results],
+    }
+
+    with open(path.join(output_directory, 'batch-report.json'), mode='w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Statistics of many Facebook exports.')
+    parser.add_argument('source', help='directory with exports or JSON manifest of exports')
+    parser.add_argument('--output', default='messenger-stats-results', help='directory for results')
+    parser.add_argument('--format', default='json', choices=['text', 'json', 'csv', 'html'],
+                        help='format of the reports')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--cache', action='store_true',
+                        help='cache parsed threads next to the exports (interrupted runs resume from the cache)')
+    args = parser.parse_args()
+
+    batch_jobs = create_jobs(args.source)
+    print(f'Processing {len(batch_jobs)} exports...')
+    batch = run_batch(batch_jobs, args.output, args.format, args.workers, args.cache)
+
+    print(f'Processed {batch["succeeded"]} of {batch["exports"]} exports ({batch["messages"]} messages) ' +
+          f'in {round(batch["seconds"], 3)} seconds, {batch["messages_per_second"]} messages per second.')
+    for failed in batch['failed']:
+        print(f'Failed: {failed} (see {path.join(args.output, failed, "messenger-stats.log")})')
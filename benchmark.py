@@ -0,0 +1,236 @@
+"""
+Benchmarks of performance critical parts of the script.
+
+Usage:
+    ./benchmark.py workers /path/to/unzipped/archive [--workers 1 2 4 8] [--repeat 3]
+    ./benchmark.py decode [/path/to/message_1.json] [--size-mb 16] [--repeat 3]
+    ./benchmark.py generate /path/to/output [--threads 100] [--messages 1000] [--group-ratio 0.1]
+    ./benchmark.py suite [--threads 100] [--messages 1000] [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter
+
+import statistics
+from ingest import decode_facebook_json
+from main import FacebookStatistics
+from synthetic import SyntheticExport, mojibake
+
+
+def quiet():
+    """
+    Returns context manager which suppresses standard output of the script.
+    """
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    Runs specified function `repeat` times and returns shortest duration in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        time_start = perf_counter()
+        func()
+        durations.append(perf_counter() - time_start)
+    return min(durations)
+
+
+def benchmark_workers(root_path: str, workers: list, repeat: int) -> None:
+    """
+    Measures how parsing of all messages scales with number of worker processes.
+    """
+    results = []
+    for worker_count in workers:
+        def parse():
+            with quiet():
+                stats = FacebookStatistics(root_path, workers=worker_count)
+                stats.parse_all_messages()
+
+        results.append((worker_count, best_time(parse, repeat)))
+
+    baseline = results[0][1]
+    print('Workers\tSeconds\tSpeedup')
+    for worker_count, duration in results:
+        print(f'{worker_count}\t{round(duration, 3)}\t{round(baseline / duration, 2)}x')
+
+
+def legacy_decode_facebook_json(data: bytes) -> str:
+    """
+    Original implementation of fixing Facebook JSON files, used as baseline.
+    """
+    decoded = data.decode('raw_unicode_escape').encode('raw_unicode_escape').decode()
+    for i in range(32):
+        decoded = decoded.replace(chr(i), '')
+    return decoded
+
+
+def synthetic_facebook_json(size: int) -> bytes:
+    """
+    Generates JSON document of approximately specified size (in bytes) encoded the
+    same way Facebook export tool encodes its files.
+    """
+    message = {'sender_name': mojibake('Jožo Čierny'), 'timestamp_ms': 1546300800000,
+               'content': mojibake('Ahoj, ako sa máš? 😀 Vidíme sa zajtra.'), 'type': 'Generic'}
+    encoded = json.dumps(message, indent=2).encode() + b',\n'
+    return b'{"messages": [' + encoded * (size // len(encoded)) + b'{}]}'
+
+
+def benchmark_decode(file_path: str, size_mb: int, repeat: int) -> None:
+    """
+    Compares speed of fixing of Facebook JSON files by current and original implementation.
+    """
+    if file_path is None:
+        data = synthetic_facebook_json(size_mb << 20)
+    else:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+
+    if legacy_decode_facebook_json(data) != decode_facebook_json(data):
+        print('Warning: Implementations produced different output!')
+
+    legacy = best_time(lambda: legacy_decode_facebook_json(data), repeat)
+    current = best_time(lambda: decode_facebook_json(data), repeat)
+
+    megabytes = len(data) / (1 << 20)
+    print('Implementation\tSeconds\tMB/s')
+    print(f'original\t{round(legacy, 3)}\t{round(megabytes / legacy, 1)}')
+    print(f'current\t{round(current, 3)}\t{round(megabytes / current, 1)}')
+    print(f'Speedup: {round(legacy / current, 2)}x')
+
+
+def benchmark_suite(root_path: str, repeat: int, workers: int) -> dict:
+    """
+    Measures duration of parsing of the export and of computing each statistic separately
+    as well as all statistics at once.
+
+    :return: dictionary of durations (in seconds) of individual benchmarks
+    """
+    timings = {}
+
+    def parse():
+        with quiet():
+            parsed = FacebookStatistics(root_path, workers=workers)
+            parsed.parse_all_messages()
+        return parsed
+
+    timings['parse'] = best_time(parse, repeat)
+
+    stats = parse()
+
+    with tempfile.TemporaryDirectory() as packed_directory:
+        packed_path = os.path.join(packed_directory, 'conversations.bin')
+        stats.write_packed(packed_path)
+        with quiet():
+            loaded = FacebookStatistics(root_path)
+            timings['load.packed'] = best_time(lambda: loaded.load_packed(packed_path), repeat)
+
+    for statistic in statistics.ALL_STATISTICS:
+        engine = statistics.StatisticsEngine(stats.my_name, statistics=[statistic])
+        timings[f'statistics.{statistic.__name__}'] = best_time(lambda: engine.run(stats.conversations), repeat)
+
+    engine = statistics.StatisticsEngine(stats.my_name)
+    timings['statistics.all'] = best_time(lambda: engine.run(stats.conversations), repeat)
+
+    return timings
+
+
+def compare_with_baseline(timings: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Prints comparison of timings with baseline timings.
+
+    :param tolerance: allowed relative slowdown (0.2 means 20 %)
+    :return: True if no benchmark is slower than the baseline by more than tolerance
+    """
+    ok = True
+    print('Benchmark\tBaseline\tCurrent\tRatio')
+    for name, duration in timings.items():
+        if name not in baseline:
+            print(f'{name}\t-\t{round(duration, 4)}\t-')
+            continue
+
+        ratio = duration / baseline[name] if baseline[name] > 0 else 1
+        regression = ratio > 1 + tolerance
+        ok = ok and not regression
+        print(f'{name}\t{round(baseline[name], 4)}\t{round(duration, 4)}\t{round(ratio, 2)}x' +
+              ('\tREGRESSION' if regression else ''))
+    return ok
+
+
+def run_suite(args) -> bool:
+    config = {'threads': args.threads, 'messages': args.messages, 'group_ratio': args.group_ratio,
+              'seed': args.seed, 'workers': args.workers}
+
+    with tempfile.TemporaryDirectory() as root_path:
+        SyntheticExport(args.threads, args.messages, args.group_ratio, seed=args.seed).write(root_path)
+        timings = benchmark_suite(root_path, args.repeat, args.workers)
+
+    results = {'config': config, 'python': platform.python_version(), 'timings': timings}
+    if args.output is not None:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is None:
+        print('Benchmark\tSeconds')
+        for name, duration in timings.items():
+            print(f'{name}\t{round(duration, 4)}')
+        return True
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['config'] != config:
+        print('Warning: Baseline was measured with different configuration!')
+    return compare_with_baseline(timings, baseline['timings'], args.tolerance)
+
+
+def add_export_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--threads', type=int, default=100, help='number of threads')
+    parser.add_argument('--messages', type=int, default=1000, help='average number of messages in thread')
+    parser.add_argument('--group-ratio', type=float, default=0.1, help='ratio of group chats')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of messenger-stats.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    workers_parser = commands.add_parser('workers', help='scaling of parallel parsing with number of workers')
+    workers_parser.add_argument('root_path', help='path to unzipped Facebook export directory')
+    workers_parser.add_argument('--workers', type=int, nargs='+',
+                                default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    workers_parser.add_argument('--repeat', type=int, default=3)
+
+    decode_parser = commands.add_parser('decode', help='speed of fixing encoding of Facebook JSON files')
+    decode_parser.add_argument('file_path', nargs='?', help='JSON file to decode (synthetic data by default)')
+    decode_parser.add_argument('--size-mb', type=int, default=16, help='size of synthetic data')
+    decode_parser.add_argument('--repeat', type=int, default=3)
+
+    generate_parser = commands.add_parser('generate', help='generate synthetic Facebook export')
+    generate_parser.add_argument('root_path', help='directory to write the export to')
+    add_export_arguments(generate_parser)
+
+    suite_parser = commands.add_parser('suite', help='benchmark parsing and statistics on synthetic export')
+    add_export_arguments(suite_parser)
+    suite_parser.add_argument('--repeat', type=int, default=3)
+    suite_parser.add_argument('--workers', type=int, default=1)
+    suite_parser.add_argument('--output', help='file to save results to (JSON)')
+    suite_parser.add_argument('--baseline', help='previously saved results to compare with')
+    suite_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+
+    args = parser.parse_args()
+
+    if args.command == 'workers':
+        benchmark_workers(args.root_path, args.workers, args.repeat)
+    elif args.command == 'decode':
+        benchmark_decode(args.file_path, args.size_mb, args.repeat)
+    elif args.command == 'generate':
+        SyntheticExport(args.threads, args.messages, args.group_ratio, seed=args.seed).write(args.root_path)
+    elif args.command == 'suite':
+        if not run_suite(args):
+            sys.exit(1)
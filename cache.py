@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+from os import path
+from typing import Dict, Optional, List, Tuple
+
+import numpy as np
+
+from archive import Archive
+from columnar import ColumnarConversation
+from ingest import ParseError
+
+# Version of cached data. Should be increased whenever format of cached conversations
+# or parsing of conversations changes, so old results are not reused.
+CACHE_VERSION = 2
+
+
+class ConversationCache:
+    """
+    Persistent cache of parsed conversations stored in SQLite database.
+
+    Each thread is stored together with its signature computed from names, sizes and
+    modification times (and optionally content hashes) of its files. When the signature
+    of the thread on disk matches the stored one, the thread can be loaded from the
+    cache instead of being parsed again.
+
+    Each thread is committed as soon as it is stored, so the cache also serves as checkpoint
+    of interrupted run. Errors of files of the thread (see `ParseError`) are stored with the
+    thread, threads which could not be parsed at all are stored only with their errors, so
+    they are not parsed again until they change.
+    """
+
+    def __init__(self, cache_path: str, settings: str = '', hash_files: bool = False):
+        """
+        :param cache_path: path to the SQLite database file
+        :param settings: description of settings which affect parsing results (threads parsed
+                         with different settings are not reused)
+        :param hash_files: whether content hashes of files should be part of the signature
+        """
+        self.cache_path = cache_path
+        self.settings = settings
+        self.hash_files = hash_files
+
+        self.db = sqlite3.connect(cache_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_dir TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                name TEXT,
+                participants TEXT NOT NULL,
+                senders TEXT NOT NULL,
+                timestamps BLOB NOT NULL,
+                sender_ids BLOB NOT NULL,
+                lengths BLOB NOT NULL,
+                offsets BLOB NOT NULL,
+                text BLOB NOT NULL
+            )''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS errors (
+                thread_dir TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                errors TEXT NOT NULL
+            )''')
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def signature(self, archive: Archive, thread_dir: str) -> str:
+        """
+        Computes signature of thread stored in specified directory of the archive.
+        """
+        files = []
+        for thread_file in archive.thread_files(thread_dir):
+            file = [thread_file.name, thread_file.size, thread_file.mtime_ns]
+            if self.hash_files:
+                with archive.open(thread_file.path) as f:
+                    file.append(hashlib.sha1(f.read()).hexdigest())
+            files.append(file)
+
+        return json.dumps([CACHE_VERSION, self.settings, sorted(files)])
+
+    def signatures(self) -> Dict[str, str]:
+        """
+        Returns signatures of all cached threads.
+        """
+        return dict(self.db.execute('SELECT thread_dir, signature FROM threads'))
+
+    def errors(self) -> Dict[str, Tuple[str, List[ParseError]]]:
+        """
+        Returns signatures and errors of all threads whose files had errors when they were parsed.
+        """
+        rows = self.db.execute('SELECT thread_dir, signature, errors FROM errors')
+        return {thread_dir: (signature, [ParseError(*error) for error in json.loads(errors)])
+                for thread_dir, signature, errors in rows}
+
+    def load(self, thread_dir: str) -> Optional[ColumnarConversation]:
+        row = self.db.execute('SELECT name, participants, senders, timestamps, sender_ids, lengths, offsets, text '
+                              'FROM threads WHERE thread_dir = ?', (thread_dir,)).fetchone()
+        if row is None:
+            return None
+
+        name, participants, senders, timestamps, sender_ids, lengths, offsets, text = row
+        return ColumnarConversation(name, json.loads(participants), json.loads(senders),
+                                    np.frombuffer(timestamps, dtype=np.int64),
+                                    np.frombuffer(sender_ids, dtype=np.int16),
+                                    np.frombuffer(lengths, dtype=np.int32),
+                                    text,
+                                    np.frombuffer(offsets, dtype=np.int64),
+                                    thread_id=thread_dir)
+
+    def store(self, thread_dir: str, signature: str, conversation: Optional[ColumnarConversation],
+              errors: List[ParseError] = ()) -> None:
+        """
+        Stores parsed thread together with errors of its files (conversation is None when
+        the thread could not be parsed at all).
+        """
+        self.db.execute('DELETE FROM errors WHERE thread_dir = ?', (thread_dir,))
+        if errors:
+            self.db.execute('INSERT INTO errors VALUES (?, ?, ?)',
+                            (thread_dir, signature, json.dumps([list(error) for error in errors], ensure_ascii=False)))
+
+        if conversation is None:
+            self.db.commit()
+            return
+
+        self.db.execute('INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            thread_dir,
+            signature,
+            conversation.name,
+            json.dumps(conversation.participants),
+            json.dumps(conversation.senders),
+            conversation.timestamps.astype(np.int64).tobytes(),
+            conversation.sender_ids.astype(np.int16).tobytes(),
+            conversation.lengths.astype(np.int32).tobytes(),
+            conversation.offsets.astype(np.int64).tobytes(),
+            conversation.text
+        ))
+        self.db.commit()
+
+
+def default_cache_path(root_path: str) -> str:
+    """
+    Returns default location of the cache for export stored in specified directory
+    (or next to specified ZIP file).
+    """
+    if path.isfile(root_path):
+        return path.splitext(root_path)[0] + '-messenger-stats-cache.sqlite'
+    return path.join(root_path, 'messenger-stats-cache.sqlite')
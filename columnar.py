@@ -0,0 +1,224 @@
+import datetime
+from array import array
+from typing import List, Iterable, Tuple
+
+import numpy as np
+
+from custom_types import Message, Participants
+from people import PeopleRegistry
+
+# Type of raw message as produced by parser: (sender, text, timestamp in milliseconds).
+RawMessage = Tuple[str, str, int]
+
+
+class ColumnarConversation:
+    """
+    Conversation stored in columnar form. Instead of list of message tuples, each
+    property of messages is stored in its own numpy array, which is both more compact
+    and allows statistics to be computed by vectorized operations.
+
+    Messages are always ordered by time of creation (oldest first).
+
+    - `timestamps` - int64 array of message creation times (milliseconds since epoch)
+    - `sender_ids` - int16 array of indices into `senders` list
+    - `lengths` - int32 array of text lengths (in characters)
+    - `text` - UTF-8 encoded texts of all messages in one contiguous buffer (bytes
+               or memory view of a mapped file, see `PackedConversations`)
+    - `offsets` - int64 array of n + 1 byte offsets, text of i-th message is stored
+                  in `text[offsets[i]:offsets[i + 1]]` (first offset is not zero when
+                  conversation is a slice of other conversation)
+
+    Sender ids are local to the conversation. When the conversation is bound to registry
+    of people of the whole archive (see `bind`), `person_ids` maps sender ids to ids
+    of people in the registry and `participant_ids` contains ids of participants.
+
+    Names of conversations are not unique (threads with the same people usually have the same
+    name), threads are identified by `thread_id` - directory of the thread relative to messages
+    folder (inbox/AdamSulko_3c954401d0 for example) or None when it is not known. Statistics
+    and snapshots keep conversations under their `key`.
+    """
+
+    __slots__ = ('name', 'participants', 'senders', 'timestamps', 'sender_ids', 'lengths', 'text', 'offsets',
+                 'person_ids', 'participant_ids', 'thread_id')
+
+    def __init__(self, name: str, participants: Participants, senders: List[str], timestamps: np.ndarray,
+                 sender_ids: np.ndarray, lengths: np.ndarray, text: bytes, offsets: np.ndarray,
+                 person_ids: np.ndarray = None, participant_ids: np.ndarray = None, thread_id: str = None):
+        self.name = name
+        self.participants = participants
+        self.senders = senders
+        self.timestamps = timestamps
+        self.sender_ids = sender_ids
+        self.lengths = lengths
+        self.text = text
+        self.offsets = offsets
+        self.person_ids = person_ids
+        self.participant_ids = participant_ids
+        self.thread_id = thread_id
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def key(self) -> str:
+        """
+        Key identifying the conversation: directory of its thread, or its name when the thread
+        is not known.
+        """
+        return self.name if self.thread_id is None else self.thread_id
+
+    def __getstate__(self):
+        # Memory views (of mapped files) can not be pickled, so their texts are copied
+        # when the conversation is sent to other process.
+        state = {name: getattr(self, name) for name in self.__slots__}
+        if isinstance(self.text, memoryview):
+            state['text'] = self.text.tobytes()
+        return None, state
+
+    def sender_id(self, sender: str) -> int:
+        """
+        Returns id of specified sender in this conversation or -1 if the sender has
+        not sent any message to this conversation.
+        """
+        try:
+            return self.senders.index(sender)
+        except ValueError:
+            return -1
+
+    def bind(self, people: PeopleRegistry) -> None:
+        """
+        Interns senders and participants of this conversation in specified registry of people.
+        """
+        self.person_ids = people.intern_all(self.senders)
+        self.participant_ids = people.intern_all(self.participants)
+
+    def text_at(self, index: int) -> str:
+        return str(self.text[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def texts(self, indices: Iterable[int] = None) -> List[str]:
+        """
+        Decodes texts of messages at specified indices (all messages by default).
+        """
+        text = self.text
+        offsets = self.offsets.tolist()
+        if indices is None:
+            indices = range(len(self))
+        return [str(text[offsets[i]:offsets[i + 1]], 'utf-8') for i in indices]
+
+    def slice(self, start: int, stop: int) -> 'ColumnarConversation':
+        """
+        Returns conversation with messages at indices from `start` to `stop` (exclusive).
+        Returned conversation shares arrays and text buffer with this conversation.
+        """
+        return ColumnarConversation(self.name, self.participants, self.senders, self.timestamps[start:stop],
+                                    self.sender_ids[start:stop], self.lengths[start:stop], self.text,
+                                    self.offsets[start:stop + 1], self.person_ids, self.participant_ids,
+                                    self.thread_id)
+
+    def select(self, indices: np.ndarray) -> 'ColumnarConversation':
+        """
+        Returns conversation with copies of messages at specified (sorted) indices.
+        """
+        starts = self.offsets[indices]
+        ends = self.offsets[indices + 1]
+
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+
+        text = memoryview(self.text)
+        text = b''.join([text[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+
+        return ColumnarConversation(self.name, self.participants, self.senders, self.timestamps[indices],
+                                    self.sender_ids[indices], self.lengths[indices], text, offsets,
+                                    self.person_ids, self.participant_ids, self.thread_id)
+
+    @property
+    def messages(self) -> List[Message]:
+        """
+        Materializes messages of this conversation as list of `Message` tuples.
+        """
+        senders = self.senders
+        return [Message(senders[sender_id], text, datetime.datetime.fromtimestamp(timestamp / 1000))
+                for sender_id, text, timestamp in zip(self.sender_ids.tolist(), self.texts(),
+                                                      self.timestamps.tolist())]
+
+
+class ColumnarBuilder:
+    """
+    Collects raw messages of one conversation (possibly from multiple files) and
+    builds `ColumnarConversation` from them. Messages are expected to be appended
+    in the order in which they are stored in Facebook export files (newest first).
+
+    Messages are collected directly into compact arrays, so the memory used by the
+    builder is proportional to size of the resulting columnar conversation.
+    """
+
+    def __init__(self):
+        self.senders: List[str] = []
+        self._sender_ids = {}
+
+        self.timestamps = array('q')
+        self.sender_ids = array('h')
+        self.lengths = array('i')
+        self.text = bytearray()
+        self.offsets = array('q', [0])
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def intern(self, sender: str) -> int:
+        sender_id = self._sender_ids.get(sender)
+        if sender_id is None:
+            sender_id = self._sender_ids[sender] = len(self.senders)
+            self.senders.append(sender)
+        return sender_id
+
+    def append(self, sender: str, text: str, timestamp: int) -> None:
+        if text is None:
+            text = ''
+        self.timestamps.append(timestamp)
+        self.sender_ids.append(self.intern(sender))
+        self.lengths.append(len(text))
+        self.text += text.encode()
+        self.offsets.append(len(self.text))
+
+    def extend(self, messages: Iterable[RawMessage]) -> None:
+        for sender, text, timestamp in messages:
+            self.append(sender, text, timestamp)
+
+    def truncate(self, count: int) -> None:
+        """
+        Removes all messages appended after first `count` messages (for example
+        messages of file which turned out to be invalid).
+        """
+        del self.timestamps[count:]
+        del self.sender_ids[count:]
+        del self.lengths[count:]
+        del self.text[self.offsets[count]:]
+        del self.offsets[count + 1:]
+
+    def build(self, name: str, participants: Participants, thread_id: str = None) -> ColumnarConversation:
+        count = len(self)
+        timestamps = np.frombuffer(self.timestamps, dtype=np.int64)
+
+        # Messages may come from multiple files in arbitrary order, so we sort
+        # them by time. Messages in files are stored newest first, so we sort them
+        # in reversed order to keep messages sent at the same time in correct order.
+        order = count - 1 - np.argsort(timestamps[::-1], kind='stable')
+
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        sorted_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.diff(offsets)[order], out=sorted_offsets[1:])
+
+        text = memoryview(self.text)
+        offsets = offsets.tolist()
+        sorted_text = b''.join([text[offsets[i]:offsets[i + 1]] for i in order.tolist()])
+
+        return ColumnarConversation(name, participants, self.senders,
+                                    timestamps[order],
+                                    np.frombuffer(self.sender_ids, dtype=np.int16)[order],
+                                    np.frombuffer(self.lengths, dtype=np.int32)[order],
+                                    sorted_text,
+                                    sorted_offsets,
+                                    thread_id=thread_id)
+
@@ -0,0 +1,306 @@
+import sqlite3
+from typing import Dict, List
+
+import numpy as np
+
+from columnar import ColumnarConversation
+from statistics import Report, Accumulator, GeneralStats, TopConversationsByChars, TopConversationsByMessages, \
+    ConversationPeopleVariability, HourlyHistogram, YearlyHistogram, DayInWeekHistogram, MessagesLengths, \
+    MsgsBeforeReply, TimeBeforeReply, WhoStartedConv
+from timezones import utc_offsets
+
+# Number of messages inserted by one `executemany` call.
+BATCH_SIZE = 10000
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+
+class MessageDatabase:
+    """
+    SQLite database of parsed messages. Database can be queried directly by analysts
+    or used to compute statistics by SQL aggregations (see `SqlStatistics`), so
+    messages do not have to be held in memory.
+
+    Tables:
+
+    - `people(id, name)` - all senders and participants
+    - `conversations(id, name, thread_id, is_group)` - thread_id is directory of the thread
+      (NULL when it is not known)
+    - `participants(conversation_id, person_id)`
+    - `messages(id, conversation_id, sender_id, timestamp, length, text)` - messages
+      of each conversation ordered by time, timestamp is in milliseconds since epoch
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self.db = sqlite3.connect(database_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.people: Dict[str, int] = {}
+
+    def close(self) -> None:
+        self.db.close()
+
+    def reset(self) -> None:
+        """
+        Drops all data and creates empty tables. Indexes are created after the messages
+        are loaded (see `create_indexes`), which is much faster than updating them
+        with each inserted message.
+        """
+        with self.db:
+            self.db.executescript('''
+                DROP TABLE IF EXISTS messages;
+                DROP TABLE IF EXISTS participants;
+                DROP TABLE IF EXISTS conversations;
+                DROP TABLE IF EXISTS people;
+
+                CREATE TABLE people (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE conversations (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    thread_id TEXT,
+                    is_group INTEGER NOT NULL
+                );
+                CREATE TABLE participants (
+                    conversation_id INTEGER NOT NULL,
+                    person_id INTEGER NOT NULL,
+                    PRIMARY KEY (conversation_id, person_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE messages (
+                    id INTEGER PRIMARY KEY,
+                    conversation_id INTEGER NOT NULL,
+                    sender_id INTEGER NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                );''')
+        self.people = {}
+
+    def create_indexes(self) -> None:
+        with self.db:
+            # Index on conversation also orders messages of each conversation by id
+            # (which is their order in time), so window functions do not need to sort.
+            self.db.execute('CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender_id)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)')
+            self.db.execute('ANALYZE')
+
+    def person_id(self, name: str, create: bool = True) -> int:
+        """
+        Returns id of person with specified name (-1 if the person is not in the database
+        and `create` is False).
+        """
+        person_id = self.people.get(name)
+        if person_id is not None:
+            return person_id
+
+        row = self.db.execute('SELECT id FROM people WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            if not create:
+                return -1
+            person_id = self.db.execute('INSERT INTO people (name) VALUES (?)', (name,)).lastrowid
+        else:
+            person_id = row[0]
+
+        self.people[name] = person_id
+        return person_id
+
+    def add_conversation(self, conversation: ColumnarConversation) -> None:
+        """
+        Inserts conversation with all its messages in one transaction.
+        """
+        with self.db:
+            conversation_id = self.db.execute(
+                'INSERT INTO conversations (name, thread_id, is_group) VALUES (?, ?, ?)',
+                (conversation.name, conversation.thread_id, len(conversation.participants) > 2)).lastrowid
+
+            self.db.executemany('INSERT OR IGNORE INTO participants (conversation_id, person_id) VALUES (?, ?)',
+                                [(conversation_id, self.person_id(participant))
+                                 for participant in conversation.participants])
+
+            # Senders of the conversation are mapped to ids of people.
+            people = np.array([self.person_id(sender) for sender in conversation.senders] or [0], dtype=np.int64)
+            sender_ids = people[conversation.sender_ids].tolist()
+            timestamps = conversation.timestamps.tolist()
+            lengths = conversation.lengths.tolist()
+
+            for start in range(0, len(conversation), BATCH_SIZE):
+                stop = min(start + BATCH_SIZE, len(conversation))
+                texts = conversation.texts(range(start, stop))
+                self.db.executemany('INSERT INTO messages (conversation_id, sender_id, timestamp, length, text) '
+                                    'VALUES (?, ?, ?, ?, ?)',
+                                    zip([conversation_id] * (stop - start), sender_ids[start:stop],
+                                        timestamps[start:stop], lengths[start:stop], texts))
+
+
+class SqlStatistics:
+    """
+    Computes statistics by SQL aggregations over `MessageDatabase`. Aggregated values
+    are filled into accumulators of the statistics, so the results are the same as
+    the results computed in memory by `StatisticsEngine` and can be written by any
+    output backend.
+
+    Most used words are not supported, as messages can not be split to words by SQL.
+    """
+
+    def __init__(self, database: MessageDatabase, self_name: str, exhaustive_lists: bool = False,
+                 timezone: str = None, **options):
+        """
+        :param database: database of messages
+        :param self_name: name of the person which should be considered as "myself"
+        :param exhaustive_lists: whether the lists should include all items
+        :param timezone: name of time zone used for histograms (local time zone by default)
+        :param options: options of individual statistics
+        """
+        self.db = database.db
+        self.self_name = self_name
+        self.exhaustive_lists = exhaustive_lists
+        self.options = options
+        self.me = database.person_id(self_name, create=False)
+
+        # Table of UTC offsets is used to compute local time of messages by SQL. Each
+        # interval of the same offset is joined with messages by the timestamp index.
+        offsets = utc_offsets(timezone)
+        starts = offsets.transitions.tolist()
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS utc_offsets (start_ms INTEGER, end_ms INTEGER, '
+                        'utc_offset INTEGER)')
+        self.db.execute('DELETE FROM utc_offsets')
+        self.db.executemany('INSERT INTO utc_offsets VALUES (?, ?, ?)',
+                            zip(starts, starts[1:] + [INT64_MAX], offsets.offsets.tolist()))
+
+    def query(self, sql: str) -> List[tuple]:
+        return self.db.execute(sql, {'me': self.me}).fetchall()
+
+    def local_histogram(self, expression: str) -> List[tuple]:
+        """
+        Counts messages by specified expression of their local time (`local` column in
+        milliseconds since epoch).
+        """
+        return self.query(f'''
+            SELECT {expression} AS bin, COUNT(*)
+            FROM (SELECT m.timestamp + o.utc_offset AS local
+                  FROM utc_offsets o JOIN messages m ON m.timestamp >= o.start_ms AND m.timestamp < o.end_ms)
+            GROUP BY bin''')
+
+    def general_stats(self, accumulator: GeneralStats) -> None:
+        (accumulator.message_count, accumulator.my_messages, accumulator.characters_count,
+         accumulator.my_characters) = self.query('''
+            SELECT COUNT(*), COALESCE(SUM(sender_id = :me), 0), COALESCE(SUM(length), 0),
+                   COALESCE(SUM(CASE WHEN sender_id = :me THEN length ELSE 0 END), 0)
+            FROM messages''')[0]
+        accumulator.conversation_count = self.query('SELECT COUNT(*) FROM conversations')[0][0]
+        accumulator.unique_people = {accumulator.people.intern(name) for name, in self.query('''
+            SELECT DISTINCT p.name FROM participants JOIN people p ON p.id = person_id''')}
+
+    def conversation_counts(self, accumulator) -> None:
+        by_characters = isinstance(accumulator, TopConversationsByChars)
+        rows = self.query('''
+            SELECT c.name, COALESCE(c.thread_id, c.name), COUNT(m.id), COALESCE(SUM(m.sender_id = :me), 0),
+                   COALESCE(SUM(m.length), 0), COALESCE(SUM(CASE WHEN m.sender_id = :me THEN m.length ELSE 0 END), 0)
+            FROM conversations c LEFT JOIN messages m ON m.conversation_id = c.id
+            GROUP BY c.id''')
+
+        # Conversations are keyed the same way as by `ConversationCounts.update`.
+        for name, key, messages, my_messages, characters, my_characters in rows:
+            accumulator.conversation_names[key] = name
+            counts = accumulator.conversation_counts.setdefault(key, [0, 0])
+            if by_characters:
+                counts[0] += characters - my_characters
+                counts[1] += my_characters
+            else:
+                counts[0] += messages - my_messages
+                counts[1] += my_messages
+            accumulator.total_messages += messages
+        accumulator.conversation_count = self.query('SELECT COUNT(*) FROM conversations')[0][0]
+
+    top_conversations_by_chars = conversation_counts
+    top_conversations_by_messages = conversation_counts
+    conversation_people_variability = conversation_counts
+
+    def hourly_histogram(self, accumulator: HourlyHistogram) -> None:
+        for hour, count in self.local_histogram('(local / 3600000) % 24'):
+            accumulator.hours[hour] = count
+
+    def yearly_histogram(self, accumulator: YearlyHistogram) -> None:
+        for year, count in self.local_histogram("CAST(strftime('%Y', local / 1000, 'unixepoch') AS INTEGER)"):
+            if 2000 <= year < 2100:
+                accumulator.years[year - 2000] = count
+
+    def day_in_week_histogram(self, accumulator: DayInWeekHistogram) -> None:
+        # 1st January 1970 was Thursday.
+        for day, count in self.local_histogram('(local / 86400000 + 4) % 7'):
+            accumulator.day_in_week[day] = count
+
+    def messages_lengths(self, accumulator: MessagesLengths) -> None:
+        for is_me, longest, total, count in self.query('''
+                SELECT sender_id = :me, MAX(length), SUM(length), COUNT(*) FROM messages GROUP BY 1'''):
+            if is_me:
+                accumulator.self_max, accumulator.self_total, accumulator.self_cnt = longest, total, count
+            else:
+                accumulator.other_max, accumulator.other_total, accumulator.other_cnt = longest, total, count
+
+    def msgs_before_reply(self, accumulator: MsgsBeforeReply) -> None:
+        # First message of conversation sent by other person is considered to be response.
+        (accumulator.me_msgs, accumulator.oth_msgs, accumulator.me_responses,
+         accumulator.oth_responses) = self.query('''
+            SELECT COALESCE(SUM(is_me), 0), COALESCE(SUM(NOT is_me), 0),
+                   COALESCE(SUM(is_me AND NOT previous), 0), COALESCE(SUM(NOT is_me AND previous), 0)
+            FROM (SELECT sender_id = :me AS is_me,
+                         LAG(sender_id = :me, 1, 1) OVER (PARTITION BY conversation_id ORDER BY id) AS previous
+                  FROM messages)''')[0]
+
+    def time_before_reply(self, accumulator: TimeBeforeReply) -> None:
+        for is_me, responses, milliseconds in self.query('''
+                SELECT is_me, COUNT(*), SUM(ABS(timestamp - previous_timestamp))
+                FROM (SELECT sender_id = :me AS is_me, timestamp,
+                             LAG(sender_id = :me) OVER w AS previous, LAG(timestamp) OVER w AS previous_timestamp
+                      FROM messages
+                      WINDOW w AS (PARTITION BY conversation_id ORDER BY id))
+                WHERE is_me != previous
+                GROUP BY is_me'''):
+            if is_me:
+                accumulator.me_responses, accumulator.me_ms_to_response = responses, milliseconds
+            else:
+                accumulator.oth_responses, accumulator.oth_ms_to_response = responses, milliseconds
+
+    def who_started_conv(self, accumulator: WhoStartedConv) -> None:
+        for is_me, starts in self.query('''
+                SELECT is_me, COUNT(*)
+                FROM (SELECT sender_id = :me AS is_me,
+                             timestamp - LAG(timestamp) OVER (PARTITION BY conversation_id ORDER BY id) AS gap
+                      FROM messages)
+                WHERE ABS(gap) > 1800000
+                GROUP BY is_me'''):
+            if is_me:
+                accumulator.me_starts = starts
+            else:
+                accumulator.oth_starts = starts
+
+    def run(self, statistics: list = None) -> Report:
+        """
+        Computes specified statistics (all supported statistics by default) over all messages
+        in the database.
+
+        :param statistics: accumulator classes of statistics to compute
+        :return: report with global results
+        """
+        accumulators: List[Accumulator] = []
+        for statistic in SQL_STATISTICS if statistics is None else statistics:
+            accumulator = statistic(self.self_name, self.exhaustive_lists, **self.options)
+            if not hasattr(self, accumulator.name):
+                raise ValueError(f'Statistic {accumulator.name} can not be computed by SQL')
+
+            getattr(self, accumulator.name)(accumulator)
+            accumulators.append(accumulator)
+
+        return Report(self.self_name, accumulators)
+
+
+# Statistics supported by `SqlStatistics` in the order in which they are printed.
+SQL_STATISTICS = [GeneralStats, TopConversationsByChars, TopConversationsByMessages, ConversationPeopleVariability,
+                  HourlyHistogram, YearlyHistogram, DayInWeekHistogram, MessagesLengths, MsgsBeforeReply,
+                  TimeBeforeReply, WhoStartedConv]
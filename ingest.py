@@ -0,0 +1,315 @@
+import codecs
+import json
+import re
+from json import JSONDecodeError
+from time import perf_counter
+from typing import Iterator, Tuple, Any, BinaryIO, NamedTuple, List
+
+from instrumentation import FileMetrics
+
+# Size of chunks in which files are read and decoded.
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Control characters which are removed from decoded files.
+CONTROL_CHARACTERS = bytes(range(32))
+
+# File which could not be parsed (or was parsed only partially). Offset is the position
+# in decoded text of the file (in characters) at which parsing failed, exception is the
+# name and message of the error and recovered is the number of messages recovered by
+# the tolerant decoder.
+ParseError = NamedTuple('ParseError', [('path', str), ('offset', int), ('exception', str), ('recovered', int)])
+
+
+class FacebookDecoder:
+    """
+    Incremental decoder of JSON files produced by Facebook export tool.
+
+    Facebook export tool produces invalid JSONs. Non-ASCII characters are stored as
+    escaped bytes of their UTF-8 representation (`\\u00c3\\u00a1` instead of `\\u00e1`)
+    and some of the control characters are not encoded correctly. This decoder fixes
+    wrongly encoded characters and removes all control characters. As the decoder keeps
+    incomplete escape sequences and UTF-8 sequences between calls, files can be decoded
+    chunk by chunk.
+
+    Tolerant decoder replaces invalid escape sequences and invalid UTF-8 sequences by
+    replacement character instead of raising UnicodeDecodeError.
+
+    Number of characters decoded so far is kept in `position`. When decoding raises
+    UnicodeDecodeError, `position` is the position of the first character which could
+    not be decoded (in the decoded text of the file).
+    """
+
+    def __init__(self, tolerant: bool = False):
+        errors = 'replace' if tolerant else 'strict'
+        self.escape_decoder = codecs.getincrementaldecoder('raw_unicode_escape')(errors)
+        self.utf8_decoder = codecs.getincrementaldecoder('utf-8')(errors)
+        self.position = 0
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        state = self.escape_decoder.getstate(), self.utf8_decoder.getstate()
+        try:
+            text = self.decode_bytes(data, final)
+        except UnicodeDecodeError:
+            self.position += self.decodable_length(data, state)
+            raise
+
+        self.position += len(text)
+        return text
+
+    def decodable_length(self, data: bytes, state: tuple) -> int:
+        """
+        Returns number of characters decoded from the longest prefix of data which can be
+        decoded from specified state of the decoders. Used only when decoding fails, so the
+        prefix is found by bisection.
+        """
+        def decode_prefix(length: int) -> str:
+            self.escape_decoder.setstate(state[0])
+            self.utf8_decoder.setstate(state[1])
+            return self.decode_bytes(data[:length], False)
+
+        low, high = 0, len(data)
+        while low < high:
+            middle = (low + high + 1) // 2
+            try:
+                decode_prefix(middle)
+                low = middle
+            except UnicodeDecodeError:
+                high = middle - 1
+        return len(decode_prefix(low))
+
+    def decode_bytes(self, data: bytes, final: bool) -> str:
+        # Here we try to fix wrongly encoded characters.
+        encoded = self.escape_decoder.decode(data, final).encode('raw_unicode_escape')
+
+        # Also some of the control characters are not encoded correctly, so
+        # we remove all of them - we are safe to remove line break as JSON is
+        # valid without any whitespace. Bytes of control characters never occur
+        # inside of multi-byte UTF-8 sequences, so we can remove all of them
+        # in one pass before the text is decoded.
+        return self.utf8_decoder.decode(encoded.translate(None, CONTROL_CHARACTERS), final)
+
+
+def decode_facebook_json(data: bytes, tolerant: bool = False) -> str:
+    """
+    Decodes whole content of JSON file produced by Facebook export tool, fixing
+    wrongly encoded characters and removing control characters.
+    """
+    return FacebookDecoder(tolerant).decode(data, final=True)
+
+
+def decoded_chunks(f: BinaryIO, chunk_size: int = CHUNK_SIZE, metrics: FileMetrics = None,
+                   tolerant: bool = False, decoder: FacebookDecoder = None) -> Iterator[str]:
+    """
+    Reads specified binary file in chunks and yields decoded and fixed text of the file.
+    When metrics are specified, time spent by reading and decoding is recorded in them.
+
+    :param decoder: decoder to use (new decoder is created when not specified)
+    """
+    if decoder is None:
+        decoder = FacebookDecoder(tolerant)
+    while True:
+        if metrics is None:
+            data = f.read(chunk_size)
+            text = decoder.decode(data, len(data) == 0)
+        else:
+            time_start = perf_counter()
+            data = f.read(chunk_size)
+            time_read = perf_counter()
+            text = decoder.decode(data, len(data) == 0)
+
+            metrics.read_seconds += time_read - time_start
+            metrics.decode_seconds += perf_counter() - time_read
+            metrics.bytes += len(data)
+
+        if text:
+            yield text
+        if len(data) == 0:
+            return
+
+
+class JsonStream:
+    """
+    Minimal streaming parser of JSON documents consisting of single top-level object.
+
+    Parser yields (key, value) pair for each top-level property. Elements of top-level
+    array properties specified as streamed are yielded one by one as (key, element)
+    pairs, so the whole array is never held in memory. Only the currently parsed value
+    is kept in memory.
+    """
+
+    def __init__(self, chunks: Iterator[str], streamed_keys=('messages',), decoder: FacebookDecoder = None):
+        """
+        :param chunks: chunks of text of the document
+        :param streamed_keys: keys of top-level arrays whose elements are yielded one by one
+        :param decoder: decoder producing the chunks, used to locate errors of decoding
+        """
+        self.chunks = chunks
+        self.streamed_keys = streamed_keys
+        self.text_decoder = decoder
+        self.decoder = json.JSONDecoder()
+
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.consumed = 0  # number of characters dropped from the buffer
+
+    def fill(self) -> bool:
+        """
+        Reads next chunk into the buffer. Returns False when there are no more chunks.
+        """
+        if self.eof:
+            return False
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+
+        # Drop already consumed part of the buffer.
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.consumed += self.pos
+        self.pos = 0
+        return True
+
+    def error_offset(self, error: Exception) -> int:
+        """
+        Returns position in the document (in characters) at which specified error raised
+        while iterating this stream occurred. Errors of decoding are reported at the first
+        character which could not be decoded when the decoder is known, other errors at
+        the end of the text read so far.
+        """
+        if isinstance(error, JSONDecodeError) and error.doc is self.buffer:
+            return self.consumed + error.pos
+        if isinstance(error, UnicodeDecodeError) and self.text_decoder is not None:
+            return self.text_decoder.position
+        return self.consumed + len(self.buffer)
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns next character without consuming it (empty string
+        at the end of the document).
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, characters: str) -> str:
+        character = self.peek()
+        if character == '' or character not in characters:
+            raise JSONDecodeError(f'Expecting one of {characters!r}', self.buffer, self.pos)
+        self.pos += 1
+        return character
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+                # Value which ends at the end of the buffer may be incomplete
+                # (number split between chunks for example).
+                if end < len(self.buffer) or self.eof or not self.fill():
+                    self.pos = end
+                    return value
+            except JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        self.expect('{')
+        if self.peek() == '}':
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+
+            if key in self.streamed_keys and self.peek() == '[':
+                self.expect('[')
+                if self.peek() != ']':
+                    while True:
+                        yield key, self.value()
+                        if self.expect(',]') == ']':
+                            break
+                else:
+                    self.expect(']')
+            else:
+                yield key, self.value()
+
+            if self.expect(',}') == '}':
+                return
+
+
+def stream_thread(f: BinaryIO, chunk_size: int = CHUNK_SIZE, metrics: FileMetrics = None,
+                  tolerant: bool = False) -> JsonStream:
+    """
+    Streams properties of thread file opened in binary mode (regular file or entry
+    of ZIP file). Each message is yielded as separate ('messages', message) pair
+    by iterating returned stream.
+
+    :param tolerant: whether invalid characters should be replaced instead of raising errors
+    """
+    decoder = FacebookDecoder(tolerant)
+    return JsonStream(decoded_chunks(f, chunk_size, metrics, decoder=decoder), decoder=decoder)
+
+
+def stream_thread_file(path: str, chunk_size: int = CHUNK_SIZE,
+                       metrics: FileMetrics = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Streams properties of thread file on specified path. Each message is yielded
+    as separate ('messages', message) pair.
+    """
+    with open(path, 'rb') as f:
+        yield from stream_thread(f, chunk_size, metrics)
+
+
+class ErrorIndex:
+    """
+    Index of files which could not be parsed completely (see `ParseError`). When path
+    of the index is specified, each error is appended to the file as one line of JSON
+    as soon as it is added, so the index is complete even when the run is interrupted.
+    """
+
+    def __init__(self, index_path: str = None):
+        """
+        :param index_path: path to the file with the index (existing file is replaced)
+        """
+        self.index_path = index_path
+        self.errors: List[ParseError] = []
+
+        if index_path is not None:
+            open(index_path, mode='w', encoding='utf-8').close()
+
+    def __len__(self) -> int:
+        return len(self.errors)
+
+    def __iter__(self) -> Iterator[ParseError]:
+        return iter(self.errors)
+
+    def add(self, error: ParseError) -> None:
+        self.errors.append(error)
+        if self.index_path is not None:
+            with open(self.index_path, mode='a', encoding='utf-8') as f:
+                f.write(json.dumps(error._asdict(), ensure_ascii=False) + '\n')
+
+    def take(self) -> List[ParseError]:
+        """
+        Returns added errors and removes them from the index (used by worker processes).
+        """
+        errors, self.errors = self.errors, []
+        return errors
+
+
+def write_decoded(f: BinaryIO, output_path: str, chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Writes decoded and fixed content of file opened in binary mode to output file.
+    """
+    with open(output_path, mode='w', encoding='utf-8') as g:
+        for chunk in decoded_chunks(f, chunk_size):
+            g.write(chunk)
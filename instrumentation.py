@@ -0,0 +1,259 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # resource module is not available on Windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns peak resident set size of this process in bytes (None when not supported).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageMetrics:
+    """
+    Accumulated metrics of one stage of processing (listing of directories, parsing,
+    computing of some statistic...).
+    """
+
+    __slots__ = ('calls', 'seconds', 'bytes', 'messages')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.messages = 0
+
+    def add(self, seconds: float, bytes_count: int = 0, messages: int = 0) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.bytes += bytes_count
+        self.messages += messages
+
+    def merge(self, other: 'StageMetrics') -> None:
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.bytes += other.bytes
+        self.messages += other.messages
+
+    def summary(self) -> dict:
+        summary = {'calls': self.calls, 'seconds': round(self.seconds, 6)}
+        if self.bytes:
+            summary['bytes'] = self.bytes
+            summary['megabytes_per_second'] = round(self.bytes / (1 << 20) / self.seconds, 2) if self.seconds else None
+        if self.messages:
+            summary['messages'] = self.messages
+            summary['messages_per_second'] = round(self.messages / self.seconds) if self.seconds else None
+        return summary
+
+
+class FileMetrics:
+    """
+    Metrics of parsing of one thread file. Time spent by JSON parsing is the time
+    which was not spent by reading, decoding or converting of messages.
+    """
+
+    __slots__ = ('path', 'bytes', 'messages', 'seconds', 'read_seconds', 'decode_seconds', 'convert_seconds',
+                 'peak_rss', 'peak_traced')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes = 0
+        self.messages = 0
+        self.seconds = 0.0
+        self.read_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.convert_seconds = 0.0
+        self.peak_rss = None
+        self.peak_traced = None
+
+    @property
+    def parse_seconds(self) -> float:
+        return max(0.0, self.seconds - self.read_seconds - self.decode_seconds - self.convert_seconds)
+
+    def summary(self) -> dict:
+        return {
+            'path': self.path,
+            'bytes': self.bytes,
+            'messages': self.messages,
+            'seconds': round(self.seconds, 6),
+            'read_seconds': round(self.read_seconds, 6),
+            'decode_seconds': round(self.decode_seconds, 6),
+            'parse_seconds': round(self.parse_seconds, 6),
+            'convert_seconds': round(self.convert_seconds, 6),
+            'messages_per_second': round(self.messages / self.seconds) if self.seconds else None,
+            'peak_rss': self.peak_rss,
+            'peak_traced': self.peak_traced
+        }
+
+
+class Instrumentation:
+    """
+    Collects metrics of processing of an export: durations of individual stages,
+    amount of processed bytes and messages, detailed metrics of each parsed file
+    and each computed statistic, and peak memory usage.
+
+    Detailed metrics (`detailed`) add small overhead to each message, so they are
+    disabled by default. Optionally the whole processing can be profiled by cProfile
+    (`profile`) and memory allocations can be traced by tracemalloc (`trace_memory`).
+    """
+
+    def __init__(self, detailed: bool = False, profile: bool = False, trace_memory: bool = False):
+        self.detailed = detailed
+        self.profile = profile
+        self.trace_memory = trace_memory
+
+        self.stages: Dict[str, StageMetrics] = {}
+        self.files: List[FileMetrics] = []
+        self.statistics: Dict[str, dict] = {}
+
+        self.profiler: Optional[cProfile.Profile] = None
+        self.time_start = perf_counter()
+
+    def copy_settings(self) -> 'Instrumentation':
+        """
+        Returns new instrumentation with the same settings (used by worker processes).
+        Profiling is not supported in worker processes.
+        """
+        return Instrumentation(self.detailed, False, self.trace_memory)
+
+    def start(self) -> None:
+        """
+        Starts profiling and tracing of memory if they are enabled.
+        """
+        if self.profile and self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stage_metrics(self, name: str) -> StageMetrics:
+        metrics = self.stages.get(name)
+        if metrics is None:
+            metrics = self.stages[name] = StageMetrics()
+        return metrics
+
+    def add(self, name: str, seconds: float, bytes_count: int = 0, messages: int = 0) -> None:
+        self.stage_metrics(name).add(seconds, bytes_count, messages)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures duration of the block as one call of specified stage.
+        """
+        time_start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - time_start)
+
+    def reset_peak_memory(self) -> None:
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def peak_traced_memory(self) -> Optional[int]:
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        return None
+
+    def start_file(self, path: str) -> Optional[FileMetrics]:
+        """
+        Returns metrics object for file which is going to be parsed (None when detailed
+        metrics are disabled).
+        """
+        if not self.detailed:
+            return None
+        self.reset_peak_memory()
+        return FileMetrics(path)
+
+    def finish_file(self, metrics: Optional[FileMetrics]) -> None:
+        if metrics is None:
+            return
+        metrics.peak_rss = peak_rss()
+        metrics.peak_traced = self.peak_traced_memory()
+        self.add_file(metrics)
+
+    def add_file(self, metrics: FileMetrics) -> None:
+        self.files.append(metrics)
+        self.add('read', metrics.read_seconds, metrics.bytes)
+        self.add('decode', metrics.decode_seconds, metrics.bytes)
+        self.add('json', metrics.parse_seconds, metrics.bytes)
+        self.add('convert', metrics.convert_seconds, 0, metrics.messages)
+
+    def add_statistic(self, name: str, seconds: float, messages: int, peak_traced: Optional[int] = None) -> None:
+        statistic = self.statistics.setdefault(name, {'seconds': 0.0, 'messages': 0})
+        statistic['seconds'] += seconds
+        statistic['messages'] += messages
+        statistic['peak_rss'] = peak_rss()
+        if peak_traced is not None:
+            statistic['peak_traced'] = max(statistic.get('peak_traced', 0), peak_traced)
+
+    def merge(self, other: 'Instrumentation') -> None:
+        """
+        Merges metrics collected by other instrumentation (of worker process for example).
+        """
+        for name, metrics in other.stages.items():
+            self.stage_metrics(name).merge(metrics)
+        self.files.extend(other.files)
+
+    def take(self) -> 'Instrumentation':
+        """
+        Returns copy of collected stage and file metrics and clears them.
+        """
+        taken = self.copy_settings()
+        taken.stages, self.stages = self.stages, {}
+        taken.files, self.files = self.files, []
+        return taken
+
+    def summary(self) -> dict:
+        summary = {
+            'seconds': round(perf_counter() - self.time_start, 6),
+            'peak_rss': peak_rss(),
+            'stages': {name: metrics.summary() for name, metrics in self.stages.items()},
+            'statistics': {name: {key: round(value, 6) if isinstance(value, float) else value
+                                  for key, value in statistic.items()}
+                           for name, statistic in self.statistics.items()}
+        }
+
+        if self.detailed:
+            summary['files'] = [metrics.summary() for metrics in self.files]
+
+        if self.profiler is not None:
+            output = io.StringIO()
+            pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(30)
+            summary['profile'] = output.getvalue()
+
+        return summary
+
+    def dump(self, path: str = None) -> None:
+        """
+        Writes summary of collected metrics as JSON to specified file (standard output
+        by default).
+        """
+        if path is None:
+            print(json.dumps(self.summary(), indent=2))
+            return
+
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
@@ -1,15 +1,29 @@
-import datetime
 import json
+import multiprocessing
 import os
 from json import JSONDecodeError
 from os import path
-from sys import argv
-from time import time
-from typing import List
+from sys import argv, stdout
+from time import perf_counter
+from typing import List, Callable, Tuple, Iterator, Optional, TextIO, Iterable
 
 import statistics
-from custom_types import NamedConversation
+from archive import open_archive
+from cache import ConversationCache, default_cache_path
+from columnar import ColumnarConversation, ColumnarBuilder
+from database import MessageDatabase, SqlStatistics
+from custom_types import Participants
+from ingest import decode_facebook_json, stream_thread, JsonStream, ParseError, ErrorIndex
+from instrumentation import Instrumentation
+from output import TextOutput, ConversationReportWriter, create_output
+from packed import PackedConversations
+from people import PeopleRegistry
+from prefetch import Prefetcher, PrefetchedFile, READ_AHEAD_BYTES
+from query import ConversationIndex, Query
+from rollup import RollupCube, RollupStatistics, ROLLUP_STATISTICS, default_rollup_path
+from snapshots import Snapshot
 from utils import separator
+from words import Tokenizer
 
 
 class FacebookStatistics:
@@ -18,22 +32,70 @@ class FacebookStatistics:
     """
 
     def __init__(self, root_path: str, encoding: str = 'utf-8', exclude_group_chats=True, exhaustive_lists=False,
-                 ignore_facebook_user=True):
+                 ignore_facebook_user=True, workers=1, cache_path: str = None, cache_hash_files=False,
+                 timezone: str = None, top_words=100, approximate_words=False, tokenizer: Tokenizer = None,
+                 instrument=False, profile=False, trace_memory=False, metrics_path: str = None, read_ahead=0,
+                 readers=2, my_name: str = None, errors_path: str = None, read_ahead_bytes=READ_AHEAD_BYTES):
+        """
+        :param my_name: name of the person whose archive is processed, used when the archive
+                        does not contain profile information (asked interactively otherwise)
+        :param errors_path: path to the file to which errors of files are written (see `ErrorIndex`)
+        """
         self.root_path = root_path
         self.encoding = encoding
 
+        # Export can be either unzipped directory or ZIP file.
+        self.archive = open_archive(root_path)
+
         # Settings.
         self.exclude_group_chats = exclude_group_chats
         self.exhaustive_lists = exhaustive_lists
         self.ignore_facebook_user = ignore_facebook_user
+        self.workers = max(1, workers or 1)
+        self.cache_path = cache_path
+        self.timezone = timezone
+
+        # Number of files read ahead of parsing by reader threads (0 disables prefetching)
+        # and limit of their total size in bytes.
+        self.read_ahead = read_ahead
+        self.read_ahead_bytes = read_ahead_bytes
+        self.readers = readers
+
+        # Options of individual statistics.
+        self.statistics_options = {
+            'top_words': top_words,
+            'approximate_words': approximate_words,
+            'tokenizer': tokenizer
+        }
+
+        self.metrics_path = metrics_path
 
         self.print_settings()
 
+        # Metrics of processing. Detailed metrics of each file, profiling and tracing
+        # of memory are only collected when enabled.
+        self.instrumentation = Instrumentation(instrument, profile, trace_memory)
+
+        # Files which could not be parsed completely.
+        self.errors = ErrorIndex(errors_path)
+
+        # Cache of already parsed threads, which also serves as checkpoint of interrupted runs.
+        self.cache: ConversationCache = None
+        if cache_path is not None:
+            self.cache = ConversationCache(cache_path, f'ignore_facebook_user={ignore_facebook_user}',
+                                           cache_hash_files)
+
         # Data
-        self.my_name: str = None
-        self.conversations: List[NamedConversation] = []
+        self.my_name: str = my_name
+        self.conversations: List[ColumnarConversation] = []
+        self.index: ConversationIndex = None
+        self.rollup: RollupCube = None
+        self.packed: PackedConversations = None
         self.parse_my_name()
 
+        # Registry of all people of the archive, conversations are bound to it when parsed.
+        self.people = PeopleRegistry(self.my_name)
+
     def print_settings(self) -> None:
         """
         Prints current settings to standard output.
@@ -41,6 +103,26 @@ class FacebookStatistics:
         print('Setting: Exclude Group Chats: ', self.exclude_group_chats)
         print('Setting: Ignore Facebook User: ', self.ignore_facebook_user)
         print('Setting: Exhaustive lists: ', self.exhaustive_lists)
+        print('Setting: Workers: ', self.workers)
+        print('Setting: Cache: ', self.cache_path)
+        print('Setting: Read ahead: ', self.read_ahead)
+        print('Setting: Time zone: ', self.timezone or 'local')
+        print('Setting: Top words: ', self.statistics_options['top_words'])
+        print('Setting: Approximate words: ', self.statistics_options['approximate_words'])
+        print('Setting: Metrics: ', self.metrics_path)
+
+    def __getstate__(self):
+        # Instance is sent to worker processes when parsing in parallel. Workers
+        # only need settings so we do not send already parsed conversations.
+        state = self.__dict__.copy()
+        state['conversations'] = []
+        state['cache'] = None
+        state['index'] = None
+        state['rollup'] = None
+        state['packed'] = None
+        state['errors'] = ErrorIndex()
+        state['instrumentation'] = self.instrumentation.copy_settings()
+        return state
 
     def parse_my_name(self) -> None:
         """
@@ -48,37 +130,40 @@ class FacebookStatistics:
 
         Name is than stored as field `my_name`.
         """
-        if path.isdir(path.join(self.root_path, 'profile_information')):
+        if self.archive.isdir('profile_information'):
             print('Parsing profile...')
-            with open(path.join(self.root_path, 'profile_information', 'profile_information.json'),
-                      encoding='raw_unicode_escape') as f:
-
-                # Facebook export tool produces invalid JSONs. Here we try to fix
-                # wrongly encoded characters.
-                encoded = f.read().encode('raw_unicode_escape')
-                decoded = encoded.decode()
+            profile_path = self.archive.file_path('profile_information', 'profile_information.json')
+            with self.archive.open(profile_path) as f:
+                data = f.read()
 
-                # Also some of the control characters are not encoded correctly, so
-                # we remove all of them - we are safe to remove line break as JSON is
-                # valid without any whitespace.
-                for i in range(32):
-                    decoded = decoded.replace(chr(i), '')
+            try:
+                self.my_name = json.loads(decode_facebook_json(data))['profile']['name']['full_name']
+            except (ValueError, KeyError, TypeError) as e:
+                print(">>>>> JSON DECODE ERROR in profile_information")
+                print(e)
 
+                # Invalid characters may be the only problem of the file.
+                name = None
                 try:
-                    doc = json.loads(decoded)
-                except JSONDecodeError as e:
-                    print(">>>>> JSON DECODE ERROR in profile_information")
-                    print(e)
-                    exit(1)
-                    return
-
-            self.my_name = doc['profile']['name']['full_name']
+                    name = json.loads(decode_facebook_json(data, tolerant=True))['profile']['name']['full_name']
+                except (ValueError, KeyError, TypeError):
+                    pass
+                self.errors.add(ParseError(profile_path, e.pos if isinstance(e, JSONDecodeError) else 0,
+                                           f'{type(e).__name__}: {e}', int(name is not None)))
+
+                if name is not None:
+                    self.my_name = name
+                elif self.my_name is None:
+                    raise ValueError('Profile information could not be parsed, name of the person has to be '
+                                     'provided (my_name)!') from e
         else:
             separator()
             print('Profile Information section is not included in this export!')
-            print('Please provide your name (exactly as on Facebook) so we can ' +
-                  'differentiate your messages from messages of your friends.')
-            self.my_name = input('Your name (exactly as on Facebook): ').strip()
+            # Name may have been provided in advance (unattended runs).
+            if self.my_name is None:
+                print('Please provide your name (exactly as on Facebook) so we can ' +
+                      'differentiate your messages from messages of your friends.')
+                self.my_name = input('Your name (exactly as on Facebook): ').strip()
             separator()
         print(f'Person name: {self.my_name}')
 
@@ -86,10 +171,81 @@ class FacebookStatistics:
         """
         Lists all threads in messages folder and parses each folder as one thread.
         """
-        subfolders = os.listdir(path.join(self.root_path, 'messages'))
+        self.conversations.extend(self.iterate_conversations())
+        # Rollup cube is built again by the first statistic computed from it.
+        self.rollup = None
+
+    def update_rollup(self) -> None:
+        """
+        Builds rollup cube of parsed conversations (see `RollupCube`), from which histograms
+        and top conversations are computed without scanning messages. The cube is built by
+        `rollup_stats` when it is needed for the first time, so runs which compute statistics
+        from messages only do not pay for it. When cache is enabled,
+        the cube is saved next to the cache and loaded back as long as it was built from
+        the same conversations with the same settings.
+        """
+        rollup_path = None if self.cache_path is None else default_rollup_path(self.cache_path)
+
+        with self.instrumentation.stage('rollup'):
+            if rollup_path is not None and path.exists(rollup_path):
+                try:
+                    cube = RollupCube.load(rollup_path)
+                    if cube.matches(self.conversations, self.my_name, self.timezone):
+                        self.rollup = cube
+                        return
+                except (OSError, ValueError, KeyError):
+                    pass
+
+            self.rollup = RollupCube.build(self.conversations, self.my_name, self.timezone, self.people)
+            if rollup_path is not None:
+                self.rollup.save(rollup_path)
+
+    def iterate_conversations(self) -> Iterator[ColumnarConversation]:
+        """
+        Lists all threads in messages folder, parses each folder as one thread and yields
+        conversations which are not excluded by settings. Conversations are not stored,
+        so only one conversation is held in memory at once.
+        """
+        self.instrumentation.start()
+
+        time_start = perf_counter()
+        with self.instrumentation.stage('list'):
+            thread_dirs = self.list_threads()
+        conversation_count = len(thread_dirs)
 
         i = 0
-        time_start = time()
+        message_count = 0
+        for thread_dir, named_conversation in zip(thread_dirs, self.parse_conversations(thread_dirs)):
+            i += 1
+            print(f'({i}/{conversation_count}) Parsed thread {path.basename(thread_dir)}')
+
+            if named_conversation is None:
+                continue
+
+            message_count += len(named_conversation)
+            named_conversation.bind(self.people)
+
+            # Exclude conversation with self and group conversations if setting is enabled
+            if len(named_conversation.participants) > 1:
+                if not (self.exclude_group_chats and len(named_conversation.participants) > 2):
+                    yield named_conversation
+
+        duration = perf_counter() - time_start
+        self.instrumentation.add('parse_all', duration, messages=message_count)
+        print(f'Parsed {i} conversations ({message_count} messages) in {round(duration, 3)} seconds.')
+        if len(self.errors):
+            print(f'{len(self.errors)} files could not be parsed completely' +
+                  ('.' if self.errors.index_path is None else f', see {self.errors.index_path}.'))
+
+    def list_threads(self) -> List[str]:
+        """
+        Lists directories of all threads (relative to messages folder) which contain
+        at least one message file.
+        """
+        thread_dirs = []
+        self.archive.rescan()
+        subfolders = self.archive.listdir('messages')
+
         for subfolder in subfolders:
 
             # facebook started putting used stickers used in conversations into
@@ -97,129 +253,500 @@ class FacebookStatistics:
             if subfolder == 'stickers_used':
                 continue
 
-            folders = os.listdir(path.join(self.root_path,
-                                           'messages',
-                                           subfolder))
+            folders = self.archive.listdir('messages', subfolder)
 
-            conversation_count = len(folders)
-            print(f'Found {conversation_count} threads in {subfolder}')
+            print(f'Found {len(folders)} threads in {subfolder}')
 
             for file in folders:
+                thread_dir = path.join(subfolder, file)
+
                 # Verify if the message file exists.
-                if not os.path.exists(path.join(self.root_path, 'messages', subfolder, file, 'message_1.json')):
+                if not self.archive.thread_files(thread_dir):
                     print(f'Warning: No message.json file for thread {file}! Skipping.')
                     continue
 
-                print(f'({i}/{conversation_count}) Parsing thread {file}...')
-                named_conversation = self.parse_conversation(path.join(subfolder, file))
-                i += 1
+                thread_dirs.append(thread_dir)
 
-                if named_conversation is None:
+        return thread_dirs
+
+    def parse_conversations(self, thread_dirs: List[str]) -> Iterator[ColumnarConversation]:
+        """
+        Parses specified threads and yields parsed conversations in the same order as
+        the threads were specified. When cache is enabled, only threads which are not
+        cached or changed since they were cached are parsed.
+
+        :param thread_dirs: directories of threads to parse
+        :return: iterator of parsed conversations (None for threads which could not be parsed)
+        """
+        if self.cache is None:
+            yield from self.parse_threads(thread_dirs)
+            return
+
+        with self.instrumentation.stage('cache.signatures'):
+            cached_signatures = self.cache.signatures()
+            cached_errors = self.cache.errors()
+            signatures = [self.cache.signature(self.archive, thread_dir) for thread_dir in thread_dirs]
+
+        # Threads which could not be parsed are not parsed again until they change.
+        failed = {thread_dir for thread_dir, signature in zip(thread_dirs, signatures)
+                  if cached_signatures.get(thread_dir) != signature
+                  and cached_errors.get(thread_dir, (None,))[0] == signature}
+        changed = [thread_dir for thread_dir, signature in zip(thread_dirs, signatures)
+                   if cached_signatures.get(thread_dir) != signature and thread_dir not in failed]
+        print(f'Loading {len(thread_dirs) - len(changed)} threads from cache ({len(failed)} of them failed), ' +
+              f'{len(changed)} threads are new or changed.')
+
+        parsed = self.parse_threads(changed)
+        try:
+            for thread_dir, signature in zip(thread_dirs, signatures):
+                if cached_signatures.get(thread_dir) == signature or thread_dir in failed:
+                    errors_signature, errors = cached_errors.get(thread_dir, (None, []))
+                    if errors_signature == signature:
+                        for error in errors:
+                            self.errors.add(error)
+
+                    with self.instrumentation.stage('cache.load'):
+                        conversation = None if thread_dir in failed else self.cache.load(thread_dir)
+                    yield conversation
                     continue
 
-                # Exclude conversation with self and group conversations if setting is enabled
-                if len(named_conversation[1]) > 1:
-                    if not (self.exclude_group_chats and len(named_conversation[1]) > 2):
-                        self.conversations.append(named_conversation)
+                errors_start = len(self.errors)
+                conversation = next(parsed)
+                # Thread is committed with errors of its files, so interrupted run resumes after it.
+                with self.instrumentation.stage('cache.store'):
+                    self.cache.store(thread_dir, signature, conversation, self.errors.errors[errors_start:])
+                yield conversation
+        finally:
+            parsed.close()
+
+    def parse_threads(self, thread_dirs: List[str]) -> Iterator[ColumnarConversation]:
+        """
+        Parses specified threads and yields parsed conversations in the same order as
+        the threads were specified. When more than one worker is configured, threads
+        are parsed in parallel by pool of worker processes.
+
+        :param thread_dirs: directories of threads to parse
+        :return: iterator of parsed conversations (None for threads which could not be parsed)
+        """
+        if self.workers == 1 or len(thread_dirs) < 2:
+            prefetched = self.prefetch(thread_dirs)
+            try:
+                for thread_dir in thread_dirs:
+                    yield self.parse_conversation(thread_dir, prefetched)
+            finally:
+                if prefetched is not None:
+                    prefetched.close()
+            return
+
+        with multiprocessing.Pool(min(self.workers, len(thread_dirs)), initializer=_init_worker,
+                                  initargs=(self,)) as pool:
+            # Results are columnar conversations, which are pickled as compact
+            # numpy buffers. `imap` returns them in order of the threads.
+            for conversation, instrumentation, errors in pool.imap(_parse_conversation, thread_dirs):
+                self.instrumentation.merge(instrumentation)
+                for error in errors:
+                    self.errors.add(error)
+                yield conversation
+
+    def prefetch(self, thread_dirs: List[str]) -> Optional[Iterator[Tuple[str, Optional[PrefetchedFile]]]]:
+        """
+        Starts reading of files of specified threads ahead of parsing (see `Prefetcher`).
+        Returns None when prefetching is disabled.
+        """
+        if not self.read_ahead:
+            return None
 
-        print(f'Parsed {i - 1} conversations in {time() - time_start} seconds.')
+        prefetcher = Prefetcher(self.archive, self.read_ahead, self.readers, self.instrumentation,
+                                self.read_ahead_bytes)
+        return prefetcher.files(thread_file for thread_dir in thread_dirs
+                                for thread_file in self.archive.thread_files(thread_dir))
 
-    def parse_conversation(self, thread_dir: str) -> NamedConversation:
+    def parse_conversation(self, thread_dir: str,
+                           prefetched: Iterator[Tuple[str, Optional[PrefetchedFile]]] = None) -> ColumnarConversation:
         """
         Parses conversation from JSON file specified by thread_dir parameter and returns
         its participants, title and messages.
 
         :param thread_dir: directory to parse conversation from (AdamSulko_3c954401d0 for example)
+        :param prefetched: already read files of this thread (and possibly following threads)
         :return: parsed conversation
         """
 
-        # absolute path to the thread directory
-        thread_path = path.join(self.root_path, 'messages', thread_dir)
-
-        # listing all the files in thread directory
-        files_in_dir = os.listdir(thread_path)
-
-        parsed_files: List[NamedConversation] = []
+        builder = ColumnarBuilder()
+        parsed_files = []
 
-        # iterating through the listed files
-        for name in files_in_dir:
-            # file's absolute path
-            name_path = path.join(thread_path, name)
+        # iterating through the files of the thread
+        for thread_file in self.archive.thread_files(thread_dir):
+            data = None
+            if prefetched is not None:
+                _, data = next(prefetched)
 
-            if not os.path.isfile(name_path):
-                continue
-
-            # parsing the file and appending it to parsed_files if not None
-            c = self.parse_file(name_path)
-            if c != None:
+            # parsing messages of the file into the builder and remembering thread
+            # information if the file was parsed successfully
+            c = self.parse_file(thread_file.path, builder, data)
+            if c is not None:
                 parsed_files.append(c)
 
         # if none of the files have been successfully parsed return None
         if len(parsed_files) == 0:
             return None
 
-        # appending messages from all parsed files to the first one
-        conversation = parsed_files[0]
-        for c in parsed_files[1:]:
-            conversation[2].extend(c[2])
+        # Participants may be missing in files which were recovered only partially.
+        title, participants = next((c for c in parsed_files if c[1]), parsed_files[0])
+        return builder.build(title, participants, thread_dir)
+
+    def parse_file(self, path: str, builder: ColumnarBuilder,
+                   data: PrefetchedFile = None) -> Optional[Tuple[str, Participants]]:
+        """
+        Parses messages from thread file on specified path and appends them to the builder.
+        The file is parsed as a stream, so only small part of the file is held in memory
+        at once regardless of its size.
+
+        When the file can not be parsed, the error is added to the error index and the file
+        is parsed again by tolerant decoder, which replaces invalid characters and keeps
+        messages parsed before the first invalid part of the file.
+
+        :param path: path to the thread file
+        :param builder: builder of the conversation the messages should be appended to
+        :param data: content of the file when it was already read (by `Prefetcher`), the file
+                     is read again from the archive when it has to be parsed by tolerant decoder
+        :return: title and participants of the thread or None if the file could not be parsed
+        """
+        count = len(builder)
+        stream = None
+
+        metrics = self.instrumentation.start_file(path)
+        time_start = perf_counter()
+
+        try:
+            with self.archive.open(path) if data is None else data as f:
+                stream = stream_thread(f, metrics=metrics)
+                return self.parse_stream(stream, builder, metrics)
+        except Exception as e:
+            print(f'>>>>> ERROR in {path}')
+            print(e)
+            # Messages of invalid file are not included in the conversation.
+            builder.truncate(count)
+            offset = 0 if stream is None else stream.error_offset(e)
+
+            parsed = None
+            if isinstance(e, ValueError):
+                with self.archive.open(path) as f:
+                    parsed = self.parse_stream(stream_thread(f, tolerant=True), builder, tolerant=True)
+                if len(builder) == count and not parsed[1]:
+                    parsed = None
+
+            self.errors.add(ParseError(path, offset, f'{type(e).__name__}: {e}', len(builder) - count))
+            if parsed is not None:
+                print(f'Recovered {len(builder) - count} messages by tolerant decoder.')
+            return parsed
+        finally:
+            if metrics is not None:
+                metrics.seconds = perf_counter() - time_start
+                self.instrumentation.finish_file(metrics)
+
+    def parse_stream(self, stream: JsonStream, builder: ColumnarBuilder, metrics=None,
+                     tolerant=False) -> Tuple[str, Participants]:
+        """
+        Appends messages from stream of thread file to the builder.
+
+        :param stream: stream of the thread file
+        :param builder: builder of the conversation the messages should be appended to
+        :param metrics: metrics of the file
+        :param tolerant: whether parsing should stop at the first error instead of raising it
+        :return: title and participants of the thread
+        """
+        title = None
+        participants = []
+
+        try:
+            for key, value in stream:
+                if key == 'messages':
+                    if metrics is not None:
+                        time_convert = perf_counter()
 
-        return conversation
+                    sender_name = value.get('sender_name', '')
 
-    def parse_file(self, path: str) -> NamedConversation:
-        with open(path, encoding='raw_unicode_escape') as f:
+                    if sender_name != '' or not self.ignore_facebook_user:
+                        builder.append(sender_name, value.get('content', ''), value.get('timestamp_ms'))
 
-            # Facebook export tool produces invalid JSONs. Here we try to fix
-            # wrongly encoded characters.
-            encoded = f.read().encode('raw_unicode_escape')
-            decoded = encoded.decode()
+                    if metrics is not None:
+                        metrics.convert_seconds += perf_counter() - time_convert
+                        metrics.messages += 1
+                elif key == 'participants':
+                    participants = [participant['name'] for participant in value]
+                elif key == 'title':
+                    title = value
+        except ValueError:
+            if not tolerant:
+                raise
 
-            # Also some of the control characters are not encoded correctly, so
-            # we remove all of them - we are safe to remove line break as JSON is
-            # valid without any whitespace.
-            for i in range(32):
-                decoded = decoded.replace(chr(i), '')
+        if title is None:
+            title = ' '.join(participants)
 
-            try:
-                doc = json.loads(decoded)
-            except JSONDecodeError as e:
-                print(">>>>> JSON DECODE ERROR")
-                print(e)
-                with open('error_file.json', mode='w', encoding='utf-8') as g:
-                    g.write(decoded)
-                return None
+        return title, participants
+
+    def write_packed(self, packed_path: str, conversations: List[ColumnarConversation] = None) -> None:
+        """
+        Writes conversations to binary file (see `PackedConversations`) which can be loaded
+        by `load_packed` without parsing the archive again.
+
+        :param packed_path: path to the file (existing file is replaced)
+        :param conversations: conversations to write (parsed conversations by default)
+        """
+        with self.instrumentation.stage('packed.write'):
+            PackedConversations.write(packed_path, self.conversations if conversations is None else conversations,
+                                      self.my_name, {'exclude_group_chats': self.exclude_group_chats,
+                                                     'ignore_facebook_user': self.ignore_facebook_user})
 
-        messages = []
-        participants = list(map(lambda x: x['name'], doc.get('participants', set())))
+    def load_packed(self, packed_path: str) -> None:
+        """
+        Replaces parsed conversations by conversations from binary file written by `write_packed`.
+        File is memory mapped, so messages are read from disk only when statistics access them
+        and processes loading the same file share its memory.
 
-        # Convert JSON message objects to correct structure.
-        for msg in reversed(doc['messages']):
-            sender_name = msg.get('sender_name', '')
+        :param packed_path: path to the file
+        """
+        with self.instrumentation.stage('packed.load'):
+            packed = PackedConversations(packed_path)
+            if packed.self_name != self.my_name:
+                raise ValueError(f'File {packed_path} was written for {packed.self_name}, not for {self.my_name}!')
+
+            conversations = list(packed)
+            for conversation in conversations:
+                conversation.bind(self.people)
+
+        self.packed = packed
+        self.conversations = conversations
+        self.index = None
+        print(f'Loaded {len(conversations)} conversations ({len(packed.timestamps)} messages) from {packed_path}.')
+        self.rollup = None
+
+    def export_database(self, database_path: str, conversations: Iterable[ColumnarConversation] = None) -> None:
+        """
+        Writes conversations to SQLite database (see `MessageDatabase`). When no conversations
+        are specified, all threads are parsed and written one by one without holding them
+        in memory, which allows processing of archives which do not fit in memory.
 
-            # Build participants array if the JSON document does not contain this information.
-            if isinstance(participants, set):
-                participants.add(sender_name)
+        :param database_path: path to the SQLite database file (existing data are replaced)
+        :param conversations: conversations to write (all threads of the archive by default)
+        """
+        if conversations is None:
+            conversations = self.iterate_conversations()
 
-            if sender_name != '' or not self.ignore_facebook_user:
-                messages.append((
-                    sender_name,
-                    msg.get('content', ''),
-                    datetime.datetime.fromtimestamp(msg.get('timestamp_ms') / 1000)
-                ))
+        database = MessageDatabase(database_path)
+        try:
+            database.reset()
+            for conversation in conversations:
+                database.add_conversation(conversation)
 
-        return doc.get('title', ' '.join(participants)), list(participants), messages
+            with self.instrumentation.stage('database.indexes'):
+                database.create_indexes()
+        finally:
+            database.close()
 
-    def all_stats(self, conversations: List[NamedConversation]):
+    def sql_stats(self, database_path: str) -> statistics.Report:
+        """
+        Computes statistics by SQL aggregations over database written by `export_database`.
+        Memory usage does not depend on the size of the archive. Most used words and reply
+        times are not computed.
+
+        :param database_path: path to the SQLite database file
+        :return: report with computed statistics
+        """
+        database = MessageDatabase(database_path)
+        try:
+            with self.instrumentation.stage('statistics.sql'):
+                return SqlStatistics(database, self.my_name, self.exhaustive_lists, self.timezone,
+                                     **self.statistics_options).run()
+        finally:
+            database.close()
+
+    def update_snapshot(self, snapshot_path: str, bucket: str = 'month') -> statistics.Report:
+        """
+        Adds messages of parsed conversations which are newer than the snapshot stored in
+        specified file to the snapshot (see `Snapshot`), saves it and returns report computed
+        from the snapshot. Statistics are computed only for the new messages.
+
+        :param snapshot_path: path to the JSON file with snapshot (created when it does not exist)
+        :param bucket: time bucket (year, month or day) of newly created snapshot
+        :return: report with computed statistics
+        """
+        engine = statistics.StatisticsEngine(self.my_name, self.exhaustive_lists, timezone=self.timezone,
+                                             **self.statistics_options)
+
+        with self.instrumentation.stage('statistics.snapshot'):
+            if path.exists(snapshot_path):
+                snapshot = Snapshot.load(snapshot_path, engine)
+            else:
+                snapshot = Snapshot(engine, bucket)
+
+            added = snapshot.update(self.conversations)
+            print(f'Added {added} new messages to snapshot of {len(snapshot)} conversations.')
+
+            snapshot.save(snapshot_path)
+            return snapshot.report()
+
+    def query(self) -> Query:
+        """
+        Returns query selecting parsed conversations and their messages by time range,
+        participants, senders and type of conversation. Result of the query can be passed
+        to any statistic:
+
+            stats.all_stats(stats.query().last_days(90).conversations())
+
+        Indexes of conversations are built on first query.
+        """
+        if self.index is None or len(self.index) != len(self.conversations):
+            self.index = ConversationIndex(self.conversations, self.people)
+        return self.index.query()
+
+    def all_stats(self, conversations: List[ColumnarConversation]):
         """
         Runs all statistics for specified list of conversations.
         :param conversations: list of conversation to run statistics generators on
         :return:
         """
-        for func in [self.global_stats, self.top_conversations_by_chars, self.top_conversations_by_messages,
-                     self.conversation_people_variability, self.hourly_histogram, self.years_histogram,
-                     self.day_in_week_histogram, self.msg_lenghts, self.msgs_before_reply, self.time_before_reply,
-                     self.who_started_conv, self.most_used_words]:
-            separator()
-            func(conversations)
+        self.render_report(self.compute_stats(conversations))
+
+    def compute_stats(self, conversations: List[ColumnarConversation],
+                      per_conversation: Callable[[ColumnarConversation], bool] = None) -> statistics.Report:
+        """
+        Computes all statistics for specified list of conversations in a single pass over their
+        messages.
+
+        :param conversations: list of conversation to run statistics generators on
+        :param per_conversation: predicate selecting conversations which should also have their
+                                 own statistics in the returned report
+        :return: report with computed statistics
+        """
+        with self.instrumentation.stage('statistics'):
+            return self.statistics_engine().run(conversations, per_conversation, self.instrumentation)
+
+    def rollup_stats(self, conversations: List[ColumnarConversation],
+                     statistics_classes: list = None) -> Optional[statistics.Report]:
+        """
+        Computes specified statistics (all statistics supported by `RollupStatistics` by default)
+        from the rollup cube instead of messages. The cube is built (or loaded) on the first call
+        (see `update_rollup`). Returns None when the cube can not be used: some of the statistics
+        is not supported by it or some of the conversations is not a parsed conversation of this
+        archive (conversation restricted by a query to some time range or senders for example).
+
+        :param conversations: list of parsed conversations
+        :param statistics_classes: accumulator classes of statistics to compute
+        :return: report with computed statistics or None
+        """
+        if statistics_classes is not None and any(s not in ROLLUP_STATISTICS for s in statistics_classes):
+            return None
+
+        positions = {id(conversation): i for i, conversation in enumerate(self.conversations)}
+        indices = [positions.get(id(conversation)) for conversation in conversations]
+        if None in indices:
+            return None
+
+        if self.rollup is None or len(self.rollup) != len(self.conversations):
+            self.update_rollup()
+
+        with self.instrumentation.stage('statistics.rollup'):
+            return RollupStatistics(self.rollup, self.exhaustive_lists, indices,
+                                    **self.statistics_options).run(statistics_classes)
+
+    def rollup_result(self, statistic, conversations: List[ColumnarConversation],
+                      compute: Callable[[], tuple]) -> tuple:
+        """
+        Returns result of statistic computed from the rollup cube when possible (see `rollup_stats`)
+        or by specified function otherwise.
+        """
+        report = self.rollup_stats(conversations, [statistic])
+        return compute() if report is None else report.accumulators[0].result()
+
+    def statistics_engine(self, statistics_classes: list = None) -> statistics.StatisticsEngine:
+        """
+        Creates engine computing specified statistics (all statistics by default) with settings
+        of this instance.
+        """
+        return statistics.StatisticsEngine(self.my_name, self.exhaustive_lists, statistics_classes,
+                                           timezone=self.timezone, people=self.people, **self.statistics_options)
+
+    def write_conversation_reports(self, conversations: List[ColumnarConversation], output_directory: str,
+                                   output_format: str = 'text', min_messages: int = 100) -> statistics.Report:
+        """
+        Computes global statistics and writes report of each conversation with at least
+        `min_messages` messages to its own file in specified directory, all in a single pass
+        over the messages. Report of each conversation is written as soon as it is computed,
+        so memory does not grow with the number of conversations. When more than one worker
+        is configured, conversations are processed in parallel by pool of worker processes.
+
+        :param conversations: list of conversations
+        :param output_directory: directory for the reports of conversations (created if needed)
+        :param output_format: format of the reports (text, json, csv or html)
+        :param min_messages: minimal number of messages of conversation to write its report
+        :return: report with global statistics
+        """
+        os.makedirs(output_directory, exist_ok=True)
+        engine = self.statistics_engine()
+        writer = ConversationReportWriter(self.my_name, output_directory, output_format)
+
+        with self.instrumentation.stage('statistics.conversations'):
+            if self.workers == 1 or len(conversations) < 2:
+                return engine.run(conversations, lambda c: len(c) >= min_messages, self.instrumentation, writer)
+
+            # Conversations are split to chunks of similar number of messages, each chunk
+            # is processed by one worker and global results of the chunks are merged.
+            chunk_messages = sum(len(c) for c in conversations) / (self.workers * 4) + 1
+            chunks = [[]]
+            chunk_size = 0
+            for conversation in conversations:
+                if chunk_size >= chunk_messages:
+                    chunks.append([])
+                    chunk_size = 0
+                chunks[-1].append(conversation)
+                chunk_size += len(conversation)
+
+            report = statistics.Report(self.my_name, engine.create_accumulators())
+            with multiprocessing.Pool(min(self.workers, len(chunks))) as pool:
+                tasks = [(engine, chunk, writer, min_messages) for chunk in chunks]
+                for accumulators in pool.imap(_conversation_reports, tasks):
+                    for accumulator, global_accumulator in zip(accumulators, report.accumulators):
+                        global_accumulator.merge(accumulator)
+            return report
+
+    @staticmethod
+    def render_report(report: statistics.Report):
+        """
+        Prints global statistics from specified report.
+        """
+        TextOutput().write_statistics(report.results().statistics, stdout)
+
+    @staticmethod
+    def write_report(report: statistics.Report, output_format: str = 'text', f: TextIO = None):
+        """
+        Writes global statistics and statistics of individual conversations from specified report
+        in specified format (text, json, csv or html).
+
+        :param report: report with computed statistics
+        :param output_format: format of the output
+        :param f: file to write the output to (standard output by default)
+        """
+        create_output(output_format).write(report.results(), stdout if f is None else f)
+
+    @staticmethod
+    def print_result(name: str, result: tuple) -> tuple:
+        """
+        Prints result of statistic with specified name as text and returns it.
+        """
+        separator()
+        for line in TextOutput().lines(name, result):
+            print(line)
+        return result
+
+    def dump_metrics(self) -> None:
+        """
+        Stops profiling and writes summary of collected metrics as JSON to file specified
+        by `metrics_path` setting (standard output when not set).
+        """
+        self.instrumentation.stop()
+        self.instrumentation.dump(self.metrics_path)
 
     def all_global_stats(self):
         self.all_stats(self.conversations)
@@ -229,51 +756,100 @@ class FacebookStatistics:
     # archive and user.
     # =============================================================
 
-    def global_stats(self, conversations: List[NamedConversation]):
-        statistics.general_stats(self.my_name, conversations)
+    def global_stats(self, conversations: List[ColumnarConversation]):
+        return self.print_result('general_stats', statistics.general_stats(self.my_name, conversations))
+
+    def hourly_histogram(self, conversations: List[ColumnarConversation]):
+        return self.print_result('hourly_histogram', self.rollup_result(
+            statistics.HourlyHistogram, conversations, lambda: statistics.hourly_histogram(conversations)))
+
+    def years_histogram(self, conversations: List[ColumnarConversation]):
+        return self.print_result('yearly_histogram', self.rollup_result(
+            statistics.YearlyHistogram, conversations, lambda: statistics.yearly_histogram(conversations)))
+
+    def day_in_week_histogram(self, conversations: List[ColumnarConversation]):
+        return self.print_result('day_in_week_histogram', self.rollup_result(
+            statistics.DayInWeekHistogram, conversations, lambda: statistics.day_in_week_histogram(conversations)))
+
+    def msg_lenghts(self, conversations: List[ColumnarConversation]):
+        return self.print_result('messages_lengths', statistics.messages_lengths(self.my_name, conversations))
+
+    def top_conversations_by_chars(self, conversations: List[ColumnarConversation]):
+        return self.print_result('top_conversations_by_chars', self.rollup_result(
+            statistics.TopConversationsByChars, conversations,
+            lambda: statistics.top_conversations_by_chars(self.my_name, conversations, self.exhaustive_lists)))
+
+    def top_conversations_by_messages(self, conversations: List[ColumnarConversation]):
+        return self.print_result('top_conversations_by_messages', self.rollup_result(
+            statistics.TopConversationsByMessages, conversations,
+            lambda: statistics.top_conversations_by_messages(self.my_name, conversations, self.exhaustive_lists)))
 
-    def hourly_histogram(self, conversations: List[NamedConversation]):
-        statistics.hourly_histogram(conversations)
+    def conversation_people_variability(self, conversations: List[ColumnarConversation]):
+        return self.print_result('conversation_people_variability', self.rollup_result(
+            statistics.ConversationPeopleVariability, conversations,
+            lambda: statistics.conversation_people_variability(self.my_name, conversations)))
 
-    def years_histogram(self, conversations: List[NamedConversation]):
-        statistics.yearly_histogram(conversations)
+    def msgs_before_reply(self, conversations: List[ColumnarConversation]):
+        return self.print_result('msgs_before_reply', statistics.msgs_before_reply(self.my_name, conversations))
 
-    def day_in_week_histogram(self, conversations: List[NamedConversation]):
-        statistics.day_in_week_histogram(conversations)
+    def time_before_reply(self, conversations: List[ColumnarConversation]):
+        return self.print_result('time_before_reply', statistics.time_before_reply(self.my_name, conversations))
 
-    def msg_lenghts(self, conversations: List[NamedConversation]):
-        statistics.messages_lengths(self.my_name, conversations)
+    def most_used_words(self, conversations: List[ColumnarConversation]):
+        return self.print_result('most_used_words',
+                                 statistics.most_used_words(self.my_name, conversations, self.exhaustive_lists,
+                                                            **self.statistics_options))
 
-    def top_conversations_by_chars(self, conversations: List[NamedConversation]):
-        statistics.top_conversations_by_chars(self.my_name, conversations, self.exhaustive_lists)
+    def who_started_conv(self, conversations: List[ColumnarConversation]):
+        return self.print_result('who_started_conv', statistics.who_started_conv(self.my_name, conversations))
 
-    def top_conversations_by_messages(self, conversations: List[NamedConversation]):
-        statistics.top_conversations_by_messages(self.my_name, conversations, self.exhaustive_lists)
+    def reply_latency(self, conversations: List[ColumnarConversation]):
+        return self.print_result('reply_latency',
+                                 statistics.reply_latency(self.my_name, conversations, self.exhaustive_lists))
 
-    def conversation_people_variability(self, conversations: List[NamedConversation]):
-        statistics.conversation_people_variability(self.my_name, conversations)
 
-    def msgs_before_reply(self, conversations: List[NamedConversation]):
-        statistics.msgs_before_reply(self.my_name, conversations)
+# Instance of FacebookStatistics used by worker process of parallel parsing.
+_worker_stats: FacebookStatistics = None
 
-    def time_before_reply(self, conversations: List[NamedConversation]):
-        statistics.time_before_reply(self.my_name, conversations)
 
-    def most_used_words(self, conversations: List[NamedConversation]):
-        statistics.most_used_words(self.my_name, conversations, self.exhaustive_lists)
+def _init_worker(stats: FacebookStatistics):
+    global _worker_stats
+    _worker_stats = stats
+    _worker_stats.archive.reopen()
+    # Processes may be forked, so metrics and errors already collected by the parent are dropped.
+    _worker_stats.instrumentation = stats.instrumentation.copy_settings()
+    _worker_stats.errors = ErrorIndex()
+    _worker_stats.instrumentation.start()
 
-    def who_started_conv(self, conversations: List[NamedConversation]):
-        statistics.who_started_conv(self.my_name, conversations)
+
+def _parse_conversation(thread_dir: str) -> Tuple[ColumnarConversation, Instrumentation, List[ParseError]]:
+    # Metrics and errors collected by worker are sent back together with the conversation.
+    prefetched = _worker_stats.prefetch([thread_dir])
+    try:
+        conversation = _worker_stats.parse_conversation(thread_dir, prefetched)
+    finally:
+        if prefetched is not None:
+            prefetched.close()
+    return conversation, _worker_stats.instrumentation.take(), _worker_stats.errors.take()
+
+
+def _conversation_reports(task) -> List[statistics.Accumulator]:
+    engine, conversations, writer, min_messages = task
+    return engine.run(conversations, lambda c: len(c) >= min_messages, conversation_results=writer).accumulators
 
 
 if __name__ == '__main__':
     print('You invoked script as interactive shell.')
     separator()
-    print('Please enter path to unzipped Facebook export ' +
+    print('Please enter path to Facebook export ZIP file or unzipped export ' +
           'directory (the one which contains sub-folder `messages`).')
 
     # Check if user provided argument and wants to use it as root folder for
-    # generating statistics from.
+    # generating statistics from. Optional second argument specifies format of
+    # the report (text, json, csv or html). Optional third argument specifies
+    # directory to which report of each conversation is written as separate file.
+    output_format = argv[2] if len(argv) > 2 else 'text'
+    conversations_directory = argv[3] if len(argv) > 3 else None
     if len(argv) > 1 and len(argv[1]) > 0:
         p = argv[1]
         print('Using provided argument as path: ', argv[1])
@@ -282,27 +858,48 @@ if __name__ == '__main__':
 
     # Verify that provided path is valid Facebook export archive by checking
     # the presence of most important folders and files.
-    if not path.isdir(path.join(p, 'messages')):
+    if not open_archive(p).isdir('messages'):
         separator()
         print('Error: Provided path does not contain required sub-folders html and messages!')
         exit(1)
 
+    # Files created by the script are stored in the export directory (or next to the ZIP file).
+    output_directory = path.dirname(path.abspath(p)) if path.isfile(p) else p
+
     # Everything seems to be alright so let's start parsing everything.
     separator()
-    stats = FacebookStatistics(p)
+    stats = FacebookStatistics(p, workers=os.cpu_count(), cache_path=default_cache_path(p), read_ahead=4,
+                               metrics_path=path.join(output_directory, 'messenger-stats-metrics.json'),
+                               errors_path=path.join(output_directory, 'messenger-stats-errors.jsonl'))
     stats.parse_all_messages()
 
-    # Generate global statistics.
-    stats.all_global_stats()
+    # Generate global statistics and statistics of each long enough conversation
+    # at once.
+    if conversations_directory is None:
+        report = stats.compute_stats(stats.conversations, per_conversation=lambda c: len(c) >= 100)
+    else:
+        report = stats.write_conversation_reports(stats.conversations, conversations_directory, output_format)
+        print(f'Reports of conversations written to {conversations_directory}')
 
-    print('\n\n')
-    print('Printing statistics for each conversation. Conversations with less than 100 messages will be skipped.')
-    print('\n\n')
+    if output_format == 'text':
+        results = report.results()
+        output = TextOutput()
+        output.write_statistics(results.statistics, stdout)
 
-    for conversation in stats.conversations:
-        if len(conversation[2]) >= 100:
+        if conversations_directory is None:
+            print('\n\n')
+            print('Printing statistics for each conversation. Conversations with less than 100 messages will be ' +
+                  'skipped.')
             print('\n\n')
-            print('+============================================================+')
-            print(f'|{conversation[0]:^60}|')
-            print('|============================================================|')
-            stats.all_stats([conversation])
+
+            for conversation in results.conversations:
+                output.write_conversation(conversation.name, conversation.statistics, stdout)
+    else:
+        # Structured reports are written to a file next to the export.
+        report_path = path.join(output_directory, f'messenger-stats-report.{output_format}')
+        with open(report_path, mode='w', encoding='utf-8', newline='') as f:
+            stats.write_report(report, output_format, f)
+        print(f'Report written to {report_path}')
+
+    # Write metrics of this run.
+    stats.dump_metrics()
@@ -0,0 +1,359 @@
+import csv
+import html
+import json
+import re
+import zlib
+from os import path
+from string import Template
+from typing import List, TextIO, Dict
+
+from results import ReportResults, Results, GeneralStatsResult, Histogram, TopConversations, PeopleVariability, \
+    MessagesLengthsResult, MessagesBeforeReplyResult, TimeBeforeReplyResult, WhoStartedResult, MostUsedWordsResult, \
+    LatencyDistribution, ReplyLatencyResult, as_dict, flatten
+from utils import separator, safe_div, format_duration
+
+# Template of the HTML report.
+TEMPLATE_PATH = path.join(path.dirname(path.abspath(__file__)), 'index.html')
+
+# Approximate number of characters of the first Harry Potter book.
+HARRY_POTTER_CHARACTERS = 500000
+
+
+class Output:
+    """
+    Base class of output backends. Backend writes results of all statistics computed by
+    `StatisticsEngine` (see `Report.results`) to a text file in its format.
+    """
+
+    def write(self, report: ReportResults, f: TextIO) -> None:
+        raise NotImplementedError
+
+
+class TextOutput(Output):
+    """
+    Human readable plain text output. Each statistic is formatted by the method named
+    after the statistic.
+    """
+
+    def lines(self, name: str, result: tuple) -> List[str]:
+        """
+        Returns lines of text describing result of the statistic with specified name.
+        """
+        return getattr(self, name)(result)
+
+    def write_statistics(self, results: Results, f: TextIO) -> None:
+        for name, result in results.items():
+            separator(file=f)
+            for line in self.lines(name, result):
+                print(line, file=f)
+
+    def write_conversation(self, name: str, results: Results, f: TextIO) -> None:
+        print('\n\n', file=f)
+        print('+============================================================+', file=f)
+        print(f'|{name:^60}|', file=f)
+        print('|============================================================|', file=f)
+        self.write_statistics(results, f)
+
+    def write(self, report, f):
+        self.write_statistics(report.statistics, f)
+
+        for conversation in report.conversations:
+            self.write_conversation(conversation.name, conversation.statistics, f)
+
+    @staticmethod
+    def general_stats(r: GeneralStatsResult) -> List[str]:
+        return [
+            f'You have exchanged {r.message_count} messages total.',
+            f'You have sent {r.sent_messages} ({round(safe_div(r.sent_messages*100, r.message_count), 2)}%) ' +
+            f'messages and received {r.received_messages} ' +
+            f'({round(safe_div(r.received_messages*100, r.message_count), 2)}%) total.',
+            f'You have exchanged {r.characters_count} characters in messages total. ' +
+            f'({round(safe_div(r.sent_characters*100, r.characters_count), 2)}% were sent by you)',
+            f'You are in {r.conversation_count} conversations.',
+            f'You talked to {r.people_count} different people.'
+        ]
+
+    @staticmethod
+    def top_conversations_by_chars(r: TopConversations) -> List[str]:
+        lines = ['Conversations by characters exchanged:']
+        for conversation_name, amounts in r.conversations.items():
+            lines.append(f'{conversation_name}\t{amounts.total} ({amounts.sent} sent, {amounts.received} received)')
+
+        if not r.complete:
+            lines.append('And more...')
+        return lines
+
+    @staticmethod
+    def top_conversations_by_messages(r: TopConversations) -> List[str]:
+        lines = ['Conversations by messages exchanged:']
+        for conversation_name, amounts in r.conversations.items():
+            lines.append(f'{conversation_name}\t{amounts.total}' +
+                         f' ({round(safe_div(amounts.total, r.total_messages) * 100, 2)}% of all msgs)' +
+                         f' ({amounts.sent} sent, {amounts.received} received)')
+
+        if not r.complete:
+            lines.append('And more...')
+        return lines
+
+    @staticmethod
+    def conversation_people_variability(r: PeopleVariability) -> List[str]:
+        return [f'{percent}% messages were sent by {people} people.' for percent, people in r.people.items()]
+
+    @staticmethod
+    def hourly_histogram(r: Histogram) -> List[str]:
+        return ['Hourly histogram (You exchange most messages at):'] + \
+               [f'{i:02}:00 - {i+1:02}:00\t{count}' for i, count in r.counts.items()]
+
+    @staticmethod
+    def yearly_histogram(r: Histogram) -> List[str]:
+        return ['Yearly histogram (You exchange most messages in the year):'] + \
+               [f'{year}\t{count}' for year, count in r.counts.items()]
+
+    @staticmethod
+    def day_in_week_histogram(r: Histogram) -> List[str]:
+        return ['Day in week histogram (You exchange most messages at):'] + \
+               [f'{day}\t{count}' for day, count in r.counts.items()]
+
+    @staticmethod
+    def messages_lengths(r: MessagesLengthsResult) -> List[str]:
+        return [
+            f'Longest message has {r.longest} characters',
+            f'  Your longest message has {r.my_longest} characters',
+            f'  Longest message you received has {r.received_longest} characters',
+            f'Average message length is {round(r.average, 2)} characters',
+            f'  Your average is {round(r.my_average, 2)} characters',
+            f'  Average of messages you received {round(r.received_average, 2)} characters',
+            f'Based on {r.message_count} messages'
+        ]
+
+    @staticmethod
+    def msgs_before_reply(r: MessagesBeforeReplyResult) -> List[str]:
+        return [
+            f'On average other person responded after {round(r.messages_before_other_reply, 2)} your messages.',
+            f'On average you responded after {round(r.messages_before_my_reply, 2)} messages from other person.'
+        ]
+
+    @staticmethod
+    def time_before_reply(r: TimeBeforeReplyResult) -> List[str]:
+        return [
+            f'On average other person responded after {round(r.seconds_before_other_reply, 2)} seconds.',
+            f'On average you responded after {round(r.seconds_before_my_reply, 2)} seconds.'
+        ]
+
+    @staticmethod
+    def who_started_conv(r: WhoStartedResult) -> List[str]:
+        return [
+            f'Other people started conversation with you {r.other_starts} times.',
+            f'You started conversation {r.my_starts} times.'
+        ]
+
+    @staticmethod
+    def latency_lines(person: str, distribution: LatencyDistribution) -> List[str]:
+        lines = [f'{person}\t{distribution.replies} replies\tmedian {format_duration(distribution.p50)}' +
+                 f'\t90% within {format_duration(distribution.p90)}' +
+                 f'\t99% within {format_duration(distribution.p99)}']
+        lines += [f'  {interval}\t{count}' for interval, count in distribution.histogram.items()]
+        return lines
+
+    def reply_latency(self, r: ReplyLatencyResult) -> List[str]:
+        lines = ['Reply times (how long it takes to reply to the previous message):']
+        if r.mine is not None:
+            lines += self.latency_lines('You', r.mine)
+        for person, distribution in r.people.items():
+            lines += self.latency_lines(person, distribution)
+
+        if not r.complete:
+            lines.append('And more...')
+        return lines
+
+    @staticmethod
+    def most_used_words(r: MostUsedWordsResult) -> List[str]:
+        if r.approximate:
+            lines = [f'Words are counted approximately, each count may be lower by at most {r.error}.']
+        else:
+            lines = [f'There are {r.different_words} different words in conversation(s).',
+                     f'You used {r.my_different_words} different words.']
+
+        lines += ['', 'Most used words in conversations:']
+        lines += [f'{word}\t{word_count}' for word, word_count in r.words.items()]
+        lines += ['', 'Most used words by you:']
+        lines += [f'{word}\t{word_count}' for word, word_count in r.my_words.items()]
+        return lines
+
+
+class JsonOutput(Output):
+    """
+    Writes all results as single JSON document.
+    """
+
+    def write(self, report, f):
+        json.dump(as_dict(report), f, ensure_ascii=False, indent=2)
+
+
+class CsvOutput(Output):
+    """
+    Writes one row for each value of each statistic. Rows of global statistics have
+    empty conversation column. File should be opened with `newline=''`.
+    """
+
+    def write(self, report, f):
+        writer = csv.writer(f)
+        writer.writerow(['conversation', 'statistic', 'key', 'value'])
+        self.write_statistics(writer, '', report.statistics)
+
+        for conversation in report.conversations:
+            self.write_statistics(writer, conversation.name, conversation.statistics)
+
+    @staticmethod
+    def write_statistics(writer, conversation_name: str, results: Results) -> None:
+        for name, result in results.items():
+            for key, value in flatten(result):
+                writer.writerow([conversation_name, name, key, value])
+
+
+class HtmlOutput(Output):
+    """
+    Renders HTML report from the `index.html` template. Header of the report shows general
+    statistics, every other statistic is rendered as separate section built from lines
+    of its text output (lines with tabs are rendered as rows of table).
+    """
+
+    titles = {
+        'general_stats': 'General statistics',
+        'top_conversations_by_chars': 'Top conversations by characters',
+        'top_conversations_by_messages': 'Top conversations by messages',
+        'conversation_people_variability': 'People variability',
+        'hourly_histogram': 'Hourly histogram',
+        'yearly_histogram': 'Yearly histogram',
+        'day_in_week_histogram': 'Day in week histogram',
+        'messages_lengths': 'Messages lengths',
+        'msgs_before_reply': 'Messages before reply',
+        'time_before_reply': 'Time before reply',
+        'who_started_conv': 'Who started conversation',
+        'reply_latency': 'Reply times',
+        'most_used_words': 'Most used words'
+    }
+
+    def __init__(self, template_path: str = TEMPLATE_PATH):
+        with open(template_path, encoding='utf-8') as f:
+            self.template = Template(f.read())
+        self.text = TextOutput()
+
+    @staticmethod
+    def number(value: int) -> str:
+        return f'{value:,}'.replace(',', ' ')
+
+    def statistic_html(self, name: str, result: tuple, heading: str) -> List[str]:
+        parts = [f'<{heading}>{html.escape(self.titles.get(name, name))}</{heading}>']
+        rows = []
+
+        for line in self.text.lines(name, result) + ['']:
+            if '\t' in line:
+                rows.append(line)
+                continue
+
+            if rows:
+                parts.append('<table>')
+                for row in rows:
+                    cells = ''.join(f'<td>{html.escape(cell)}</td>' for cell in row.split('\t'))
+                    parts.append(f'<tr>{cells}</tr>')
+                parts.append('</table>')
+                rows = []
+
+            if line:
+                parts.append(f'<p>{html.escape(line)}</p>')
+
+        return parts
+
+    @staticmethod
+    def section_html(css_class: str, parts: List[str]) -> str:
+        return '\n'.join([f'<section class="{css_class}">', '    <div class="container">'] +
+                         [f'        {part}' for part in parts] +
+                         ['    </div>', '</section>'])
+
+    @staticmethod
+    def talkativeness(general: GeneralStatsResult) -> Dict[str, str]:
+        sent = general.sent_characters
+        received = general.characters_count - sent
+
+        if received > sent:
+            return {'talkativeness': '🤐 SHUT-MOUTH',
+                    'talkativeness_description': f'You receive <b>{round(safe_div(received, sent), 1)}&times;</b> ' +
+                                                 'more characters than you send.'}
+        return {'talkativeness': '🗣️ LOQUACIOUS',
+                'talkativeness_description': f'You send <b>{round(safe_div(sent, received), 1)}&times;</b> ' +
+                                             'more characters than you receive.'}
+
+    def write(self, report, f):
+        general = report.statistics.get('general_stats', GeneralStatsResult(0, 0, 0, 0, 0, 0, 0))
+
+        sections = [self.section_html('statistic', self.statistic_html(name, result, 'h1'))
+                    for name, result in report.statistics.items()]
+
+        for conversation in report.conversations:
+            parts = [f'<h1>{html.escape(conversation.name)}</h1>']
+            for name, result in conversation.statistics.items():
+                parts += self.statistic_html(name, result, 'h2')
+            sections.append(self.section_html('conversation', parts))
+
+        f.write(self.template.substitute(
+            title=html.escape(f'Messenger statistics of {report.self_name}'),
+            name=html.escape(report.self_name or ''),
+            sent_messages=self.number(general.sent_messages),
+            sent_percent=round(safe_div(general.sent_messages * 100, general.message_count), 2),
+            received_messages=self.number(general.received_messages),
+            received_percent=round(safe_div(general.received_messages * 100, general.message_count), 2),
+            characters=self.number(general.characters_count),
+            harry_potters=round(general.characters_count / HARRY_POTTER_CHARACTERS, 1),
+            sections='\n'.join(sections),
+            **self.talkativeness(general)
+        ))
+
+
+# Output backends by names of their formats.
+OUTPUTS = {
+    'text': TextOutput,
+    'json': JsonOutput,
+    'csv': CsvOutput,
+    'html': HtmlOutput
+}
+
+
+# Extensions of report files of formats whose extension differs from their name.
+FILE_EXTENSIONS = {'text': 'txt'}
+
+
+class ConversationReportWriter:
+    """
+    Writes report of each conversation to its own file in specified directory as soon as
+    results of the conversation are computed (see `StatisticsEngine.run`). Files are named
+    after conversations, names are made unique by hash of name and time of first message.
+    """
+
+    def __init__(self, self_name: str, directory: str, output_format: str = 'text'):
+        self.self_name = self_name
+        self.directory = directory
+        self.output_format = output_format
+        self.output = create_output(output_format)
+        self.paths: List[str] = []
+
+    def file_name(self, conversation) -> str:
+        name = re.sub(r'[^\w.-]+', '_', conversation.name).strip('._')[:80] or 'conversation'
+        first_timestamp = int(conversation.timestamps[0]) if len(conversation) else 0
+        checksum = zlib.crc32(f'{conversation.name}\0{first_timestamp}'.encode())
+        return f'{name}_{checksum:08x}.{FILE_EXTENSIONS.get(self.output_format, self.output_format)}'
+
+    def __call__(self, conversation, results: Results) -> None:
+        report_path = path.join(self.directory, self.file_name(conversation))
+        with open(report_path, mode='w', encoding='utf-8', newline='') as f:
+            self.output.write(ReportResults(self.self_name, results, []), f)
+        self.paths.append(report_path)
+
+
+def create_output(output_format: str) -> Output:
+    """
+    Creates output backend of specified format (text, json, csv or html).
+    """
+    if output_format not in OUTPUTS:
+        raise ValueError(f'Unknown output format {output_format!r}, expected one of: {", ".join(OUTPUTS)}')
+    return OUTPUTS[output_format]()
@@ -0,0 +1,176 @@
+import json
+import mmap
+import os
+import struct
+from typing import List, Iterator, BinaryIO
+
+import numpy as np
+
+from columnar import ColumnarConversation
+
+MAGIC = b'MSGSTATS'
+PACKED_VERSION = 1
+
+# Magic, version, number of conversations, number of messages, then offset and size of
+# metadata, offsets of the table and of the timestamp, sender, length and text offset
+# columns and offset and size of the text heap (all offsets are from the start of the file).
+HEADER = struct.Struct('<8sIIqqqqqqqqqq')
+
+# Row of the conversation table: first message and number of messages of the conversation
+# in the columns, start and size of its texts in the text heap.
+TABLE_ROW = np.dtype([('message_start', '<i8'), ('message_count', '<i8'), ('text_start', '<i8'),
+                      ('text_size', '<i8')])
+
+# Sections are aligned, so the columns can be viewed as arrays without copying.
+ALIGNMENT = 8
+
+
+class PackedConversations:
+    """
+    Parsed conversations stored in single binary file which is memory mapped when opened.
+    Conversations are `ColumnarConversation` instances whose arrays and texts are views
+    of the mapped file, so opening the file does not read or copy messages and processes
+    opening the same file share its pages through the page cache of the operating system.
+
+    Layout of the file (little endian):
+
+    - header (see `HEADER`)
+    - metadata - UTF-8 JSON with name of "myself", settings and name, participants, senders
+      and thread id of each conversation
+    - table - one `TABLE_ROW` per conversation
+    - timestamps (int64), sender ids (int16) and lengths (int32) of all messages of all
+      conversations, conversations are stored one after another
+    - text offsets (int64) - n + 1 offsets of each conversation relative to its own texts
+    - text heap - UTF-8 encoded texts of all messages
+
+    Files are written by `write`.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mmap) < HEADER.size:
+            raise ValueError(f'File {file_path} is not a file with packed conversations!')
+
+        (magic, version, conversation_count, message_count, metadata_offset, metadata_size, table_offset,
+         timestamps_offset, sender_ids_offset, lengths_offset, offsets_offset, text_offset,
+         text_size) = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f'File {file_path} is not a file with packed conversations!')
+        if version != PACKED_VERSION:
+            raise ValueError(f'Unsupported version of packed conversations: {version}!')
+
+        metadata = json.loads(self.mmap[metadata_offset:metadata_offset + metadata_size].decode())
+        self.self_name: str = metadata['self_name']
+        self.settings: dict = metadata['settings']
+        self.conversation_info: List[list] = metadata['conversations']  # [name, participants, senders, thread]
+
+        buffer = self.mmap
+        self.table = np.frombuffer(buffer, TABLE_ROW, conversation_count, table_offset)
+        self.timestamps = np.frombuffer(buffer, '<i8', message_count, timestamps_offset)
+        self.sender_ids = np.frombuffer(buffer, '<i2', message_count, sender_ids_offset)
+        self.lengths = np.frombuffer(buffer, '<i4', message_count, lengths_offset)
+        self.offsets = np.frombuffer(buffer, '<i8', message_count + conversation_count, offsets_offset)
+        self.text = memoryview(buffer)[text_offset:text_offset + text_size]
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, i: int) -> ColumnarConversation:
+        """
+        Returns i-th conversation, its arrays and texts are views of the mapped file.
+        """
+        message_start, message_count, text_start, text_size = self.table[i].tolist()
+        name, participants, senders, thread_id = self.conversation_info[i]
+        start, stop = message_start, message_start + message_count
+
+        # Each conversation has one more offset than messages.
+        return ColumnarConversation(name, participants, senders, self.timestamps[start:stop],
+                                    self.sender_ids[start:stop], self.lengths[start:stop],
+                                    self.text[text_start:text_start + text_size],
+                                    self.offsets[start + i:stop + i + 1], thread_id=thread_id)
+
+    def __iter__(self) -> Iterator[ColumnarConversation]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self) -> None:
+        """
+        Unmaps the file. Raises BufferError while some of the returned conversations
+        (or arrays derived from them without copying) are still referenced.
+        """
+        self.table = self.timestamps = self.sender_ids = self.lengths = self.offsets = None
+        self.text.release()
+        self.mmap.close()
+
+    @staticmethod
+    def write(file_path: str, conversations: List[ColumnarConversation], self_name: str,
+              settings: dict = None) -> None:
+        """
+        Writes conversations to binary file which can be opened by `PackedConversations`.
+        File is written to temporary file first and then replaces existing file, so processes
+        which have the existing file opened keep their (unchanged) mapping.
+
+        :param file_path: path to the file
+        :param conversations: conversations to write
+        :param self_name: name of the person which is considered as "myself"
+        :param settings: settings which affected the parsing of the conversations
+        """
+        metadata = json.dumps({
+            'self_name': self_name,
+            'settings': settings or {},
+            'conversations': [[c.name, c.participants, c.senders, c.thread_id] for c in conversations],
+        }, ensure_ascii=False).encode()
+
+        message_count = sum(len(c) for c in conversations)
+        table = np.zeros(len(conversations), dtype=TABLE_ROW)
+        message_start = text_start = 0
+        for row, conversation in zip(table, conversations):
+            text_size = int(conversation.offsets[-1] - conversation.offsets[0])
+            row['message_start'], row['message_count'] = message_start, len(conversation)
+            row['text_start'], row['text_size'] = text_start, text_size
+            message_start += len(conversation)
+            text_start += text_size
+
+        def aligned(offset: int) -> int:
+            return -(-offset // ALIGNMENT) * ALIGNMENT
+
+        metadata_offset = HEADER.size
+        table_offset = aligned(metadata_offset + len(metadata))
+        timestamps_offset = aligned(table_offset + table.nbytes)
+        sender_ids_offset = aligned(timestamps_offset + 8 * message_count)
+        lengths_offset = aligned(sender_ids_offset + 2 * message_count)
+        offsets_offset = aligned(lengths_offset + 4 * message_count)
+        text_offset = aligned(offsets_offset + 8 * (message_count + len(conversations)))
+
+        def pad(f: BinaryIO, offset: int) -> None:
+            f.write(b'\0' * (offset - f.tell()))
+
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, PACKED_VERSION, len(conversations), message_count, metadata_offset,
+                                len(metadata), table_offset, timestamps_offset, sender_ids_offset, lengths_offset,
+                                offsets_offset, text_offset, text_start))
+            f.write(metadata)
+            pad(f, table_offset)
+            f.write(table.tobytes())
+
+            for offset, column, dtype in ((timestamps_offset, 'timestamps', '<i8'),
+                                          (sender_ids_offset, 'sender_ids', '<i2'),
+                                          (lengths_offset, 'lengths', '<i4')):
+                pad(f, offset)
+                for conversation in conversations:
+                    f.write(getattr(conversation, column).astype(dtype).tobytes())
+
+            pad(f, offsets_offset)
+            for conversation in conversations:
+                f.write((conversation.offsets - conversation.offsets[0]).astype('<i8').tobytes())
+
+            pad(f, text_offset)
+            for conversation in conversations:
+                # Conversation may be a slice sharing text buffer with other messages.
+                f.write(memoryview(conversation.text)[int(conversation.offsets[0]):int(conversation.offsets[-1])])
+
+        os.replace(temporary_path, file_path)
@@ -0,0 +1,42 @@
+from typing import List, Dict, Iterable
+
+import numpy as np
+
+# Id reserved for the person whose archive is being processed.
+SELF_ID = 0
+
+
+class PeopleRegistry:
+    """
+    Registry of all people (senders and participants) of an archive. Each name is
+    interned once and then referred to by its integer id, so conversations and
+    statistics work with small integers and names are resolved only when results
+    are printed. The person whose archive is processed always has id `SELF_ID`.
+    """
+
+    def __init__(self, self_name: str):
+        self.self_name = self_name
+        self.names: List[str] = [self_name]
+        self.ids: Dict[str, int] = {self_name: SELF_ID}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str) -> int:
+        person_id = self.ids.get(name)
+        if person_id is None:
+            person_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return person_id
+
+    def intern_all(self, names: Iterable[str]) -> np.ndarray:
+        return np.array([self.intern(name) for name in names], dtype=np.int32)
+
+    def id(self, name: str) -> int:
+        """
+        Returns id of person with specified name or -1 if the person is not known.
+        """
+        return self.ids.get(name, -1)
+
+    def name(self, person_id: int) -> str:
+        return self.names[person_id]
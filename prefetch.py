@@ -0,0 +1,141 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Iterable, Iterator, Tuple, List, Optional
+
+from archive import Archive, ArchiveFile
+from ingest import CHUNK_SIZE
+from instrumentation import Instrumentation
+
+# Default limit of total size (in bytes) of files read ahead of the parser.
+READ_AHEAD_BYTES = 64 << 20
+
+
+class PrefetchedFile:
+    """
+    Read-only binary file over content of a file read by `Prefetcher` as a list of chunks.
+    Chunks are released as soon as they are read, so memory is returned while the file
+    is being parsed.
+    """
+
+    def __init__(self, chunks: List[bytes]):
+        self.chunks = deque(chunks)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            data = b''.join(self.chunks)
+            self.chunks.clear()
+            return data
+
+        # Chunks are read in the same size in which the file is decoded, so they are
+        # usually returned without copying.
+        parts = []
+        while size > 0 and self.chunks:
+            chunk = self.chunks.popleft()
+            if len(chunk) > size:
+                self.chunks.appendleft(chunk[size:])
+                chunk = chunk[:size]
+            parts.append(chunk)
+            size -= len(chunk)
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def close(self) -> None:
+        self.chunks.clear()
+
+    def __enter__(self) -> 'PrefetchedFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Prefetcher:
+    """
+    Reads files of an archive ahead of the parser by pool of reader threads, so waiting
+    on disk (or network) overlaps with parsing of already read files.
+
+    Files are returned in the order in which they were requested. At most `read_ahead`
+    files are being read or waiting for the parser at once and their total size (together
+    with the file currently parsed) is at most `max_bytes`. Next file is requested only
+    when the parser takes one of the read files, so memory used by read files stays
+    bounded regardless of the number and size of files. Files larger than `max_bytes`
+    are not read ahead, the parser streams them from the archive itself.
+
+    Files are read in chunks of the size in which the parser decodes them and returned
+    as a list of chunks (see `PrefetchedFile`), so no file is copied to one large buffer.
+
+    Time spent by reader threads reading files is recorded as `prefetch.read` stage,
+    time the parser spent waiting for files which were not read yet as `prefetch.wait`
+    and time spent by the parser between requests for files as `prefetch.parse`.
+    """
+
+    def __init__(self, archive: Archive, read_ahead: int = 4, readers: int = 2,
+                 instrumentation: Instrumentation = None, max_bytes: int = READ_AHEAD_BYTES):
+        """
+        :param archive: archive to read files from
+        :param read_ahead: maximal number of files read ahead of the parser
+        :param readers: number of reader threads
+        :param instrumentation: instrumentation to record the stages to
+        :param max_bytes: maximal total size of files read ahead of the parser
+        """
+        self.archive = archive
+        self.read_ahead = max(1, read_ahead)
+        self.readers = max(1, min(readers, self.read_ahead))
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.max_bytes = max_bytes
+
+    def read(self, file_path: str) -> Tuple[List[bytes], float]:
+        time_start = perf_counter()
+        with self.archive.open(file_path) as f:
+            chunks = list(iter(lambda: f.read(CHUNK_SIZE), b''))
+        return chunks, perf_counter() - time_start
+
+    def files(self, files: Iterable[ArchiveFile]) -> Iterator[Tuple[str, Optional[PrefetchedFile]]]:
+        """
+        Yields (path, content) pair of each of specified files in the same order. Content
+        is None for files which were not read ahead (because of their size).
+        """
+        files = iter(files)
+        instrumentation = self.instrumentation
+        executor = ThreadPoolExecutor(self.readers, thread_name_prefix='prefetch')
+        pending = deque()
+        reserved = 0  # total size of read files which were not parsed yet
+        following = next(files, None)
+
+        def submit() -> None:
+            nonlocal reserved, following
+            while following is not None and len(pending) < self.read_ahead:
+                if following.size > self.max_bytes:
+                    pending.append((following, None))
+                elif reserved + following.size <= self.max_bytes:
+                    reserved += following.size
+                    pending.append((following, executor.submit(self.read, following.path)))
+                else:
+                    return
+                following = next(files, None)
+
+        try:
+            submit()
+            while pending:
+                archive_file, future = pending.popleft()
+                if future is None:
+                    yield archive_file.path, None
+                    submit()
+                    continue
+
+                time_start = perf_counter()
+                chunks, read_seconds = future.result()
+                instrumentation.add('prefetch.wait', perf_counter() - time_start)
+                instrumentation.add('prefetch.read', read_seconds, sum(len(chunk) for chunk in chunks))
+
+                submit()
+
+                time_start = perf_counter()
+                yield archive_file.path, PrefetchedFile(chunks)
+                instrumentation.add('prefetch.parse', perf_counter() - time_start)
+
+                # The parsed file was released, so following files can be read.
+                reserved -= archive_file.size
+                submit()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
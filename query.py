@@ -0,0 +1,190 @@
+import copy
+import datetime
+from typing import List, Dict, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from columnar import ColumnarConversation
+from people import PeopleRegistry
+from timezones import DAY_MS
+
+# Time can be specified as datetime or as milliseconds since epoch.
+Time = Union[datetime.datetime, int]
+
+
+def to_milliseconds(time: Time) -> int:
+    if isinstance(time, datetime.datetime):
+        return int(time.timestamp() * 1000)
+    return int(time)
+
+
+class ConversationIndex:
+    """
+    Indexes of list of conversations used to answer queries without scanning all
+    messages.
+
+    Messages of each conversation are already sorted by time, so their timestamps serve
+    as sorted index of the conversation and messages in time range are found by binary
+    search. Times of first and last message of each conversation are used to skip
+    conversations outside of the range. Inverted indexes map each participant and each
+    sender to (sorted) indices of conversations they take part in. When registry of people
+    is specified (and conversations are bound to it), people are indexed by their ids.
+    """
+
+    def __init__(self, conversations: List[ColumnarConversation], people: PeopleRegistry = None):
+        self.conversations = conversations
+        self.people = people
+
+        self.first_timestamps = np.array([c.timestamps[0] if len(c) else 0 for c in conversations], dtype=np.int64)
+        self.last_timestamps = np.array([c.timestamps[-1] if len(c) else -1 for c in conversations], dtype=np.int64)
+        self.is_group = np.array([len(c.participants) > 2 for c in conversations], dtype=bool)
+
+        self.by_participant: Dict[Union[str, int], List[int]] = {}
+        self.by_sender: Dict[Union[str, int], List[int]] = {}
+
+        for i, conversation in enumerate(conversations):
+            if people is None:
+                participants, senders = conversation.participants, conversation.senders
+            else:
+                participants, senders = conversation.participant_ids.tolist(), conversation.person_ids.tolist()
+
+            for participant in set(participants):
+                self.by_participant.setdefault(participant, []).append(i)
+
+            # Only senders which really sent some message to the conversation are indexed.
+            for sender_id in np.unique(conversation.sender_ids).tolist():
+                self.by_sender.setdefault(senders[sender_id], []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def lookup(self, index: Dict[Union[str, int], List[int]], names: Iterable[str]) -> np.ndarray:
+        """
+        Returns indices of conversations listed under any of specified names in the index.
+        """
+        keys = set(names) if self.people is None else {self.people.id(name) for name in names}
+        indices = [i for key in keys for i in index.get(key, ())]
+        return np.array(indices, dtype=np.int64)
+
+    def query(self) -> 'Query':
+        return Query(self)
+
+
+class Query:
+    """
+    Query selecting conversations and their messages by time range, participants,
+    senders and type of conversation. Each filter returns new query, so queries can be
+    chained and reused:
+
+        index.query().last_days(90).with_participants('John Doe').conversations()
+
+    Result of the query is list of conversations which can be passed to statistics.
+    Conversations restricted to time range share memory with the indexed conversations,
+    filtering by senders copies selected messages.
+    """
+
+    def __init__(self, index: ConversationIndex):
+        self.index = index
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.participants: Optional[frozenset] = None
+        self.senders: Optional[frozenset] = None
+        self.group: Optional[bool] = None
+
+    def _with(self, **changes) -> 'Query':
+        query = copy.copy(self)
+        query.__dict__.update(changes)
+        return query
+
+    def between(self, start: Time = None, end: Time = None) -> 'Query':
+        """
+        Selects messages sent at or after `start` and before `end`.
+        """
+        return self._with(start=None if start is None else to_milliseconds(start),
+                          end=None if end is None else to_milliseconds(end))
+
+    def last_days(self, days: int, now: Time = None) -> 'Query':
+        """
+        Selects messages sent in last specified number of days (before `now`, current
+        time by default).
+        """
+        end = to_milliseconds(datetime.datetime.now() if now is None else now)
+        return self._with(start=end - days * DAY_MS, end=end)
+
+    def with_participants(self, *names: str) -> 'Query':
+        """
+        Selects conversations in which at least one of specified people participates.
+        """
+        return self._with(participants=frozenset(names))
+
+    def sent_by(self, *names: str) -> 'Query':
+        """
+        Selects messages sent by specified people.
+        """
+        return self._with(senders=frozenset(names))
+
+    def group_chats(self) -> 'Query':
+        return self._with(group=True)
+
+    def one_to_one(self) -> 'Query':
+        return self._with(group=False)
+
+    def conversation_indices(self) -> np.ndarray:
+        """
+        Returns indices of conversations which may contain selected messages.
+        """
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+
+        if self.participants is not None:
+            selected = np.zeros(len(index), dtype=bool)
+            selected[index.lookup(index.by_participant, self.participants)] = True
+            mask &= selected
+
+        if self.senders is not None:
+            selected = np.zeros(len(index), dtype=bool)
+            selected[index.lookup(index.by_sender, self.senders)] = True
+            mask &= selected
+
+        if self.group is not None:
+            mask &= index.is_group == self.group
+
+        if self.start is not None:
+            mask &= index.last_timestamps >= self.start
+        if self.end is not None:
+            mask &= index.first_timestamps < self.end
+
+        return np.flatnonzero(mask)
+
+    def restrict(self, conversation: ColumnarConversation) -> ColumnarConversation:
+        """
+        Restricts messages of the conversation to the time range and senders of this query.
+        """
+        timestamps = conversation.timestamps
+        start = 0 if self.start is None else int(np.searchsorted(timestamps, self.start, side='left'))
+        stop = len(conversation) if self.end is None else int(np.searchsorted(timestamps, self.end, side='left'))
+
+        if start != 0 or stop != len(conversation):
+            conversation = conversation.slice(start, stop)
+
+        if self.senders is not None:
+            # Mask of selected senders is looked up by sender ids of messages.
+            selected = np.array([sender in self.senders for sender in conversation.senders] or [False])
+            mask = selected[conversation.sender_ids]
+            if not mask.all():
+                conversation = conversation.select(np.flatnonzero(mask))
+
+        return conversation
+
+    def __iter__(self) -> Iterator[ColumnarConversation]:
+        conversations = self.index.conversations
+        for i in self.conversation_indices().tolist():
+            conversation = self.restrict(conversations[i])
+            if len(conversation):
+                yield conversation
+
+    def conversations(self) -> List[ColumnarConversation]:
+        """
+        Returns selected conversations with selected messages only.
+        """
+        return list(self)
@@ -0,0 +1,90 @@
+from typing import NamedTuple, List, Dict, Any, Iterator, Tuple, Optional
+
+# Results of individual statistics. Results are plain named tuples of numbers, strings,
+# lists and dicts, so they can be pickled, cached and converted to JSON.
+
+GeneralStatsResult = NamedTuple('GeneralStatsResult', [('message_count', int), ('sent_messages', int),
+                                                       ('received_messages', int), ('characters_count', int),
+                                                       ('sent_characters', int), ('conversation_count', int),
+                                                       ('people_count', int)])
+
+# Counts of messages in each bin (hour, year, day in week) in order of the bins.
+Histogram = NamedTuple('Histogram', [('counts', Dict[Any, int])])
+
+ConversationAmounts = NamedTuple('ConversationAmounts', [('total', int), ('sent', int), ('received', int)])
+
+# Conversations ordered by the amount (characters or messages) exchanged. When the list
+# is not complete, conversations with small amount are left out.
+TopConversations = NamedTuple('TopConversations', [('conversations', Dict[str, ConversationAmounts]),
+                                                   ('total_messages', int), ('complete', bool)])
+
+# Numbers of people who sent specified percentage of all messages.
+PeopleVariability = NamedTuple('PeopleVariability', [('people', Dict[float, int])])
+
+MessagesLengthsResult = NamedTuple('MessagesLengthsResult', [('longest', int), ('my_longest', int),
+                                                             ('received_longest', int), ('average', float),
+                                                             ('my_average', float), ('received_average', float),
+                                                             ('message_count', int)])
+
+MessagesBeforeReplyResult = NamedTuple('MessagesBeforeReplyResult', [('messages_before_other_reply', float),
+                                                                     ('messages_before_my_reply', float)])
+
+TimeBeforeReplyResult = NamedTuple('TimeBeforeReplyResult', [('seconds_before_other_reply', float),
+                                                             ('seconds_before_my_reply', float)])
+
+WhoStartedResult = NamedTuple('WhoStartedResult', [('my_starts', int), ('other_starts', int)])
+
+# Distribution of reply times of one person: number of replies, percentiles of reply
+# times (in seconds) and counts of replies in log-scale bins of reply times.
+LatencyDistribution = NamedTuple('LatencyDistribution', [('replies', int), ('p50', float), ('p90', float),
+                                                         ('p99', float), ('histogram', Dict[str, int])])
+
+# Distributions of my reply times (None when I never replied) and of other people ordered
+# by their number of replies. When the list is not complete, people with less replies are left out.
+ReplyLatencyResult = NamedTuple('ReplyLatencyResult', [('mine', Optional[LatencyDistribution]),
+                                                       ('people', Dict[str, LatencyDistribution]),
+                                                       ('complete', bool)])
+
+# Most used words with their counts. Approximate counts may be lower by at most `error`.
+MostUsedWordsResult = NamedTuple('MostUsedWordsResult', [('approximate', bool), ('error', int),
+                                                         ('different_words', int), ('my_different_words', int),
+                                                         ('words', Dict[str, int]), ('my_words', Dict[str, int])])
+
+# Results of statistics by names of the statistics (`general_stats` for example).
+Results = Dict[str, tuple]
+
+ConversationResults = NamedTuple('ConversationResults', [('name', str), ('statistics', Results)])
+ReportResults = NamedTuple('ReportResults', [('self_name', str), ('statistics', Results),
+                                             ('conversations', List[ConversationResults])])
+
+
+def as_dict(value: Any) -> Any:
+    """
+    Converts (nested) results to plain dicts and lists which can be serialized to JSON.
+    """
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        return {field: as_dict(getattr(value, field)) for field in value._fields}
+    if isinstance(value, dict):
+        return {key: as_dict(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [as_dict(item) for item in value]
+    return value
+
+
+def flatten(value: Any, prefix: str = '') -> Iterator[Tuple[str, Any]]:
+    """
+    Yields (key, value) pair for each number or string in (nested) results. Keys are
+    paths to the values separated by dots (`conversations.John Doe.sent` for example).
+    """
+    if isinstance(value, tuple) and hasattr(value, '_fields'):
+        items = ((field, getattr(value, field)) for field in value._fields)
+    elif isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = enumerate(value)
+    else:
+        yield prefix, value
+        return
+
+    for key, item in items:
+        yield from flatten(item, f'{prefix}.{key}' if prefix else str(key))
@@ -0,0 +1,267 @@
+import json
+from os import path
+from typing import List, Optional, Iterable, Tuple
+
+import numpy as np
+
+from columnar import ColumnarConversation
+from people import PeopleRegistry
+from statistics import Report, Accumulator, ConversationData, TopConversationsByChars, TopConversationsByMessages, \
+    ConversationPeopleVariability, HourlyHistogram, YearlyHistogram, DayInWeekHistogram
+from timezones import utc_offsets
+
+# Version of saved cubes. Should be increased whenever layout of the cube changes.
+ROLLUP_VERSION = 2
+
+# Number of cells of one year of one sender (days in week x hours).
+YEAR_CELLS = 7 * 24
+
+
+class RollupCube:
+    """
+    Numbers of messages and sums of their lengths pre-aggregated by (conversation, sender
+    is "myself", year, day in week, hour) in local time. Histograms and per-conversation
+    counts of any subset of conversations are computed by summing parts of the cube (see
+    `RollupStatistics`), so messages do not have to be scanned again.
+
+    Each conversation has its own dense block of shape (2, years, 7, 24), which covers only
+    years of its messages (conversations spanning few years stay small). First index of the
+    block is 0 for messages of other people and 1 for messages sent by "myself".
+
+    Cube is valid only for the time zone and "myself" it was built for and is identified
+    by keys, numbers of messages and last timestamps of its conversations (see `matches`).
+    """
+
+    def __init__(self, self_name: str, timezone: Optional[str] = None):
+        """
+        :param self_name: name of the person which should be considered as "myself"
+        :param timezone: name of time zone of the local time (local time zone by default)
+        """
+        self.self_name = self_name
+        self.timezone = timezone
+
+        self.names: List[str] = []
+        self.keys: List[str] = []  # see `ColumnarConversation.key`
+        self.message_counts: List[int] = []
+        self.last_timestamps: List[int] = []
+        self.first_years: List[int] = []
+        self.counts: List[np.ndarray] = []
+        self.characters: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, data: ConversationData) -> None:
+        """
+        Adds block of specified conversation to the end of the cube.
+        """
+        years, weekdays, hours = data.time_parts()
+        if len(data):
+            first_year = int(years.min())
+            year_count = int(years.max()) - first_year + 1
+        else:
+            first_year, year_count = 0, 0
+
+        shape = (2, year_count, 7, 24)
+        cells = ((data.is_me * year_count + (years - first_year)) * 7 + weekdays) * 24 + hours
+
+        self.names.append(data.conversation.name)
+        self.keys.append(data.conversation.key)
+        self.message_counts.append(len(data))
+        self.last_timestamps.append(int(data.timestamps[-1]) if len(data) else 0)
+        self.first_years.append(first_year)
+        self.counts.append(np.bincount(cells, minlength=2 * year_count * YEAR_CELLS).reshape(shape))
+        # Sums of weights are exact floats, lengths are far below 2^53.
+        self.characters.append(np.bincount(cells, weights=data.lengths, minlength=2 * year_count * YEAR_CELLS)
+                               .astype(np.int64).reshape(shape))
+
+    @staticmethod
+    def build(conversations: Iterable[ColumnarConversation], self_name: str, timezone: Optional[str] = None,
+              people: PeopleRegistry = None) -> 'RollupCube':
+        """
+        Builds cube of specified conversations (in the same order).
+
+        :param people: registry of people which the conversations are bound to
+        """
+        cube = RollupCube(self_name, timezone)
+        offsets = utc_offsets(timezone)
+
+        for conversation in conversations:
+            cube.add(ConversationData(conversation, self_name, offsets, people))
+        return cube
+
+    def matches(self, conversations: List[ColumnarConversation], self_name: str, timezone: Optional[str]) -> bool:
+        """
+        Returns whether the cube was built from specified conversations with the same settings.
+        """
+        return (self.self_name == self_name and self.timezone == timezone and len(self) == len(conversations) and
+                all(key == conversation.key and count == len(conversation) and
+                    (not count or last_timestamp == int(conversation.timestamps[-1]))
+                    for key, count, last_timestamp, conversation in
+                    zip(self.keys, self.message_counts, self.last_timestamps, conversations)))
+
+    def reduce(self, indices: Iterable[int] = None, characters: bool = False) -> Tuple[int, np.ndarray]:
+        """
+        Sums blocks of specified conversations (all conversations by default). Returns first
+        year of the sum and array of shape (2, years, 7, 24).
+
+        :param indices: indices of conversations to sum
+        :param characters: whether lengths of messages should be summed instead of their numbers
+        """
+        blocks = self.characters if characters else self.counts
+        indices = range(len(self)) if indices is None else list(indices)
+        indices = [i for i in indices if blocks[i].shape[1]]
+        if not indices:
+            return 0, np.zeros((2, 0, 7, 24), dtype=np.int64)
+
+        first_year = min(self.first_years[i] for i in indices)
+        last_year = max(self.first_years[i] + blocks[i].shape[1] for i in indices)
+
+        total = np.zeros((2, last_year - first_year, 7, 24), dtype=np.int64)
+        for i in indices:
+            start = self.first_years[i] - first_year
+            total[:, start:start + blocks[i].shape[1]] += blocks[i]
+        return first_year, total
+
+    def conversation_totals(self, i: int, characters: bool = False) -> Tuple[int, int]:
+        """
+        Returns amounts (messages or characters) of i-th conversation sent by other people
+        and by "myself".
+        """
+        others, mine = (self.characters if characters else self.counts)[i].sum(axis=(1, 2, 3)).tolist()
+        return others, mine
+
+    def save(self, file_path: str) -> None:
+        """
+        Saves the cube to uncompressed NumPy archive (.npz), blocks of all conversations are
+        stored one after another in two flat arrays.
+        """
+        sizes = [block.size for block in self.counts]
+        metadata = {'version': ROLLUP_VERSION, 'self_name': self.self_name, 'timezone': self.timezone,
+                    'names': self.names, 'keys': self.keys}
+
+        with open(file_path, 'wb') as f:
+            np.savez(f, metadata=np.array(json.dumps(metadata, ensure_ascii=False)),
+                     message_counts=np.array(self.message_counts, dtype=np.int64),
+                     last_timestamps=np.array(self.last_timestamps, dtype=np.int64),
+                     first_years=np.array(self.first_years, dtype=np.int64),
+                     starts=np.cumsum([0] + sizes, dtype=np.int64),
+                     counts=np.concatenate([block.ravel() for block in self.counts] or [np.zeros(0, np.int64)]),
+                     characters=np.concatenate([block.ravel() for block in self.characters] or
+                                               [np.zeros(0, np.int64)]))
+
+    @staticmethod
+    def load(file_path: str) -> 'RollupCube':
+        """
+        Loads cube saved by `save`. Raises ValueError when the file was saved by other version.
+        """
+        with np.load(file_path, allow_pickle=False) as f:
+            metadata = json.loads(str(f['metadata']))
+            if metadata.get('version') != ROLLUP_VERSION:
+                raise ValueError(f'Unsupported version of rollup cube: {metadata.get("version")}!')
+
+            cube = RollupCube(metadata['self_name'], metadata['timezone'])
+            cube.names = metadata['names']
+            cube.keys = metadata['keys']
+            cube.message_counts = f['message_counts'].tolist()
+            cube.last_timestamps = f['last_timestamps'].tolist()
+            cube.first_years = f['first_years'].tolist()
+
+            starts = f['starts'].tolist()
+            counts, characters = f['counts'], f['characters']
+
+        for start, stop in zip(starts, starts[1:]):
+            shape = (2, (stop - start) // (2 * YEAR_CELLS), 7, 24)
+            cube.counts.append(counts[start:stop].reshape(shape))
+            cube.characters.append(characters[start:stop].reshape(shape))
+        return cube
+
+
+def default_rollup_path(cache_path: str) -> str:
+    """
+    Returns location of the rollup cube stored next to the cache on specified path.
+    """
+    return path.splitext(cache_path)[0] + '-rollup.npz'
+
+
+class RollupStatistics:
+    """
+    Computes statistics from `RollupCube` instead of messages. Only statistics listed
+    in `ROLLUP_STATISTICS` are supported, results are the same as results computed by
+    `StatisticsEngine` from the same conversations.
+    """
+
+    def __init__(self, cube: RollupCube, exhaustive_lists: bool = False, indices: Iterable[int] = None, **options):
+        """
+        :param cube: rollup cube of the conversations
+        :param exhaustive_lists: whether the lists should include all items
+        :param indices: indices of conversations of the cube to compute statistics of (all by default)
+        :param options: options of individual statistics
+        """
+        self.cube = cube
+        self.self_name = cube.self_name
+        self.exhaustive_lists = exhaustive_lists
+        self.indices = list(range(len(cube)) if indices is None else indices)
+        self.options = options
+
+        self._messages = None
+
+    def messages(self) -> Tuple[int, np.ndarray]:
+        if self._messages is None:
+            self._messages = self.cube.reduce(self.indices)
+        return self._messages
+
+    def conversation_counts(self, accumulator) -> None:
+        by_characters = isinstance(accumulator, TopConversationsByChars)
+
+        for i in self.indices:
+            others, mine = self.cube.conversation_totals(i, by_characters)
+            key = self.cube.keys[i]
+            accumulator.conversation_names[key] = self.cube.names[i]
+            counts = accumulator.conversation_counts.setdefault(key, [0, 0])
+            counts[0] += others
+            counts[1] += mine
+            accumulator.total_messages += self.cube.message_counts[i]
+        accumulator.conversation_count = len(self.indices)
+
+    top_conversations_by_chars = conversation_counts
+    top_conversations_by_messages = conversation_counts
+    conversation_people_variability = conversation_counts
+
+    def hourly_histogram(self, accumulator: HourlyHistogram) -> None:
+        if self.messages()[1].size:
+            accumulator.hours = self.messages()[1].sum(axis=(0, 1, 2)).tolist()
+
+    def yearly_histogram(self, accumulator: YearlyHistogram) -> None:
+        first_year, messages = self.messages()
+        for year, count in enumerate(messages.sum(axis=(0, 2, 3)).tolist(), first_year):
+            if 2000 <= year < 2100:
+                accumulator.years[year - 2000] = count
+
+    def day_in_week_histogram(self, accumulator: DayInWeekHistogram) -> None:
+        if self.messages()[1].size:
+            accumulator.day_in_week = self.messages()[1].sum(axis=(0, 1, 3)).tolist()
+
+    def run(self, statistics: list = None) -> Report:
+        """
+        Computes specified statistics (all supported statistics by default) of the selected
+        conversations.
+
+        :param statistics: accumulator classes of statistics to compute
+        :return: report with global results
+        """
+        accumulators: List[Accumulator] = []
+        for statistic in ROLLUP_STATISTICS if statistics is None else statistics:
+            accumulator = statistic(self.self_name, self.exhaustive_lists, **self.options)
+            if not hasattr(self, accumulator.name):
+                raise ValueError(f'Statistic {accumulator.name} can not be computed from rollup cube')
+
+            getattr(self, accumulator.name)(accumulator)
+            accumulators.append(accumulator)
+
+        return Report(self.self_name, accumulators)
+
+
+# Statistics supported by `RollupStatistics` in the order in which they are printed.
+ROLLUP_STATISTICS = [TopConversationsByChars, TopConversationsByMessages, ConversationPeopleVariability,
+                     HourlyHistogram, YearlyHistogram, DayInWeekHistogram]
@@ -0,0 +1,322 @@
+"""
+HTTP server with statistics of one or more archives. Archives are parsed once when
+the server starts, statistics are computed on request and their JSON responses are
+kept in LRU cache.
+
+Usage:
+    python server.py /path/to/archive [/path/to/other/archive ...] [--port 8000] [--cache-mb 64]
+
+Endpoints (all responses are JSON):
+    GET /archives                                                      loaded archives
+    GET /archives/<archive>/statistics                                 all statistics
+    GET /archives/<archive>/statistics/<statistic>                     one statistic
+    GET /archives/<archive>/conversations                              conversations with their indices
+    GET /archives/<archive>/conversations/<index>/statistics           all statistics of one conversation
+    GET /archives/<archive>/conversations/<index>/statistics/<statistic>
+    GET /cache                                                         state of the cache
+
+Messages can be filtered by query parameters `since` and `until` (date, time or milliseconds
+since epoch), `last_days`, `participant` and `sender` (both can be repeated) and `group`
+(1 for group chats only, 0 for one to one conversations only). Statistics of one conversation
+are filtered only by time and senders.
+"""
+import argparse
+import datetime
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from typing import Dict, List, Callable, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import statistics
+from cache import default_cache_path
+from main import FacebookStatistics
+from query import Query
+from results import as_dict
+from timezones import DAY_MS
+
+# Query parameters which filter messages, in the order in which they form keys of the cache.
+FILTERS = ('since', 'until', 'last_days', 'participant', 'sender', 'group')
+
+# Filters which apply to messages of single conversation.
+CONVERSATION_FILTERS = ('since', 'until', 'sender')
+
+# Time range of `last_days` ends at the current time rounded down to this resolution, so
+# responses are cached at most this long (in milliseconds).
+LAST_DAYS_RESOLUTION_MS = 60 * 1000
+
+
+class NotFound(Exception):
+    pass
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of serialized responses bounded by their total size in bytes.
+    Least recently used responses are evicted when the size is exceeded. Concurrent
+    requests for the same key wait for single computation of the response.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.pending: Dict[tuple, threading.Lock] = {}
+
+    def get(self, key: tuple) -> bytes:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: bytes) -> None:
+        with self.lock:
+            if key in self.entries or len(value) > self.max_bytes:
+                return
+
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], bytes]) -> bytes:
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            pending = self.pending.setdefault(key, threading.Lock())
+
+        with pending:
+            # Response may have been computed by other request in the meantime.
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            with self.lock:
+                self.misses += 1
+            try:
+                value = compute()
+                self.put(key, value)
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+            return value
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def parse_time(value: str) -> int:
+    """
+    Parses time specified as milliseconds since epoch or as ISO date (time) in local time.
+    """
+    if value.isdigit():
+        return int(value)
+    return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def to_json(value) -> bytes:
+    return json.dumps(as_dict(value), ensure_ascii=False).encode('utf-8')
+
+
+class StatisticsService:
+    """
+    Answers requests for statistics of loaded archives. Messages are never scanned again
+    for a request whose response is cached.
+    """
+
+    def __init__(self, archives: Dict[str, FacebookStatistics], cache: ResultCache):
+        self.archives = archives
+        self.cache = cache
+
+    @staticmethod
+    def filter_key(params: Dict[str, List[str]], filters: Tuple[str, ...] = FILTERS) -> tuple:
+        return tuple((name, tuple(sorted(params[name]))) for name in filters if name in params)
+
+    @staticmethod
+    def absolute_time(params: Dict[str, List[str]], now: int = None) -> Dict[str, List[str]]:
+        """
+        Replaces `last_days` by absolute time range (`since` and `until`), which ends at the
+        current time rounded down to `LAST_DAYS_RESOLUTION_MS`. Cached responses of relative
+        time ranges are thus not reused after the time range moves.
+
+        :param now: current time in milliseconds since epoch
+        """
+        if 'last_days' not in params:
+            return params
+
+        if now is None:
+            now = int(time.time() * 1000)
+        until = now // LAST_DAYS_RESOLUTION_MS * LAST_DAYS_RESOLUTION_MS
+        since = max(until - int(params['last_days'][0]) * DAY_MS, 0)
+
+        params = {name: values for name, values in params.items() if name != 'last_days'}
+        params['since'], params['until'] = [str(since)], [str(until)]
+        return params
+
+    @staticmethod
+    def query(stats: FacebookStatistics, params: Dict[str, List[str]]) -> Query:
+        """
+        Creates query of the archive from query parameters. Raises ValueError when some
+        of the parameters is not valid.
+        """
+        query = stats.query()
+        if 'since' in params or 'until' in params:
+            query = query.between(parse_time(params['since'][0]) if 'since' in params else None,
+                                  parse_time(params['until'][0]) if 'until' in params else None)
+        if 'last_days' in params:
+            query = query.last_days(int(params['last_days'][0]))
+        if 'participant' in params:
+            query = query.with_participants(*params['participant'])
+        if 'sender' in params:
+            query = query.sent_by(*params['sender'])
+        if 'group' in params:
+            query = query.group_chats() if params['group'][0] == '1' else query.one_to_one()
+        return query
+
+    @staticmethod
+    def statistic_classes(name: str = None) -> list:
+        if name is None:
+            return statistics.ALL_STATISTICS
+        if name not in statistics.STATISTICS:
+            raise NotFound(f'Unknown statistic {name}')
+        return [statistics.STATISTICS[name]]
+
+    def response(self, url_path: str, params: Dict[str, List[str]]) -> bytes:
+        """
+        Returns JSON response for specified path and query parameters. Raises NotFound
+        for unknown paths and ValueError for invalid parameters.
+        """
+        parts = [unquote(part) for part in url_path.strip('/').split('/') if part]
+
+        if parts == ['archives']:
+            return to_json({name: {'self_name': stats.my_name, 'conversations': len(stats.conversations)}
+                            for name, stats in self.archives.items()})
+        if parts == ['cache']:
+            return to_json(self.cache.summary())
+
+        if len(parts) < 3 or parts[0] != 'archives' or parts[1] not in self.archives:
+            raise NotFound(f'Unknown path {url_path}')
+
+        archive, stats, resource = parts[1], self.archives[parts[1]], parts[2:]
+        params = self.absolute_time(params)
+        query = self.query(stats, params)
+        key = (archive, '/'.join(resource), self.filter_key(params))
+
+        if resource[0] == 'statistics' and len(resource) <= 2:
+            classes = self.statistic_classes(resource[1] if len(resource) == 2 else None)
+            return self.cache.get_or_compute(key, lambda: self.compute(stats, classes, query.conversations()))
+
+        if resource == ['conversations']:
+            return self.cache.get_or_compute(key, lambda: self.conversations(stats, query))
+
+        if resource[0] == 'conversations' and len(resource) in (3, 4) and resource[2] == 'statistics':
+            if not resource[1].isdigit() or int(resource[1]) >= len(stats.conversations):
+                raise NotFound(f'Unknown conversation {resource[1]}')
+
+            # Conversation is selected by its index, only time and senders of its messages are filtered.
+            conversation = stats.conversations[int(resource[1])]
+            classes = self.statistic_classes(resource[3] if len(resource) == 4 else None)
+            key = (archive, '/'.join(resource), self.filter_key(params, CONVERSATION_FILTERS))
+            return self.cache.get_or_compute(key, lambda: self.compute(stats, classes,
+                                                                       [query.restrict(conversation)]))
+
+        raise NotFound(f'Unknown path {url_path}')
+
+    @staticmethod
+    def compute(stats: FacebookStatistics, classes: list, conversations: list) -> bytes:
+        # Histograms and top conversations of whole conversations are computed from rollup cube.
+        report = stats.rollup_stats(conversations, classes)
+        if report is None:
+            report = stats.statistics_engine(classes).run(conversations)
+        return to_json(report.results().statistics)
+
+    @staticmethod
+    def conversations(stats: FacebookStatistics, query: Query) -> bytes:
+        conversations = stats.conversations
+        return to_json([{'index': i, 'name': conversations[i].name, 'participants': conversations[i].participants,
+                         'messages': len(conversations[i])}
+                        for i in query.conversation_indices().tolist()])
+
+
+class StatisticsHandler(BaseHTTPRequestHandler):
+    service: StatisticsService = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            self.send(200, self.service.response(url.path, parse_qs(url.query)))
+        except NotFound as e:
+            self.send(404, to_json({'error': str(e)}))
+        except ValueError as e:
+            self.send(400, to_json({'error': str(e)}))
+        except Exception as e:
+            self.log_error('%s', traceback.format_exc())
+            self.send(500, to_json({'error': f'{type(e).__name__}: {e}'}))
+
+    def send(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def load_archives(root_paths: List[str], workers: int = 1) -> Dict[str, FacebookStatistics]:
+    """
+    Parses specified archives and returns them by their names (names of their directories
+    or ZIP files).
+    """
+    archives = {}
+    for root_path in root_paths:
+        name = path.splitext(path.basename(path.normpath(root_path)))[0]
+        while name in archives:
+            name += '_'
+
+        stats = FacebookStatistics(root_path, workers=workers, cache_path=default_cache_path(root_path))
+        stats.parse_all_messages()
+        # Indexes are built before requests are served by multiple threads.
+        stats.query()
+        archives[name] = stats
+    return archives
+
+
+def create_server(archives: Dict[str, FacebookStatistics], port: int = 8000, host: str = 'localhost',
+                  cache_bytes: int = 64 << 20) -> Tuple[ThreadingHTTPServer, StatisticsService]:
+    service = StatisticsService(archives, ResultCache(cache_bytes))
+    handler = type('Handler', (StatisticsHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler), service
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP server with statistics of Facebook exports.')
+    parser.add_argument('root_paths', nargs='+', help='paths to Facebook exports (directories or ZIP files)')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-mb', type=int, default=64, help='maximal size of cached responses')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes parsing the archives')
+    args = parser.parse_args()
+
+    server, _ = create_server(load_archives(args.root_paths, args.workers), args.port, args.host,
+                              args.cache_mb << 20)
+    print(f'Serving statistics on http://{args.host}:{args.port}/archives')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,244 @@
+import json
+from typing import List, Dict, Iterable, Callable, Optional, Tuple
+
+import numpy as np
+
+from columnar import ColumnarConversation
+from statistics import Accumulator, Report, StatisticsEngine
+from timezones import UtcOffsets, DAY_MS
+
+# Time buckets which snapshots can be split to and numpy units of their boundaries.
+BUCKETS = {'year': 'Y', 'month': 'M', 'day': 'D'}
+
+# Name of the only bucket of snapshots which are not split by time.
+WHOLE_CONVERSATION = 'all'
+
+SNAPSHOT_VERSION = 3
+
+
+def split_to_buckets(timestamps: np.ndarray, offsets: UtcOffsets, bucket: Optional[str]) -> Tuple[List[int], List[str]]:
+    """
+    Splits sorted timestamps (milliseconds since epoch) to runs of timestamps in the same
+    bucket of local time. Returns start indices of the runs and names of their buckets
+    (`2019`, `2019-03` or `2019-03-05`), which are ordered the same way as the buckets.
+
+    :param bucket: year, month, day or None when timestamps should not be split
+    """
+    if bucket is None:
+        return [0], [WHOLE_CONVERSATION]
+
+    days = (offsets.local(timestamps) // DAY_MS).astype('datetime64[D]')
+    units = days.astype(f'datetime64[{BUCKETS[bucket]}]')
+
+    starts = np.flatnonzero(np.concatenate(([True], units[1:] != units[:-1])))
+    return starts.tolist(), np.datetime_as_string(units[starts]).tolist()
+
+
+class Snapshot:
+    """
+    Partial state of statistics (see `Accumulator`) kept separately for each conversation
+    and each time bucket of the conversation (month by default), which can be saved to
+    JSON file and loaded back.
+
+    Snapshots are updated incrementally: `update` adds only messages newer than messages
+    already included in the snapshot, so adding new export costs time proportional to the
+    new messages only. Snapshots of different conversations or of consecutive periods can
+    be combined by `merge`, which is associative. Report with global statistics (and
+    statistics of individual conversations) is computed by `report` from the stored
+    state without touching any message.
+
+    Conversations are identified by their threads (see `ColumnarConversation.key`), because names
+    of conversations are not unique. For each conversation, the snapshot keeps cursor
+    of included messages: timestamp of the last included message and number of included
+    messages sent at that time, so new messages sent in the same millisecond are not lost.
+    People are saved by their names, so snapshots do not depend on registry of people.
+    """
+
+    def __init__(self, engine: StatisticsEngine, bucket: Optional[str] = 'month'):
+        """
+        :param engine: statistics engine which creates accumulators of the statistics
+        :param bucket: time bucket (year, month or day) or None to keep whole conversations
+        """
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError(f'Unknown time bucket {bucket}! Use one of: {", ".join(BUCKETS)}.')
+
+        self.engine = engine
+        self.bucket = bucket
+        self.parts: Dict[str, Dict[str, List[Accumulator]]] = {}  # conversation -> bucket -> accumulators
+        self.names: Dict[str, str] = {}  # conversation -> name
+        self.cursors: Dict[str, List[int]] = {}  # conversation -> [last timestamp, messages at that time]
+
+    def __len__(self) -> int:
+        return len(self.parts)
+
+    def add_part(self, key: str, bucket: str, accumulators: List[Accumulator]) -> None:
+        """
+        Adds state of messages of conversation in specified bucket. Messages must be newer
+        than messages of the conversation already included in the snapshot.
+        """
+        buckets = self.parts.setdefault(key, {})
+        existing = buckets.get(bucket)
+        if existing is None:
+            existing = buckets[bucket] = self.engine.create_accumulators()
+
+        for accumulator, other in zip(existing, accumulators):
+            accumulator.extend(other)
+
+    def advance(self, key: str, cursor: List[int]) -> None:
+        """
+        Moves cursor of conversation past messages described by `cursor`, which were sent
+        after (or at the same time as) messages already included.
+        """
+        last_timestamp, count = cursor
+        current = self.cursors.get(key)
+        if current is None or current[0] < last_timestamp:
+            self.cursors[key] = [last_timestamp, count]
+        elif current[0] == last_timestamp:
+            current[1] += count
+
+    def add(self, conversations: Iterable[ColumnarConversation]) -> None:
+        """
+        Adds all messages of specified conversations. Messages must be newer than messages
+        of the same conversations already included in the snapshot (see `update`).
+        """
+        engine = self.engine
+
+        for conversation in conversations:
+            if not len(conversation):
+                continue
+            key = conversation.key
+            self.names[key] = conversation.name
+
+            starts, buckets = split_to_buckets(conversation.timestamps, engine.offsets, self.bucket)
+            for start, stop, bucket in zip(starts, starts[1:] + [len(conversation)], buckets):
+                data = engine.conversation_data(conversation.slice(start, stop))
+
+                accumulators = engine.create_accumulators()
+                for accumulator in accumulators:
+                    accumulator.update(data)
+
+                self.add_part(key, bucket, accumulators)
+
+            last_timestamp = int(conversation.timestamps[-1])
+            first_at_last = int(np.searchsorted(conversation.timestamps, last_timestamp, side='left'))
+            self.advance(key, [last_timestamp, len(conversation) - first_at_last])
+
+    def update(self, conversations: Iterable[ColumnarConversation]) -> int:
+        """
+        Adds messages of specified conversations which are not included in the snapshot
+        yet (messages after the cursor of the same conversation).
+
+        :return: number of added messages
+        """
+        new_conversations = []
+        for conversation in conversations:
+            cursor = self.cursors.get(conversation.key)
+            if cursor is not None:
+                # Messages sent at the time of the last included message are ordered the same
+                # way in every export, so the first ones of them were already included.
+                last_timestamp, count = cursor
+                first, stop = np.searchsorted(conversation.timestamps, [last_timestamp, last_timestamp + 1]).tolist()
+                conversation = conversation.slice(min(first + count, stop), len(conversation))
+            new_conversations.append(conversation)
+
+        self.add(new_conversations)
+        return sum(len(conversation) for conversation in new_conversations)
+
+    def merge(self, other: 'Snapshot') -> None:
+        """
+        Adds state of other snapshot, whose messages have to be newer than messages of the
+        same conversations in this snapshot.
+        """
+        for key, buckets in other.parts.items():
+            for bucket in sorted(buckets):
+                self.add_part(key, bucket, buckets[bucket])
+
+        self.names.update(other.names)
+        for key, cursor in other.cursors.items():
+            self.advance(key, cursor)
+
+    def conversation_accumulators(self, key: str) -> List[Accumulator]:
+        """
+        Returns accumulators of whole conversation combined from all its buckets.
+        """
+        accumulators = self.engine.create_accumulators()
+        buckets = self.parts[key]
+        for bucket in sorted(buckets):
+            for accumulator, other in zip(accumulators, buckets[bucket]):
+                accumulator.extend(other)
+        return accumulators
+
+    def report(self, per_conversation: Optional[Callable[[str], bool]] = None) -> Report:
+        """
+        Computes report with all statistics from the snapshot.
+
+        :param per_conversation: predicate selecting names of conversations for which separate
+                                 results should be kept in returned report
+        """
+        report = Report(self.engine.self_name, self.engine.create_accumulators())
+
+        for key in self.parts:
+            accumulators = self.conversation_accumulators(key)
+            for accumulator, global_accumulator in zip(accumulators, report.accumulators):
+                global_accumulator.merge(accumulator)
+
+            if per_conversation is not None and per_conversation(self.names[key]):
+                report.conversations.append((self.names[key], accumulators))
+
+        return report
+
+    def state(self) -> dict:
+        return {
+            'version': SNAPSHOT_VERSION,
+            'self_name': self.engine.self_name,
+            'bucket': self.bucket,
+            'statistics': [statistic.name for statistic in self.engine.statistics],
+            'conversations': {
+                key: {
+                    'name': self.names[key],
+                    'cursor': self.cursors[key],
+                    'buckets': {
+                        bucket: {accumulator.name: accumulator.state() for accumulator in accumulators}
+                        for bucket, accumulators in buckets.items()
+                    },
+                }
+                for key, buckets in self.parts.items()
+            },
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.state(), f, ensure_ascii=False)
+
+    @staticmethod
+    def from_state(state: dict, engine: StatisticsEngine) -> 'Snapshot':
+        """
+        Creates snapshot from state returned by `state`. Snapshot has to contain all
+        statistics of the engine.
+        """
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported version of snapshot: {state.get("version")}!')
+        if state['self_name'] != engine.self_name:
+            raise ValueError(f'Snapshot was created for {state["self_name"]}, not for {engine.self_name}!')
+
+        missing = [statistic.name for statistic in engine.statistics if statistic.name not in state['statistics']]
+        if missing:
+            raise ValueError(f'Snapshot does not contain statistics: {", ".join(missing)}!')
+
+        snapshot = Snapshot(engine, state['bucket'])
+
+        for key, conversation in state['conversations'].items():
+            snapshot.names[key] = conversation['name']
+            snapshot.cursors[key] = list(conversation['cursor'])
+            parts = snapshot.parts[key] = {}
+            for bucket, states in conversation['buckets'].items():
+                accumulators = parts[bucket] = engine.create_accumulators()
+                for accumulator in accumulators:
+                    accumulator.load(states[accumulator.name])
+
+        return snapshot
+
+    @staticmethod
+    def load(path: str, engine: StatisticsEngine) -> 'Snapshot':
+        with open(path, 'r', encoding='utf-8') as f:
+            return Snapshot.from_state(json.load(f), engine)
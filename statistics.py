@@ -1,388 +1,1076 @@
-from typing import List
-from custom_types import NamedConversation
-from utils import safe_div
+from collections import Counter
+from time import perf_counter
+from typing import List, Dict, Callable, Optional, Tuple, Iterable
 
+import numpy as np
 
-def general_stats(self_name: str, conversations: List[NamedConversation]):
+from columnar import ColumnarConversation
+from instrumentation import Instrumentation
+from people import PeopleRegistry
+from results import GeneralStatsResult, Histogram, ConversationAmounts, TopConversations, PeopleVariability, \
+    MessagesLengthsResult, MessagesBeforeReplyResult, TimeBeforeReplyResult, WhoStartedResult, MostUsedWordsResult, \
+    LatencyDistribution, ReplyLatencyResult, Results, ConversationResults, ReportResults
+from timezones import UtcOffsets, local_time_parts, utc_offsets
+from utils import safe_div, format_duration
+from words import Tokenizer, WordCounter, HeavyHittersCounter
+
+# Gap between messages (in milliseconds) after which the next message starts new conversation.
+CONVERSATION_GAP_MS = 60 * 30 * 1000
+
+
+class ConversationData:
     """
-    Generates general statistics for specified list of conversations.
-    :param self_name: name of the person which should be considered as "myself"
-    :param conversations: list of conversations
-    :return: 
+    Arrays derived from one conversation which are shared by all accumulators. Derived
+    arrays are computed lazily on first access, so they are only computed when some
+    of the accumulators needs them.
     """
-    message_count = 0
-    conversation_count = 0
-    unique_people = set()
 
-    characters_count = 0
+    def __init__(self, conversation: ColumnarConversation, self_name: str, offsets: UtcOffsets,
+                 people: PeopleRegistry = None, bound: bool = True):
+        """
+        :param people: registry of people whose ids identify senders and participants
+        :param bound: whether the conversation (when it is bound) is bound to `people`, senders and
+                      participants of other conversations are interned to `people`
+        """
+        self.conversation = conversation
+        self.offsets = offsets
+        self.lengths = conversation.lengths
+        self.timestamps = conversation.timestamps
+
+        if people is None:
+            people, bound = PeopleRegistry(self_name), False
+
+        # Senders (`person_ids` maps sender ids of the conversation) and participants are
+        # identified by ids of people in the registry.
+        if not bound or conversation.person_ids is None:
+            self.person_ids = people.intern_all(conversation.senders)
+            self.participants = people.intern_all(conversation.participants).tolist()
+        else:
+            self.person_ids = conversation.person_ids
+            self.participants = conversation.participant_ids.tolist()
+        self.people = people
+
+        # Mask of messages sent by "myself".
+        self.is_me = (self.person_ids == people.id(self_name))[conversation.sender_ids]
+
+        self._time_parts = None
+        self._intervals = None
+        self._switches = None
+
+    def __len__(self) -> int:
+        return len(self.conversation)
+
+    def time_parts(self):
+        if self._time_parts is None:
+            self._time_parts = local_time_parts(self.timestamps, self.offsets)
+        return self._time_parts
+
+    @property
+    def years(self) -> np.ndarray:
+        return self.time_parts()[0]
+
+    @property
+    def weekdays(self) -> np.ndarray:
+        return self.time_parts()[1]
+
+    @property
+    def hours(self) -> np.ndarray:
+        return self.time_parts()[2]
+
+    @property
+    def intervals(self) -> np.ndarray:
+        """
+        Times (in milliseconds) between each message and the previous message, i-th interval
+        precedes message at index i + 1.
+        """
+        if self._intervals is None:
+            self._intervals = np.diff(self.timestamps)
+        return self._intervals
+
+    @property
+    def switches(self) -> np.ndarray:
+        """
+        Indices of messages sent by "myself" directly after message of other person or
+        sent by other person directly after my message.
+        """
+        if self._switches is None:
+            self._switches = np.flatnonzero(self.is_me[1:] != self.is_me[:-1]) + 1
+        return self._switches
+
+
+class Accumulator:
+    """
+    Base class of all statistics. Each statistic is computed by an accumulator which
+    receives all messages of every conversation exactly once (`update`) and can be
+    combined with accumulator of the same type computed over different conversations
+    (`merge`).
+
+    Accumulated state is then converted to typed result by `result`. Results are formatted
+    by output backends (see `output` module) under the `name` of the statistic.
+
+    Accumulated state (attributes listed in `fields`) can be saved by `state` as JSON
+    compatible dictionary and loaded back by `load`, so partial results can be stored
+    in snapshots (see `snapshots` module). Accumulators of consecutive parts of the same
+    conversation are combined by `extend`, which (unlike `merge`) also accounts for
+    the messages around the boundary of the parts. Both `merge` and `extend` are
+    associative.
+
+    Accumulators are created with name of the person which should be considered as
+    "myself", exhaustive lists setting, registry of people and options of the statistics
+    engine. Each accumulator uses only options it knows. People are identified by their ids
+    in the registry, names are resolved only in results and in saved state (so the state
+    does not depend on the registry).
+    """
 
-    my_messages = 0
-    my_characters = 0
+    # Name of the statistic used by output backends.
+    name: str = None
 
-    for _, participants, messages in conversations:
-        message_count += len(messages)
+    # Names of attributes with accumulated state.
+    fields: Tuple[str, ...] = ()
 
-        for sender, text, _ in messages:
-            characters_count += 0 if text is None else len(text)
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, people: PeopleRegistry = None, **options):
+        """
+        :param self_name: name of the person which should be considered as "myself"
+        :param exhaustive_lists: whether the lists should include all items
+        :param people: registry of people of the updated conversations (see `ConversationData`)
+        """
+        self.self_name = self_name
+        self.exhaustive_lists = exhaustive_lists
+        self.people = PeopleRegistry(self_name) if people is None else people
 
-            if sender == self_name:
-                my_messages += 1
-                my_characters += 0 if text is None else len(text)
+    def update(self, data: ConversationData) -> None:
+        raise NotImplementedError
 
-        conversation_count += 1
-        unique_people = unique_people | set(participants)
+    def merge(self, other: 'Accumulator') -> None:
+        raise NotImplementedError
 
-    print(f'You have exchanged {message_count} messages total.')
-    print(f'You have sent {my_messages} ({round(safe_div(my_messages*100, message_count), 2)}%) ' +
-          f'messages and received {message_count - my_messages} ' +
-          f'({round(safe_div((message_count - my_messages)*100, message_count), 2)}%) total.')
+    def extend(self, other: 'Accumulator') -> None:
+        """
+        Adds state of accumulator of messages of the same conversation which were sent
+        after all messages of this accumulator.
+        """
+        self.merge(other)
 
-    print(f'You have exchanged {characters_count} characters in messages total. ' +
-          f'({round(safe_div(my_characters*100, characters_count), 2)}% were sent by you)')
+    def state(self) -> dict:
+        return {field: getattr(self, field) for field in self.fields}
 
-    print(f'You are in {conversation_count} conversations.')
-    print(f'You talked to {len(unique_people)} different people.')
+    def load(self, state: dict) -> None:
+        for field in self.fields:
+            setattr(self, field, state[field])
 
+    def result(self) -> tuple:
+        raise NotImplementedError
 
-def hourly_histogram(conversations: List[NamedConversation]):
+
+class SequenceAccumulator(Accumulator):
     """
-    Generates hourly histogram of messages sent from specified list of conversations.
-    :param conversations: list of conversations
-    :return: 
+    Base of statistics which depend on the order of messages in conversation. First and last
+    message (their timestamp, whether they were sent by "myself" and id of their sender) are
+    remembered, so the statistic can be corrected for the pair of messages around the
+    boundary when consecutive parts of conversation are combined by `extend`.
     """
-    hours = [0 for _ in range(24)]
 
-    for name, participants, messages in conversations:
-        for sender, text, date in messages:
-            hours[date.hour] += 1
+    fields = ('first', 'last')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists, **options)
+        self.first: Optional[list] = None  # [timestamp, is_me, sender id]
+        self.last: Optional[list] = None
+
+    @staticmethod
+    def boundary(data: ConversationData, index: int) -> list:
+        return [int(data.timestamps[index]), bool(data.is_me[index]),
+                int(data.person_ids[data.conversation.sender_ids[index]])]
+
+    def update(self, data):
+        if len(data):
+            if self.first is None:
+                self.first = self.boundary(data, 0)
+            self.last = self.boundary(data, -1)
+
+    def join(self, last: list, first: list) -> None:
+        """
+        Accounts for message `first` which directly follows the last message `last`
+        of preceding part.
+        """
+        raise NotImplementedError
+
+    def extend(self, other: 'SequenceAccumulator'):
+        if self.last is not None and other.first is not None:
+            self.join(self.last, other.first)
+
+        self.merge(other)
+        if self.first is None:
+            self.first = other.first
+        if other.last is not None:
+            self.last = other.last
+
+    def state(self):
+        # Senders are saved by their names.
+        state = super().state()
+        for field in ('first', 'last'):
+            if state[field] is not None:
+                timestamp, is_me, sender = state[field]
+                state[field] = [timestamp, is_me, self.people.name(sender)]
+        return state
+
+    def load(self, state):
+        super().load(state)
+        for field in ('first', 'last'):
+            if getattr(self, field) is not None:
+                timestamp, is_me, sender = getattr(self, field)
+                setattr(self, field, [timestamp, is_me, self.people.intern(sender)])
+
+
+class GeneralStats(Accumulator):
+    name = 'general_stats'
+    fields = ('message_count', 'conversation_count', 'unique_people', 'characters_count', 'my_messages',
+              'my_characters')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists, **options)
+        self.message_count = 0
+        self.conversation_count = 0
+        self.unique_people = set()  # ids of people
+        self.characters_count = 0
+        self.my_messages = 0
+        self.my_characters = 0
+
+    def update(self, data):
+        self.message_count += len(data)
+        self.characters_count += int(data.lengths.sum())
+
+        self.my_messages += int(np.count_nonzero(data.is_me))
+        self.my_characters += int(data.lengths[data.is_me].sum())
+
+        self.conversation_count += 1
+        self.unique_people.update(data.participants)
+
+    def merge(self, other: 'GeneralStats'):
+        self.message_count += other.message_count
+        self.conversation_count += other.conversation_count
+        self.unique_people.update(other.unique_people)
+        self.characters_count += other.characters_count
+        self.my_messages += other.my_messages
+        self.my_characters += other.my_characters
+
+    def extend(self, other: 'GeneralStats'):
+        # Both parts are parts of the same conversation.
+        conversation_count = max(self.conversation_count, other.conversation_count)
+        self.merge(other)
+        self.conversation_count = conversation_count
+
+    def state(self):
+        state = super().state()
+        state['unique_people'] = sorted(self.people.name(person_id) for person_id in self.unique_people)
+        return state
+
+    def load(self, state):
+        super().load(state)
+        self.unique_people = {self.people.intern(name) for name in state['unique_people']}
+
+    def result(self):
+        return GeneralStatsResult(self.message_count, self.my_messages, self.message_count - self.my_messages,
+                                  self.characters_count, self.my_characters, self.conversation_count,
+                                  len(self.unique_people))
+
+
+class HourlyHistogram(Accumulator):
+    name = 'hourly_histogram'
+    fields = ('hours',)
+
+    def __init__(self, self_name: str = None, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists)
+        self.hours = [0 for _ in range(24)]
+
+    def update(self, data):
+        for i, count in enumerate(np.bincount(data.hours, minlength=24).tolist()):
+            self.hours[i] += count
+
+    def merge(self, other: 'HourlyHistogram'):
+        for i in range(24):
+            self.hours[i] += other.hours[i]
+
+    def result(self):
+        return Histogram({i: self.hours[i] for i in range(24)})
+
+
+class YearlyHistogram(Accumulator):
+    name = 'yearly_histogram'
+    fields = ('years',)
+
+    def __init__(self, self_name: str = None, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists)
+        # Should be enough for next approximately 100 years.
+        self.years = [0 for _ in range(100)]
+
+    def update(self, data):
+        years = data.years - 2000
+        years = years[(years >= 0) & (years < 100)]
+        for i, count in enumerate(np.bincount(years, minlength=100).tolist()):
+            self.years[i] += count
+
+    def merge(self, other: 'YearlyHistogram'):
+        for i in range(100):
+            self.years[i] += other.years[i]
+
+    def result(self):
+        return Histogram({i + 2000: self.years[i] for i in range(100) if self.years[i] != 0})
+
+
+class DayInWeekHistogram(Accumulator):
+    name = 'day_in_week_histogram'
+    fields = ('day_in_week',)
+
+    # Names are indexed the same way the days are indexed in strftime()
+    # method as specified by Python documentation "Weekday as a decimal number [0(Sunday),6]."
+    day_in_week_names = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+    def __init__(self, self_name: str = None, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists)
+        self.day_in_week = [0 for _ in range(7)]
+
+    def update(self, data):
+        for i, count in enumerate(np.bincount(data.weekdays, minlength=7).tolist()):
+            self.day_in_week[i] += count
+
+    def merge(self, other: 'DayInWeekHistogram'):
+        for i in range(7):
+            self.day_in_week[i] += other.day_in_week[i]
+
+    def result(self):
+        return Histogram({self.day_in_week_names[i]: self.day_in_week[i] for i in range(7)})
+
+
+class MessagesLengths(Accumulator):
+    name = 'messages_lengths'
+    fields = ('self_max', 'self_total', 'self_cnt', 'other_max', 'other_total', 'other_cnt')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists)
+        self.self_max = 0
+        self.self_total = 0
+        self.self_cnt = 0
+
+        self.other_max = 0
+        self.other_total = 0
+        self.other_cnt = 0
+
+    def update(self, data):
+        self_lengths = data.lengths[data.is_me]
+        other_lengths = data.lengths[~data.is_me]
+
+        if len(self_lengths):
+            self.self_total += int(self_lengths.sum())
+            self.self_max = max(self.self_max, int(self_lengths.max()))
+            self.self_cnt += len(self_lengths)
+
+        if len(other_lengths):
+            self.other_total += int(other_lengths.sum())
+            self.other_max = max(self.other_max, int(other_lengths.max()))
+            self.other_cnt += len(other_lengths)
 
-    print('Hourly histogram (You exchange most messages at):')
-    for i in range(24):
-        print(f'{i:02}:00 - {i+1:02}:00\t{hours[i]}')
+    def merge(self, other: 'MessagesLengths'):
+        self.self_max = max(self.self_max, other.self_max)
+        self.self_total += other.self_total
+        self.self_cnt += other.self_cnt
 
+        self.other_max = max(self.other_max, other.other_max)
+        self.other_total += other.other_total
+        self.other_cnt += other.other_cnt
 
-def yearly_histogram(conversations: List[NamedConversation]):
+    def result(self):
+        self_total, self_cnt = self.self_total, self.self_cnt
+        other_total, other_cnt = self.other_total, self.other_cnt
+
+        return MessagesLengthsResult(max(self.self_max, self.other_max), self.self_max, self.other_max,
+                                     safe_div(self_total + other_total, self_cnt + other_cnt),
+                                     safe_div(self_total, self_cnt), safe_div(other_total, other_cnt),
+                                     self_cnt + other_cnt)
+
+
+class ConversationCounts(Accumulator):
     """
-    Generates yearly histogram of messages sent from specified list of conversations.
-    :param conversations: list of conversations
-    :return: 
+    Common base for statistics which need per-conversation counters of messages (or characters)
+    sent and received.
+
+    Counters are kept under keys of conversations (see `ColumnarConversation.key`), because
+    names of conversations are not unique. Conversations with the same name are listed
+    in results with their key appended to the name.
     """
 
-    # Should be enough for next approximately 100 years.
-    years = [0 for _ in range(100)]
+    fields = ('conversation_counts', 'conversation_names', 'total_messages', 'conversation_count')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists)
+        self.conversation_counts: Dict[str, List[int]] = {}  # conversation key -> [others, me]
+        self.conversation_names: Dict[str, str] = {}  # conversation key -> name
+        self.total_messages = 0  # Used for computing threshold when not using exhaustive lists.
+        self.conversation_count = 0
+
+    def amounts(self, data: ConversationData) -> np.ndarray:
+        """
+        Returns array with amount counted for each message of the conversation.
+        """
+        raise NotImplementedError
+
+    def update(self, data):
+        self.total_messages += len(data)
+        self.conversation_count += 1
+
+        amounts = self.amounts(data)
+        mine = int(amounts[data.is_me].sum())
+
+        key = data.conversation.key
+        self.conversation_names[key] = data.conversation.name
+        counts = self.conversation_counts.setdefault(key, [0, 0])  # others, me
+        counts[0] += int(amounts.sum()) - mine
+        counts[1] += mine
+
+    def merge(self, other: 'ConversationCounts'):
+        self.total_messages += other.total_messages
+        self.conversation_count += other.conversation_count
+
+        self.conversation_names.update(other.conversation_names)
+        for key, other_counts in other.conversation_counts.items():
+            counts = self.conversation_counts.setdefault(key, [0, 0])
+            counts[0] += other_counts[0]
+            counts[1] += other_counts[1]
+
+    def extend(self, other: 'ConversationCounts'):
+        # Both parts are parts of the same conversation.
+        conversation_count = max(self.conversation_count, other.conversation_count)
+        self.merge(other)
+        self.conversation_count = conversation_count
+
+    def labels(self) -> Dict[str, str]:
+        """
+        Returns label of each conversation in results: its name, followed by its key when
+        other conversation has the same name.
+        """
+        names = Counter(self.conversation_names.get(key, key) for key in self.conversation_counts)
+        labels = {}
+        for key in self.conversation_counts:
+            name = self.conversation_names.get(key, key)
+            labels[key] = name if names[name] == 1 or name == key else f'{name} ({key})'
+        return labels
+
+    def top_conversations(self):
+        labels = self.labels()
+        return sorted((value[0] + value[1], labels[key], value) for (key, value) in self.conversation_counts.items())
+
+    def top_conversations_result(self, threshold: float) -> TopConversations:
+        """
+        Returns conversations ordered by the total amount. Unless exhaustive lists are enabled,
+        only conversations with amount above the threshold are included.
+        """
+        conversations = {}
+        for amount, conversation_name, counts in reversed(self.top_conversations()):
+            if amount != 0:
+                if self.exhaustive_lists or amount > threshold:
+                    conversations[conversation_name] = ConversationAmounts(amount, counts[1], counts[0])
+
+        return TopConversations(conversations, self.total_messages, self.exhaustive_lists)
+
+
+class TopConversationsByChars(ConversationCounts):
+    name = 'top_conversations_by_chars'
+
+    def amounts(self, data):
+        return data.lengths
+
+    def result(self):
+        # Threshold is used to prevent outputting lot of conversations
+        # with very little messages. Currently it is calculated as average
+        # message count in conversation.
+        return self.top_conversations_result(safe_div(self.total_messages, len(self.conversation_counts)))
+
+
+class TopConversationsByMessages(ConversationCounts):
+    name = 'top_conversations_by_messages'
+
+    def amounts(self, data):
+        return np.ones(len(data), dtype=np.int32)
+
+    def result(self):
+        # Threshold is used to prevent outputting lot of conversations
+        # with very little messages. Currently it is calculated as average
+        # message count in conversation.
+        return self.top_conversations_result(safe_div(self.total_messages, self.conversation_count))
+
+
+class ConversationPeopleVariability(ConversationCounts):
+    name = 'conversation_people_variability'
+
+    def amounts(self, data):
+        return np.ones(len(data), dtype=np.int32)
+
+    def result(self):
+        top_convos = self.top_conversations()
+        total_msgs = self.total_messages
+        people = {}
+
+        for i in range(1, 20):
+            messages_seen = 0
+            people_seen = 0
+            for msgs, convo, counts in reversed(top_convos):
+                if msgs != 0:
+                    messages_seen += msgs
+                    people_seen += 1
+
+                    if messages_seen > int(total_msgs / (1 + 0.1 * i)):
+                        people[100 // (1 + 0.1 * i)] = people_seen
+                        break
+
+        return PeopleVariability(people)
+
+
+class MsgsBeforeReply(SequenceAccumulator):
+    name = 'msgs_before_reply'
+    fields = SequenceAccumulator.fields + ('me_msgs', 'oth_msgs', 'me_responses', 'oth_responses')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists, **options)
+        self.me_msgs = 0
+        self.oth_msgs = 0
+
+        self.me_responses = 0
+        self.oth_responses = 0
+
+    def update(self, data):
+        super().update(data)
+        if not len(data):
+            return
+
+        me_msgs = int(np.count_nonzero(data.is_me))
+        self.me_msgs += me_msgs
+        self.oth_msgs += len(data) - me_msgs
+
+        me_responses = int(np.count_nonzero(data.is_me[data.switches]))
+        self.me_responses += me_responses
+        self.oth_responses += len(data.switches) - me_responses
+
+        # First message of conversation sent by other person is considered to be response.
+        if not data.is_me[0]:
+            self.oth_responses += 1
+
+    def merge(self, other: 'MsgsBeforeReply'):
+        self.me_msgs += other.me_msgs
+        self.oth_msgs += other.oth_msgs
+        self.me_responses += other.me_responses
+        self.oth_responses += other.oth_responses
+
+    def join(self, last, first):
+        # First message of each part is counted as if it followed my message.
+        if not last[1]:
+            if first[1]:
+                self.me_responses += 1
+            else:
+                self.oth_responses -= 1
+
+    def result(self):
+        return MessagesBeforeReplyResult(safe_div(self.me_msgs, self.me_responses),
+                                         safe_div(self.oth_msgs, self.oth_responses))
+
+
+class TimeBeforeReply(SequenceAccumulator):
+    name = 'time_before_reply'
+    fields = SequenceAccumulator.fields + ('me_ms_to_response', 'oth_ms_to_response', 'me_responses',
+                                           'oth_responses')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists, **options)
+        # Sums of response times are exact integers in milliseconds.
+        self.me_ms_to_response = 0
+        self.oth_ms_to_response = 0
+
+        self.me_responses = 0
+        self.oth_responses = 0
+
+    def update(self, data):
+        super().update(data)
+
+        # Response time is the time since the previous message, which was sent by the other side.
+        switches = data.switches
+        is_me = data.is_me[switches]
+        intervals = data.intervals[switches - 1]
+
+        self.me_responses += int(np.count_nonzero(is_me))
+        self.me_ms_to_response += int(intervals[is_me].sum())
+        self.oth_responses += len(switches) - int(np.count_nonzero(is_me))
+        self.oth_ms_to_response += int(intervals[~is_me].sum())
+
+    def merge(self, other: 'TimeBeforeReply'):
+        self.me_ms_to_response += other.me_ms_to_response
+        self.oth_ms_to_response += other.oth_ms_to_response
+        self.me_responses += other.me_responses
+        self.oth_responses += other.oth_responses
+
+    def join(self, last, first):
+        if first[1] and not last[1]:
+            self.me_responses += 1
+            self.me_ms_to_response += abs(first[0] - last[0])
+        elif not first[1] and last[1]:
+            self.oth_responses += 1
+            self.oth_ms_to_response += abs(first[0] - last[0])
+
+    def result(self):
+        return TimeBeforeReplyResult(safe_div(self.me_ms_to_response / 1000, self.me_responses),
+                                     safe_div(self.oth_ms_to_response / 1000, self.oth_responses))
+
+
+class MostUsedWords(Accumulator):
+    name = 'most_used_words'
+    # Number of messages whose words are counted at once.
+    batch_size = 1000
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, top_words: int = 100,
+                 approximate_words: bool = False, words_capacity: int = 10000, tokenizer: Tokenizer = None,
+                 **options):
+        """
+        :param top_words: number of most used words to print
+        :param approximate_words: whether words should be counted approximately in bounded memory
+        :param words_capacity: maximal number of distinct words tracked by approximate counting
+        :param tokenizer: tokenizer used to split messages to words
+        """
+        super().__init__(self_name, exhaustive_lists)
+        self.top_words = top_words
+        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
+
+        if approximate_words:
+            self.words = HeavyHittersCounter(words_capacity)
+            self.my_words = HeavyHittersCounter(words_capacity)
+        else:
+            self.words = WordCounter()
+            self.my_words = WordCounter()
+
+    def update(self, data):
+        for is_me, counter in ((True, self.my_words), (False, self.words)):
+            indices = np.flatnonzero(data.is_me == is_me).tolist()
+
+            # Words are counted in batches of messages, so approximate counter is pruned
+            # before memory grows with the size of the conversation.
+            for start in range(0, len(indices), self.batch_size):
+                texts = data.conversation.texts(indices[start:start + self.batch_size])
+                # Messages are joined by line break so words of different messages
+                # are never glued together.
+                counter.update(self.tokenizer.tokenize('\n'.join(texts)))
+
+    def merge(self, other: 'MostUsedWords'):
+        self.words.merge(other.words)
+        self.my_words.merge(other.my_words)
+
+    def state(self):
+        return {'words': self.words.state(), 'my_words': self.my_words.state()}
+
+    def load(self, state):
+        self.words.load(state['words'])
+        self.my_words.load(state['my_words'])
+
+    def result(self):
+        count = None if self.exhaustive_lists else self.top_words
+
+        if self.words.approximate:
+            error = max(self.words.error, self.my_words.error)
+        else:
+            error = 0
+
+        return MostUsedWordsResult(self.words.approximate, error, len(self.words), len(self.my_words),
+                                   dict(self.words.top(count)), dict(self.my_words.top(count)))
+
+
+class WhoStartedConv(SequenceAccumulator):
+    name = 'who_started_conv'
+    fields = SequenceAccumulator.fields + ('me_starts', 'oth_starts')
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, **options):
+        super().__init__(self_name, exhaustive_lists, **options)
+        self.me_starts = 0
+        self.oth_starts = 0
+
+    def update(self, data):
+        super().update(data)
+
+        # Messages sent after long enough gap start new conversation.
+        starts = np.flatnonzero(data.intervals > CONVERSATION_GAP_MS) + 1
+        me_starts = int(np.count_nonzero(data.is_me[starts]))
+        self.me_starts += me_starts
+        self.oth_starts += len(starts) - me_starts
+
+    def merge(self, other: 'WhoStartedConv'):
+        self.me_starts += other.me_starts
+        self.oth_starts += other.oth_starts
+
+    def join(self, last, first):
+        if abs(first[0] - last[0]) > CONVERSATION_GAP_MS:
+            if first[1]:
+                self.me_starts += 1
+            else:
+                self.oth_starts += 1
+
+    def result(self):
+        return WhoStartedResult(self.me_starts, self.oth_starts)
 
-    for name, participants, messages in conversations:
-        for sender, text, date in messages:
-            years[date.year - 2000] += 1
 
-    print('Yearly histogram (You exchange most messages in the year):')
-    for i in range(100):
-        if years[i] != 0:
-            print(f'{i+2000}\t{years[i]}')
+# Reply times are counted in log-scale bins, each doubling of time is split to this many bins.
+LATENCY_BINS_PER_DOUBLING = 4
 
+# Bin 0 counts replies faster than one second, last bin counts replies slower than 2^28 seconds.
+LATENCY_BINS = 1 + 28 * LATENCY_BINS_PER_DOUBLING
 
-def day_in_week_histogram(conversations: List[NamedConversation]):
+# Number of consecutive bins merged into one bin of printed histogram (so each printed bin
+# is 4 times wider than the previous one).
+LATENCY_HISTOGRAM_BINS = 2 * LATENCY_BINS_PER_DOUBLING
+
+
+def latency_bins(milliseconds: np.ndarray) -> np.ndarray:
     """
-    Generates yearly histogram of messages sent from specified list of conversations.
-    :param conversations: list of conversations
-    :return: 
+    Returns indices of log-scale bins of specified reply times.
     """
-    day_in_week = [0 for _ in range(7)]
+    seconds = np.maximum(milliseconds, 1) / 1000
+    bins = np.floor(np.log2(seconds) * LATENCY_BINS_PER_DOUBLING).astype(np.int64) + 1
+    return np.clip(bins, 0, LATENCY_BINS - 1)
 
-    # Names are indexed the same way the days are indexed in strftime()
-    # method as specified by Python documentation "Weekday as a decimal number [0(Sunday),6]."
-    day_in_week_names = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
-    for name, participants, messages in conversations:
-        for sender, text, date in messages:
-            day_in_week[int(date.strftime('%w'))] += 1
+def latency_bin_start(index: int) -> float:
+    """
+    Returns shortest reply time (in seconds) counted in bin with specified index.
+    """
+    return 0 if index == 0 else 2 ** ((index - 1) / LATENCY_BINS_PER_DOUBLING)
 
-    print('Day in week histogram (You exchange most messages at):')
-    for i in range(7):
-        print(f'{day_in_week_names[i]}\t{day_in_week[i]}')
 
+def latency_distribution(counts: List[int]) -> LatencyDistribution:
+    """
+    Computes percentiles and printable histogram from counts of reply times in bins.
+    Percentiles are geometric middles of bins, so they are approximated within ~9%.
+    """
+    cumulative = np.cumsum(counts)
+    total = int(cumulative[-1])
+
+    def percentile(q: float) -> float:
+        index = int(np.searchsorted(cumulative, q * total, side='left'))
+        if index == 0:
+            return 0.5
+        if index == LATENCY_BINS - 1:
+            return latency_bin_start(index)
+        return 2 ** ((index - 0.5) / LATENCY_BINS_PER_DOUBLING)
+
+    # Printed bins are: below one second, then bins of [4^(k - 1), 4^k) seconds.
+    merged = [counts[0]] + [sum(counts[i:i + LATENCY_HISTOGRAM_BINS])
+                            for i in range(1, LATENCY_BINS, LATENCY_HISTOGRAM_BINS)]
+    used = [i for i, count in enumerate(merged) if count]
+
+    histogram = {}
+    for i in range(used[0], used[-1] + 1):
+        start = latency_bin_start(1 + (i - 1) * LATENCY_HISTOGRAM_BINS) if i else 0
+        end = latency_bin_start(1 + i * LATENCY_HISTOGRAM_BINS)
+        if i == 0:
+            label = f'< {format_duration(end)}'
+        elif i == len(merged) - 1:
+            label = f'>= {format_duration(start)}'
+        else:
+            label = f'{format_duration(start)} - {format_duration(end)}'
+        histogram[label] = merged[i]
+
+    return LatencyDistribution(total, percentile(0.5), percentile(0.9), percentile(0.99), histogram)
+
+
+class ReplyLatency(SequenceAccumulator):
+    """
+    Distributions of reply times of each person. Every message sent by different person than
+    the previous message of the conversation is reply of its sender. Reply times are counted
+    in log-scale bins, so distributions of conversations can be merged and their percentiles
+    are computed from the bins.
+    """
 
-def messages_lengths(self_name: str, conversations: List[NamedConversation]):
+    name = 'reply_latency'
+    fields = SequenceAccumulator.fields + ('replies',)
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, top_people: int = 10, **options):
+        """
+        :param top_people: number of people (besides "myself") whose distributions are printed
+        """
+        super().__init__(self_name, exhaustive_lists, **options)
+        self.top_people = top_people
+        self.replies: Dict[int, List[int]] = {}  # id of person -> counts of replies in bins
+
+    def add(self, person_id: int, counts: List[int]) -> None:
+        person_counts = self.replies.get(person_id)
+        if person_counts is None:
+            self.replies[person_id] = list(counts)
+        else:
+            for i, count in enumerate(counts):
+                person_counts[i] += count
+
+    def update(self, data):
+        super().update(data)
+
+        conversation = data.conversation
+        sender_ids = conversation.sender_ids.astype(np.int64)
+        replies = np.flatnonzero(sender_ids[1:] != sender_ids[:-1]) + 1
+        if not len(replies):
+            return
+
+        # Replies are counted in bins of all senders at once.
+        bins = sender_ids[replies] * LATENCY_BINS + latency_bins(data.intervals[replies - 1])
+        counts = np.bincount(bins, minlength=len(conversation.senders) * LATENCY_BINS).reshape(-1, LATENCY_BINS)
+
+        for sender_id in np.flatnonzero(counts.any(axis=1)).tolist():
+            self.add(int(data.person_ids[sender_id]), counts[sender_id].tolist())
+
+    def merge(self, other: 'ReplyLatency'):
+        for person_id, counts in other.replies.items():
+            self.add(person_id, counts)
+
+    def join(self, last, first):
+        if first[2] != last[2]:
+            counts = [0] * LATENCY_BINS
+            counts[int(latency_bins(np.array([first[0] - last[0]]))[0])] = 1
+            self.add(first[2], counts)
+
+    def state(self):
+        # People are saved by their names.
+        state = super().state()
+        state['replies'] = {self.people.name(person_id): counts for person_id, counts in self.replies.items()}
+        return state
+
+    def load(self, state):
+        super().load(state)
+        self.replies = {self.people.intern(name): list(counts) for name, counts in state['replies'].items()}
+
+    def result(self):
+        self_id = self.people.id(self.self_name)
+
+        # Other people are ordered by number of their replies.
+        others = sorted(((sum(counts), self.people.name(person_id), person_id)
+                         for person_id, counts in self.replies.items() if person_id != self_id),
+                        key=lambda item: (-item[0], item[1]))
+        complete = self.exhaustive_lists or len(others) <= self.top_people
+        if not complete:
+            others = others[:self.top_people]
+
+        mine = self.replies.get(self_id)
+        return ReplyLatencyResult(None if mine is None else latency_distribution(mine),
+                                  {name: latency_distribution(self.replies[person_id])
+                                   for _, name, person_id in others}, complete)
+
+
+# Statistics in the order in which they are printed in the reports.
+ALL_STATISTICS = [GeneralStats, TopConversationsByChars, TopConversationsByMessages, ConversationPeopleVariability,
+                  HourlyHistogram, YearlyHistogram, DayInWeekHistogram, MessagesLengths, MsgsBeforeReply,
+                  TimeBeforeReply, WhoStartedConv, ReplyLatency, MostUsedWords]
+
+# Statistics by their names.
+STATISTICS = {statistic.name: statistic for statistic in ALL_STATISTICS}
+
+
+def results_of(accumulators: List[Accumulator]) -> Results:
     """
-    Generates statistics about message length from specified list of conversations.
-    :param self_name: name of the person which should be considered as "myself"
-    :param conversations: list of conversations
-    :return: 
-    """
-    self_max = 0
-    self_total = 0
-    self_cnt = 0
-
-    other_max = 0
-    other_total = 0
-    other_cnt = 0
-
-    for name, participants, messages in conversations:
-        for sender, text, date in messages:
-            # Some messages (eg. when sending image only) have no text content so
-            # we need to check that before actually computing length of the text.
-            if text is not None:
-                message_length = len(text)
-
-                if sender == self_name:
-                    self_total += message_length
-                    self_max = max(self_max, message_length)
-                    self_cnt += 1
+    Returns results of specified accumulators by names of their statistics.
+    """
+    return {accumulator.name: accumulator.result() for accumulator in accumulators}
+
+
+class Report:
+    """
+    Accumulated state of all statistics computed by `StatisticsEngine.run`. Global results are
+    stored in `accumulators`, results for individual conversations in `conversations`.
+    """
+
+    def __init__(self, self_name: str, accumulators: List[Accumulator]):
+        self.self_name = self_name
+        self.accumulators = accumulators
+        self.conversations: List[tuple] = []  # (conversation name, accumulators)
+
+    def results(self) -> ReportResults:
+        """
+        Returns typed results of all statistics which can be written by output backends.
+        """
+        return ReportResults(self.self_name, results_of(self.accumulators),
+                             [ConversationResults(name, results_of(accumulators))
+                              for name, accumulators in self.conversations])
+
+
+class StatisticsEngine:
+    """
+    Computes multiple statistics in a single pass over all messages.
+    """
+
+    def __init__(self, self_name: str, exhaustive_lists: bool = False, statistics: list = None,
+                 timezone: str = None, people: PeopleRegistry = None, **options):
+        """
+        :param self_name: name of the person which should be considered as "myself"
+        :param exhaustive_lists: whether the lists should include all items
+        :param statistics: accumulator classes of statistics to compute (all statistics by default)
+        :param timezone: name of time zone used for histograms (local time zone by default)
+        :param people: registry of people which the conversations are bound to
+        :param options: options of individual statistics (`top_words` for example)
+        """
+        self.self_name = self_name
+        self.exhaustive_lists = exhaustive_lists
+        self.statistics = ALL_STATISTICS if statistics is None else statistics
+        self.offsets = utc_offsets(timezone)
+        # People of conversations which are not bound to the registry are interned to own registry.
+        self.people = PeopleRegistry(self_name) if people is None else people
+        self.bound = people is not None
+        self.options = options
+
+    def create_accumulators(self) -> List[Accumulator]:
+        return [statistic(self.self_name, self.exhaustive_lists, people=self.people, **self.options)
+                for statistic in self.statistics]
+
+    def conversation_data(self, conversation: ColumnarConversation) -> ConversationData:
+        return ConversationData(conversation, self.self_name, self.offsets, self.people, self.bound)
+
+    def run(self, conversations: Iterable[ColumnarConversation],
+            per_conversation: Optional[Callable[[ColumnarConversation], bool]] = None,
+            instrumentation: Instrumentation = None,
+            conversation_results: Optional[Callable[[ColumnarConversation, Results], None]] = None) -> Report:
+        """
+        Computes all statistics of this engine over specified list of conversations.
+
+        :param conversations: list of conversations
+        :param per_conversation: predicate selecting conversations for which separate results
+                                 should be kept in returned report
+        :param instrumentation: instrumentation to record duration of each statistic to
+        :param conversation_results: function which receives results of each selected conversation
+                                     as soon as they are computed, results are not kept in returned
+                                     report then (so memory does not grow with number of conversations)
+        :return: report with accumulated results
+        """
+        report = Report(self.self_name, self.create_accumulators())
+        detailed = instrumentation is not None and instrumentation.detailed
+
+        for conversation in conversations:
+            data = self.conversation_data(conversation)
+            accumulators = self.create_accumulators()
+
+            for accumulator, global_accumulator in zip(accumulators, report.accumulators):
+                if detailed:
+                    instrumentation.reset_peak_memory()
+                    time_start = perf_counter()
+
+                accumulator.update(data)
+                global_accumulator.merge(accumulator)
+
+                if detailed:
+                    instrumentation.add_statistic(type(accumulator).__name__, perf_counter() - time_start,
+                                                  len(data), instrumentation.peak_traced_memory())
+
+            if per_conversation is not None and per_conversation(conversation):
+                if conversation_results is None:
+                    report.conversations.append((conversation.name, accumulators))
                 else:
-                    other_total += message_length
-                    other_max = max(other_max, message_length)
-                    other_cnt += 1
+                    conversation_results(conversation, results_of(accumulators))
 
-    print(f'Longest message has {max(self_max, other_max)} characters')
-    print(f'  Your longest message has {self_max} characters')
-    print(f'  Longest message you received has {other_max} characters')
+        return report
 
-    print(f'Average message length is {round(safe_div((self_total+other_total), (self_cnt+other_cnt)), 2)} characters')
-    print(f'  Your average is {round(safe_div(self_total, self_cnt), 2)} characters')
-    print(f'  Average of messages you received {round(safe_div(other_total, other_cnt), 2)} characters')
 
-    print(f'Based on {self_cnt+other_cnt} messages')
+def _compute_statistic(statistic, self_name: str, conversations: List[ColumnarConversation],
+                       exhaustive_lists: bool = False, **options) -> tuple:
+    """
+    Computes single statistic over specified list of conversations and returns its result.
+    """
+    engine = StatisticsEngine(self_name, exhaustive_lists, [statistic], **options)
+    return engine.run(conversations).accumulators[0].result()
 
 
-def top_conversations_by_chars(self_name: str, conversations: List[NamedConversation], exhaustive_lists: bool):
+def general_stats(self_name: str, conversations: List[ColumnarConversation]) -> GeneralStatsResult:
     """
-    Generates list of top conversations ordered by characters exchanged from specified
-    list of conversations.
-    
+    Generates general statistics for specified list of conversations.
     :param self_name: name of the person which should be considered as "myself"
     :param conversations: list of conversations
-    :param exhaustive_lists: whether the list should include all conversations
-    :return: 
+    :return: result of the statistic
     """
-    conversation_counts = {}
-    total_messages = 0  # Used for computing threshold when not using exhaustive lists.
+    return _compute_statistic(GeneralStats, self_name, conversations)
+
 
-    for name, participants, messages in conversations:
-        total_messages += len(messages)
+def hourly_histogram(conversations: List[ColumnarConversation]) -> Histogram:
+    """
+    Generates hourly histogram of messages sent from specified list of conversations.
+    :param conversations: list of conversations
+    :return: result of the statistic
+    """
+    return _compute_statistic(HourlyHistogram, None, conversations)
 
-        # Create counters for each conversation not present in list of conversations.
-        if not str(participants) in conversation_counts:
-            conversation_counts[name] = [0, 0]  # others, me
 
-        for sender, text, _ in messages:
-            if sender == self_name:
-                conversation_counts[name][1] += 0 if text is None else len(text)
-            else:
-                conversation_counts[name][0] += 0 if text is None else len(text)
+def yearly_histogram(conversations: List[ColumnarConversation]) -> Histogram:
+    """
+    Generates yearly histogram of messages sent from specified list of conversations.
+    :param conversations: list of conversations
+    :return: result of the statistic
+    """
+    return _compute_statistic(YearlyHistogram, None, conversations)
 
-    top_conversations = reversed(
-        sorted((value[0] + value[1], key, value) for (key, value) in conversation_counts.items()))
 
-    # Threshold is used to prevent outputting lot of conversations
-    # with very little messages. Currently it is calculated as average
-    # message count in conversation.
-    threshold = safe_div(total_messages, len(conversation_counts))
+def day_in_week_histogram(conversations: List[ColumnarConversation]) -> Histogram:
+    """
+    Generates day in week histogram of messages sent from specified list of conversations.
+    :param conversations: list of conversations
+    :return: result of the statistic
+    """
+    return _compute_statistic(DayInWeekHistogram, None, conversations)
 
-    print('Conversations by characters exchanged:')
-    for characters, conversation_name, counts in top_conversations:
-        if characters != 0:
-            if exhaustive_lists or characters > threshold:
-                print(f'{conversation_name}\t{characters} ({counts[1]} sent, {counts[0]} received)')
 
-    if not exhaustive_lists:
-        print('And more...')
+def messages_lengths(self_name: str, conversations: List[ColumnarConversation]) -> MessagesLengthsResult:
+    """
+    Generates statistics about message length from specified list of conversations.
+    :param self_name: name of the person which should be considered as "myself"
+    :param conversations: list of conversations
+    :return: result of the statistic
+    """
+    return _compute_statistic(MessagesLengths, self_name, conversations)
 
 
-def top_conversations_by_messages(self_name: str, conversations: List[NamedConversation], exhaustive_lists: bool):
+def top_conversations_by_chars(self_name: str, conversations: List[ColumnarConversation],
+                               exhaustive_lists: bool) -> TopConversations:
     """
-    Generates list of top conversations ordered by messages exchanged from specified
+    Generates list of top conversations ordered by characters exchanged from specified
     list of conversations.
 
     :param self_name: name of the person which should be considered as "myself"
     :param conversations: list of conversations
     :param exhaustive_lists: whether the list should include all conversations
-    :return: 
+    :return: result of the statistic
     """
-    conversation_counts = {}
-    total_messages = 0  # Used for computing threshold when not using exhaustive lists.
-
-    for name, participants, messages in conversations:
-        total_messages += len(messages)
-
-        # Create counters for each conversation not present in list of conversations.
-        if not str(participants) in conversation_counts:
-            conversation_counts[name] = [0, 0]  # others, me
-
-        for sender, _, _ in messages:
-            if sender == self_name:
-                conversation_counts[name][1] += 1
-            else:
-                conversation_counts[name][0] += 1
-
-    top_conversations = sorted((value[0] + value[1], key, value) for (key, value) in conversation_counts.items())
+    return _compute_statistic(TopConversationsByChars, self_name, conversations, exhaustive_lists)
 
-    # Threshold is used to prevent outputting lot of conversations
-    # with very little messages. Currently it is calculated as average
-    # message count in conversation.
-    threshold = safe_div(total_messages, len(conversations))
-
-    print('Conversations by messages exchanged:')
-    for messages, conversation_name, counts in reversed(top_conversations):
-        if messages != 0:
-            if exhaustive_lists or messages > threshold:
-                print(f'{conversation_name}\t{messages}' +
-                      f' ({round(safe_div(messages, total_messages) * 100, 2)}% of all msgs)' +
-                      f' ({counts[1]} sent, {counts[0]} received)')
-
-    if not exhaustive_lists:
-        print('And more...')
 
+def top_conversations_by_messages(self_name: str, conversations: List[ColumnarConversation],
+                                  exhaustive_lists: bool) -> TopConversations:
+    """
+    Generates list of top conversations ordered by messages exchanged from specified
+    list of conversations.
 
-def conversation_people_variability(self_name: str, conversations: List[NamedConversation]):
-    convos = {}
-    total_msgs = 0
+    :param self_name: name of the person which should be considered as "myself"
+    :param conversations: list of conversations
+    :param exhaustive_lists: whether the list should include all conversations
+    :return: result of the statistic
+    """
+    return _compute_statistic(TopConversationsByMessages, self_name, conversations, exhaustive_lists)
 
-    for name, participants, messages in conversations:
-        total_msgs += len(messages)
 
-        if not str(participants) in convos:
-            convos[name] = [0, 0]  # others, me
+def conversation_people_variability(self_name: str, conversations: List[ColumnarConversation]) -> PeopleVariability:
+    return _compute_statistic(ConversationPeopleVariability, self_name, conversations)
 
-        for sender, cnts, date in messages:
-            if sender == self_name:
-                convos[name][1] += 1
-            else:
-                convos[name][0] += 1
 
-    top_convos = sorted((value[0] + value[1], key, value) for (key, value) in convos.items())
+def msgs_before_reply(self_name: str, conversations: List[ColumnarConversation]) -> MessagesBeforeReplyResult:
+    return _compute_statistic(MsgsBeforeReply, self_name, conversations)
 
-    for i in range(1, 20):
-        messages_seen = 0
-        people_seen = 0
-        for msgs, convo, counts in reversed(top_convos):
-            if msgs != 0:
-                messages_seen += msgs
-                people_seen += 1
 
-                if messages_seen > int(total_msgs / (1 + 0.1 * i)):
-                    print(f'{100//(1 + 0.1 * i)}% messages were sent by {people_seen} people.')
-                    break
+def time_before_reply(self_name: str, conversations: List[ColumnarConversation]) -> TimeBeforeReplyResult:
+    return _compute_statistic(TimeBeforeReply, self_name, conversations)
 
 
-def msgs_before_reply(self_name: str, conversations: List[NamedConversation]):
-    me_msgs = 0
-    oth_msgs = 0
+def most_used_words(self_name: str, conversations: List[ColumnarConversation], exhaustive_lists: bool,
+                    **options) -> MostUsedWordsResult:
+    return _compute_statistic(MostUsedWords, self_name, conversations, exhaustive_lists, **options)
 
-    me_responses = 0
-    oth_responses = 0
 
-    last = 'me'
+def who_started_conv(self_name: str, conversations: List[ColumnarConversation]) -> WhoStartedResult:
+    return _compute_statistic(WhoStartedConv, self_name, conversations)
 
-    for name, participants, messages in conversations:
-        for sender, cnts, date in messages:
-            if sender == self_name:
-                me_msgs += 1
-                if last == 'oth':
-                    me_responses += 1
-                last = 'me'
-            else:
-                oth_msgs += 1
-                if last == 'me':
-                    oth_responses += 1
-                last = 'oth'
-
-    print(f'On average other person responded after {round(safe_div(me_msgs, me_responses), 2)} your messages.')
-    print(f'On average you responded after {round(safe_div(oth_msgs, oth_responses), 2)} messages from other person.')
-
-
-def time_before_reply(self_name: str, conversations: List[NamedConversation]):
-    me_seconds_to_response = 0
-    oth_seconds_to_response = 0
-
-    me_responses = 0
-    oth_responses = 0
-
-    for name, participants, messages in conversations:
-        last = None
-        last_my_response = None
-        last_oth_response = None
-
-        for sender, cnts, date in messages:
-            if sender == self_name:
-                last_my_response = date
-                if last == 'oth':
-                    me_responses += 1
-                    me_seconds_to_response += abs((date - last_oth_response).total_seconds())
-                last = 'me'
-            else:
-                last_oth_response = date
-                if last == 'me':
-                    oth_responses += 1
-                    oth_seconds_to_response += abs((date - last_my_response).total_seconds())
-                last = 'oth'
-
-    print(f'On average other person responded ' +
-          f'after {round(safe_div(me_seconds_to_response, me_responses), 2)} seconds.')
-    print(f'On average you responded after {round(safe_div(oth_seconds_to_response, oth_responses), 2)} seconds.')
-
-
-def most_used_words(self_name: str, conversations: List[NamedConversation], exhaustive_lists: bool):
-    words = {}
-    my_words = {}
-
-    for name, participants, messages in conversations:
-        for sender, cnts, date in messages:
-            if cnts is not None:
-                message_words = cnts.replace(',', '').strip().split()
-
-                if sender == self_name:
-                    for word in message_words:
-                        if word not in my_words:
-                            my_words[word] = 0
-                        else:
-                            my_words[word] += 1
-                else:
-                    for word in message_words:
-                        if word not in words:
-                            words[word] = 0
-                        else:
-                            words[word] += 1
-
-    top_words = sorted((value, key) for (key, value) in words.items())
-    my_top_words = sorted((value, key) for (key, value) in my_words.items())
-
-    print(f'There are {len(top_words)} different words in conversation(s).')
-    print(f'You used {len(my_top_words)} different words.')
-    print()
-    print('Most used words in conversations:')
-    i = 0
-    for count, word in reversed(top_words):
-        if i < 100 or exhaustive_lists:
-            print(f'{word}\t{count}')
-        i += 1
-
-    print()
-    print('Most used words by you:')
-    i = 0
-    for count, word in reversed(my_top_words):
-        if i < 100 or exhaustive_lists:
-            print(f'{word}\t{count}')
-        i += 1
-
-
-def who_started_conv(self_name: str, conversations: List[NamedConversation]):
-    me_starts = 0
-    oth_starts = 0
-
-    for name, participants, messages in conversations:
-        last_msg_at = None
-        for sender, cnts, date in messages:
-            if last_msg_at is None:
-                last_msg_at = date
-
-            ans_after = abs((date - last_msg_at).total_seconds())
-
-            if ans_after > 60 * 30:
-                if sender == self_name:
-                    me_starts += 1
-                else:
-                    oth_starts += 1
-            last_msg_at = date
 
-    print(f'Other people started conversation with you {oth_starts} times.')
-    print(f'You started conversation {me_starts} times.')
+def reply_latency(self_name: str, conversations: List[ColumnarConversation],
+                  exhaustive_lists: bool = False) -> ReplyLatencyResult:
+    return _compute_statistic(ReplyLatency, self_name, conversations, exhaustive_lists)
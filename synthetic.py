@@ -0,0 +1,127 @@
+import json
+import os
+import random
+import unicodedata
+from os import path
+from typing import List
+
+WORDS = ['ahoj', 'čau', 'ako', 'sa', 'máš', 'dobre', 'ďakujem', 'kde', 'si', 'zajtra', 'večer', 'pivo', 'škola',
+         'práca', 'áno', 'nie', 'možno', 'okej', 'haha', 'lol', 'ľudia', 'žiadny', 'problém', 'uvidíme', 'hello',
+         'what', 'are', 'you', 'doing', 'tonight', 'see', 'you', 'soon', 'thanks', 'great', '😀', '👍', '❤️']
+
+FIRST_NAMES = ['Adam', 'Ján', 'Peter', 'Martin', 'Tomáš', 'Jana', 'Mária', 'Zuzana', 'Katarína', 'Ľubica',
+               'Šimon', 'Žofia', 'Michal', 'Lucia', 'Ondrej']
+LAST_NAMES = ['Novák', 'Kováč', 'Horváth', 'Varga', 'Tóth', 'Nagy', 'Baláž', 'Szabó', 'Molnár', 'Čierny',
+              'Šťastný']
+
+# Facebook splits messages of one thread to files of at most 10 000 messages.
+MESSAGES_PER_FILE = 10000
+
+
+def mojibake(text: str) -> str:
+    """
+    Encodes text the same (broken) way the Facebook export tool does. Each byte of
+    UTF-8 representation of the text is stored as separate character, which is then
+    escaped as \\u00XX when serialized to JSON.
+    """
+    return text.encode('utf-8').decode('latin-1')
+
+
+def write_json(file_path: str, document: dict) -> None:
+    with open(file_path, mode='w', encoding='ascii') as f:
+        json.dump(document, f, indent=2, ensure_ascii=True)
+
+
+class SyntheticExport:
+    """
+    Generator of synthetic Facebook exports with the same on-disk layout and encoding
+    as exports created by Facebook. Generated exports are deterministic for given seed.
+    """
+
+    def __init__(self, threads: int = 100, messages_per_thread: int = 1000, group_ratio: float = 0.1,
+                 messages_per_file: int = MESSAGES_PER_FILE, my_name: str = 'Matej Kormuth', seed: int = 0):
+        """
+        :param threads: number of generated threads
+        :param messages_per_thread: average number of messages in thread
+        :param group_ratio: ratio of group chats among generated threads
+        :param messages_per_file: maximal number of messages stored in one file
+        :param my_name: name of the person whose export is generated
+        :param seed: seed of the random generator
+        """
+        self.threads = threads
+        self.messages_per_thread = messages_per_thread
+        self.group_ratio = group_ratio
+        self.messages_per_file = messages_per_file
+        self.my_name = my_name
+        self.random = random.Random(seed)
+
+    def person(self) -> str:
+        return f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}'
+
+    def message(self, sender: str, timestamp: int, participants: List[str]) -> dict:
+        message = {'sender_name': mojibake(sender), 'timestamp_ms': timestamp}
+
+        kind = self.random.random()
+        if kind < 0.9:
+            text = ' '.join(self.random.choice(WORDS) for _ in range(int(self.random.expovariate(1 / 6)) + 1))
+            message['content'] = mojibake(text)
+        elif kind < 0.97:
+            message['photos'] = [{'uri': f'messages/inbox/photos/{timestamp}.jpg',
+                                  'creation_timestamp': timestamp // 1000}]
+        else:
+            message['share'] = {'link': 'https://www.facebook.com/'}
+
+        if self.random.random() < 0.05:
+            message['reactions'] = [{'reaction': mojibake('😍'), 'actor': mojibake(self.random.choice(participants))}]
+
+        message['type'] = 'Share' if 'share' in message else 'Generic'
+        return message
+
+    def write_thread(self, messages_path: str, index: int) -> None:
+        group = self.random.random() < self.group_ratio
+        participants = [self.my_name] + [self.person() for _ in range(self.random.randint(2, 7) if group else 1)]
+        title = ', '.join(participants[1:]) if group else participants[1]
+
+        # Facebook names thread directories by ASCII only lower case name and random hash.
+        ascii_name = unicodedata.normalize('NFKD', participants[1]).encode('ascii', 'ignore').decode()
+        thread_dir = f'{ascii_name.replace(" ", "").lower()}_{index:010x}'
+        thread_path = path.join(messages_path, 'inbox', thread_dir)
+        os.makedirs(thread_path, exist_ok=True)
+
+        count = max(1, int(self.random.expovariate(1 / self.messages_per_thread)))
+        timestamp = self.random.randint(1300000000000, 1550000000000)
+        messages = []
+        for _ in range(count):
+            # Messages come in bursts separated by longer pauses.
+            if self.random.random() < 0.1:
+                timestamp += self.random.randint(30 * 60 * 1000, 7 * 24 * 3600 * 1000)
+            else:
+                timestamp += self.random.randint(1000, 10 * 60 * 1000)
+            messages.append(self.message(self.random.choice(participants), timestamp, participants))
+
+        # Files are ordered from the newest messages and messages in files are
+        # stored newest first.
+        messages.reverse()
+        for file_index, start in enumerate(range(0, count, self.messages_per_file)):
+            write_json(path.join(thread_path, f'message_{file_index + 1}.json'), {
+                'participants': [{'name': mojibake(participant)} for participant in participants],
+                'messages': messages[start:start + self.messages_per_file],
+                'title': mojibake(title),
+                'is_still_participant': True,
+                'thread_type': 'RegularGroup' if group else 'Regular',
+                'thread_path': f'inbox/{thread_dir}'
+            })
+
+    def write(self, root_path: str) -> None:
+        """
+        Writes synthetic export to specified directory.
+        """
+        profile_path = path.join(root_path, 'profile_information')
+        os.makedirs(profile_path, exist_ok=True)
+        write_json(path.join(profile_path, 'profile_information.json'),
+                   {'profile': {'name': {'full_name': mojibake(self.my_name)}}})
+
+        messages_path = path.join(root_path, 'messages')
+        os.makedirs(path.join(messages_path, 'stickers_used'), exist_ok=True)
+        for index in range(self.threads):
+            self.write_thread(messages_path, index)
@@ -0,0 +1,33 @@
+import shutil
+
+import pytest
+
+from main import FacebookStatistics
+from synthetic import SyntheticExport
+from tests.exports import parse, report_of
+
+
+@pytest.fixture(scope='session')
+def export_path(tmp_path_factory) -> str:
+    # Threads are split to several files and include group chats, so parsing of
+    # multiple files of one thread is covered as well.
+    root_path = tmp_path_factory.mktemp('export')
+    export = SyntheticExport(threads=12, messages_per_thread=300, group_ratio=0.3, messages_per_file=200)
+    export.write(str(root_path))
+    return str(root_path)
+
+
+@pytest.fixture(scope='session')
+def zip_path(export_path, tmp_path_factory) -> str:
+    base_name = tmp_path_factory.mktemp('zip') / 'export'
+    return shutil.make_archive(str(base_name), 'zip', export_path)
+
+
+@pytest.fixture(scope='session')
+def plain(export_path) -> FacebookStatistics:
+    return parse(export_path)
+
+
+@pytest.fixture(scope='session')
+def plain_report(plain) -> dict:
+    return report_of(plain)
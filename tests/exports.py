@@ -0,0 +1,37 @@
+import contextlib
+import io
+
+from main import FacebookStatistics
+from results import ReportResults, as_dict
+
+TIMEZONE = 'Europe/Bratislava'
+
+
+def parse(root_path: str, **options) -> FacebookStatistics:
+    """
+    Parses all messages of export on specified path with settings shared by all tests.
+    Output of the parsing is suppressed.
+    """
+    options.setdefault('timezone', TIMEZONE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = FacebookStatistics(root_path, **options)
+        stats.parse_all_messages()
+    return stats
+
+
+def comparable(results: ReportResults) -> dict:
+    """
+    Converts results of report to plain dict. Results of conversations are sorted, because
+    their order depends on the order of threads in the archive.
+    """
+    results = as_dict(results)
+    results['conversations'].sort(key=repr)
+    return results
+
+
+def report_of(stats: FacebookStatistics, conversations=None) -> dict:
+    """
+    Returns global statistics and statistics of each conversation (see `comparable`).
+    """
+    conversations = stats.conversations if conversations is None else conversations
+    return comparable(stats.compute_stats(conversations, per_conversation=lambda c: True).results())
@@ -0,0 +1,154 @@
+import glob
+import io
+import json
+import shutil
+from os import path
+
+import pytest
+
+from ingest import decode_facebook_json, stream_thread
+from tests.exports import parse
+
+CHUNK_SIZES = [1 << 20, 64, 7, 1]
+
+
+def streamed_document(data: bytes, chunk_size: int) -> dict:
+    """
+    Collects properties yielded by streaming parser back to a document.
+    """
+    document = {'messages': []}
+    for key, value in stream_thread(io.BytesIO(data), chunk_size):
+        if key == 'messages' and not isinstance(value, list):
+            document['messages'].append(value)
+        else:
+            document[key] = value
+    return document
+
+
+def message_files(export_path: str):
+    return sorted(glob.glob(path.join(export_path, 'messages', 'inbox', '*', 'message_*.json')))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_stream_matches_json_load(export_path, chunk_size):
+    for file_path in message_files(export_path):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        assert streamed_document(data, chunk_size) == json.loads(decode_facebook_json(data))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_stream_matches_json_load_of_any_values(chunk_size):
+    document = {'title': 'a \\ "quoted" Ã¡ title', 'empty': [], 'nested': {'a': [1, 2.5e10, None, True]},
+                'messages': [{'sender_name': 'x', 'timestamp_ms': 1234567890123, 'content': 'Ä\u008f' * 5},
+                             {'sender_name': 'y', 'timestamp_ms': -1, 'reactions': [{'reaction': 'z'}]}],
+                'number': 123456789012345}
+    data = json.dumps(document, indent=1).encode('ascii')
+    assert streamed_document(data, chunk_size) == json.loads(decode_facebook_json(data))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_stream_of_empty_messages(chunk_size):
+    data = b'{"messages": [], "title": "t"}'
+    assert streamed_document(data, chunk_size) == {'messages': [], 'title': 't'}
+
+
+def error_offset(data: bytes, chunk_size: int, tolerant: bool = False) -> int:
+    stream = stream_thread(io.BytesIO(data), chunk_size, tolerant=tolerant)
+    with pytest.raises(ValueError) as error:
+        for _ in stream:
+            pass
+    return stream.error_offset(error.value)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_offset_of_invalid_escape(chunk_size):
+    prefix = b'{"title": "\\u00c3\\u00a1bc", "messages": [{"content": "'
+    data = prefix + b'\\u00zz"}]}'
+    assert error_offset(data, chunk_size) == len(decode_facebook_json(prefix))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_offset_of_invalid_utf8(chunk_size):
+    prefix = b'{"title": "\\u00c3\\u00a1bc", "messages": [{"content": "'
+    data = prefix + b'\\u00c3\\u0028"}]}'
+    assert error_offset(data, chunk_size) == len(decode_facebook_json(prefix))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_offset_of_invalid_structure(chunk_size):
+    prefix = b'{"title": "\\u00c3\\u00a1bc", "messages": [{"content": "a"} '
+    data = prefix + b'{"content": "b"}]}'
+    assert error_offset(data, chunk_size) == len(decode_facebook_json(prefix))
+    assert error_offset(data, chunk_size, tolerant=True) == len(decode_facebook_json(prefix))
+
+
+def one_to_one_file(export_path: str) -> str:
+    """
+    Returns the first message file of a conversation which is not a group chat (group chats
+    are excluded from statistics by default).
+    """
+    for file_path in message_files(export_path):
+        with open(file_path, 'rb') as f:
+            if len(json.loads(decode_facebook_json(f.read()))['participants']) == 2:
+                return file_path
+
+
+def corrupt(file_path: str, marker: bytes, occurrence: int, inserted: bytes) -> bytes:
+    """
+    Inserts bytes before specified occurrence of marker in file and returns the content
+    of the file preceding the inserted bytes.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    position = -1
+    for _ in range(occurrence):
+        position = data.index(marker, position + 1)
+
+    with open(file_path, 'wb') as f:
+        f.write(data[:position] + inserted + data[position:])
+    return data[:position]
+
+
+def message_count(file_path: str) -> int:
+    with open(file_path, 'rb') as f:
+        return len(json.loads(decode_facebook_json(f.read()))['messages'])
+
+
+@pytest.fixture
+def damaged_export(export_path, tmp_path):
+    root_path = str(tmp_path / 'damaged')
+    shutil.copytree(export_path, root_path)
+    return root_path
+
+
+def test_recovery_of_invalid_structure(damaged_export, plain):
+    file_path = one_to_one_file(damaged_export)
+    count = message_count(file_path)
+    prefix = corrupt(file_path, b'{\n      "sender_name"', 3, b'@')
+
+    stats = parse(damaged_export)
+    (error,) = list(stats.errors)
+    assert path.normpath(error.path).endswith(path.normpath(path.relpath(file_path, damaged_export)))
+    assert error.offset == len(decode_facebook_json(prefix))
+    assert error.exception.startswith('JSONDecodeError')
+
+    # Only messages before the error are kept.
+    assert error.recovered == 2
+    assert sum(map(len, stats.conversations)) == sum(map(len, plain.conversations)) - count + 2
+
+
+def test_recovery_of_invalid_escape(damaged_export, plain):
+    file_path = one_to_one_file(damaged_export)
+    count = message_count(file_path)
+    prefix = corrupt(file_path, b'"content": "', 5, b'"x": "\\u00zz", ')
+
+    stats = parse(damaged_export)
+    (error,) = list(stats.errors)
+    assert error.offset == len(decode_facebook_json(prefix)) + len('"x": "')
+    assert error.exception.startswith('UnicodeDecodeError')
+
+    # Invalid escape is replaced, so all messages of the file are recovered.
+    assert error.recovered == count
+    assert sum(map(len, stats.conversations)) == sum(map(len, plain.conversations))
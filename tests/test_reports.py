@@ -0,0 +1,92 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from database import SQL_STATISTICS
+from main import FacebookStatistics
+from results import as_dict
+from rollup import ROLLUP_STATISTICS
+from snapshots import Snapshot
+from tests.exports import TIMEZONE, comparable, parse, report_of
+
+
+def statistics_of(report) -> dict:
+    return as_dict(report.results().statistics)
+
+
+def test_cached_report(export_path, plain_report, tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    assert report_of(parse(export_path, cache_path=cache_path)) == plain_report
+
+    # Second run loads all threads from the cache.
+    assert report_of(parse(export_path, cache_path=cache_path)) == plain_report
+
+
+def test_parallel_report(export_path, plain_report):
+    assert report_of(parse(export_path, workers=2)) == plain_report
+
+
+@pytest.mark.parametrize('read_ahead_bytes', [1, 20000, 64 << 20])
+def test_prefetched_report(export_path, plain_report, read_ahead_bytes):
+    assert report_of(parse(export_path, read_ahead=3, read_ahead_bytes=read_ahead_bytes)) == plain_report
+
+
+def test_zip_report(zip_path, plain_report):
+    assert report_of(parse(zip_path)) == plain_report
+    assert report_of(parse(zip_path, workers=2)) == plain_report
+
+
+def test_packed_report(export_path, plain, plain_report, tmp_path):
+    packed_path = str(tmp_path / 'conversations.bin')
+    plain.write_packed(packed_path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = FacebookStatistics(export_path, timezone=TIMEZONE)
+        stats.load_packed(packed_path)
+    assert report_of(stats) == plain_report
+
+
+def test_rollup_report(plain):
+    conversations = plain.conversations
+    for subset in (conversations, conversations[::2], conversations[:1], []):
+        rollup = plain.rollup_stats(subset)
+        assert statistics_of(rollup) == statistics_of(plain.statistics_engine(ROLLUP_STATISTICS).run(subset))
+
+
+def test_rollup_is_not_used_for_sliced_conversations(plain):
+    sliced = [conversation.slice(0, len(conversation) // 2) for conversation in plain.conversations]
+    assert plain.rollup_stats(sliced) is None
+
+
+def test_sql_report(plain, tmp_path):
+    database_path = str(tmp_path / 'messages.sqlite')
+    with contextlib.redirect_stdout(io.StringIO()):
+        plain.export_database(database_path, plain.conversations)
+        report = plain.sql_stats(database_path)
+    assert statistics_of(report) == statistics_of(plain.statistics_engine(SQL_STATISTICS).run(plain.conversations))
+
+
+@pytest.mark.parametrize('bucket', [None, 'year', 'month', 'day'])
+def test_snapshot_report(plain, plain_report, bucket):
+    snapshot = Snapshot(plain.statistics_engine(), bucket)
+    snapshot.add(plain.conversations)
+    assert comparable(snapshot.report(lambda c: True).results()) == plain_report
+
+
+def test_incremental_snapshot_report(plain, plain_report, tmp_path):
+    engine = plain.statistics_engine()
+    timestamps = np.sort(np.concatenate([conversation.timestamps for conversation in plain.conversations]))
+    cut = timestamps[len(timestamps) // 2]
+
+    older = [conversation.slice(0, int(np.searchsorted(conversation.timestamps, cut)))
+             for conversation in plain.conversations]
+    snapshot = Snapshot(engine)
+    snapshot.add(older)
+    snapshot.save(str(tmp_path / 'snapshot.json'))
+
+    snapshot = Snapshot.load(str(tmp_path / 'snapshot.json'), engine)
+    assert snapshot.update(plain.conversations) == len(timestamps) - sum(map(len, older))
+    assert snapshot.update(plain.conversations) == 0
+    assert comparable(snapshot.report(lambda c: True).results()) == plain_report
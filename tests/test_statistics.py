@@ -0,0 +1,43 @@
+from columnar import ColumnarBuilder, ColumnarConversation
+from statistics import MsgsBeforeReply, StatisticsEngine, msgs_before_reply
+
+ME = 'Matej Kormuth'
+OTHER = 'John Doe'
+
+
+def conversation(name: str, senders: list, start: int = 0) -> ColumnarConversation:
+    builder = ColumnarBuilder()
+    for i, sender in enumerate(senders):
+        builder.append(sender, 'text', start + i * 1000)
+    return builder.build(name, [ME, OTHER])
+
+
+def test_msgs_before_reply_resets_per_conversation():
+    # First message of each conversation is counted as if it followed my message, so
+    # message of other person which starts the second conversation is a reply although
+    # the first conversation ended with message of other person too.
+    first = conversation('First', [ME, OTHER])
+    second = conversation('Second', [OTHER, ME], start=10 ** 6)
+
+    result = msgs_before_reply(ME, [first, second])
+    assert result.messages_before_other_reply == 2.0  # my 2 messages, 1 reply of mine
+    assert result.messages_before_my_reply == 1.0  # 2 messages of other person, 2 replies of theirs
+
+
+def test_msgs_before_reply_does_not_depend_on_order_of_conversations():
+    conversations = [conversation('First', [ME, OTHER, OTHER]), conversation('Second', [OTHER, OTHER, ME, ME]),
+                     conversation('Third', [OTHER, ME, OTHER])]
+    assert msgs_before_reply(ME, conversations) == msgs_before_reply(ME, conversations[::-1])
+
+
+def test_msgs_before_reply_of_parts_of_conversation():
+    # Consecutive parts of one conversation combined by `extend` continue the conversation.
+    whole = conversation('Whole', [OTHER, OTHER, ME, OTHER, ME, ME, OTHER])
+    engine = StatisticsEngine(ME, statistics=[MsgsBeforeReply])
+
+    for split in range(len(whole) + 1):
+        (first,), (second,) = engine.create_accumulators(), engine.create_accumulators()
+        first.update(engine.conversation_data(whole.slice(0, split)))
+        second.update(engine.conversation_data(whole.slice(split, len(whole))))
+        first.extend(second)
+        assert first.result() == msgs_before_reply(ME, [whole])
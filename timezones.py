@@ -0,0 +1,102 @@
+import datetime
+import time
+from functools import lru_cache
+from typing import Tuple, Optional, Callable
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+DAY_MS = 24 * 60 * 60 * 1000
+HOUR_MS = 60 * 60 * 1000
+
+# Range of years for which UTC offsets are precomputed. Timestamps outside of this
+# range use the offset of the nearest year in the range.
+FIRST_YEAR = 1990
+LAST_YEAR = datetime.date.today().year + 5
+
+
+class UtcOffsets:
+    """
+    Precomputed table of UTC offsets of a time zone. Table consists of sorted times
+    (milliseconds since epoch) at which the offset changes and offsets valid from these
+    times, so local time of many timestamps can be computed by single binary search.
+    """
+
+    def __init__(self, timezone: Optional[str] = None):
+        """
+        :param timezone: name of time zone (Europe/Bratislava for example), local time zone
+                         of the system by default
+        """
+        self.timezone = timezone
+
+        if timezone is None:
+            def offset_at(seconds: int) -> int:
+                return time.localtime(seconds).tm_gmtoff
+        else:
+            zone = ZoneInfo(timezone)
+
+            def offset_at(seconds: int) -> int:
+                return int(datetime.datetime.fromtimestamp(seconds, zone).utcoffset().total_seconds())
+
+        self.transitions, self.offsets = self.compute_table(offset_at)
+
+    @staticmethod
+    def compute_table(offset_at: Callable[[int], int]) -> Tuple[np.ndarray, np.ndarray]:
+        start = int(datetime.datetime(FIRST_YEAR, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+        end = int(datetime.datetime(LAST_YEAR, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+        transitions = [np.iinfo(np.int64).min]
+        offsets = [offset_at(start)]
+
+        # Offset changes at most few times a year, so we sample it once a day and
+        # find exact second of each change by binary search.
+        for day in range(start + 86400, end, 86400):
+            offset = offset_at(day)
+            if offset == offsets[-1]:
+                continue
+
+            low, high = day - 86400, day
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset_at(middle) == offset:
+                    high = middle
+                else:
+                    low = middle
+
+            transitions.append(high * 1000)
+            offsets.append(offset)
+
+        return np.array(transitions, dtype=np.int64), np.array(offsets, dtype=np.int64) * 1000
+
+    def local(self, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Converts timestamps (milliseconds since epoch) to local timestamps (milliseconds since
+        epoch in local time).
+        """
+        indices = np.searchsorted(self.transitions, timestamps, side='right') - 1
+        return timestamps + self.offsets[indices]
+
+
+@lru_cache(maxsize=None)
+def utc_offsets(timezone: Optional[str] = None) -> UtcOffsets:
+    """
+    Returns (shared) table of UTC offsets of specified time zone.
+    """
+    return UtcOffsets(timezone)
+
+
+def local_time_parts(timestamps: np.ndarray, offsets: UtcOffsets) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Converts timestamps (milliseconds since epoch) to local time and returns arrays
+    of years, days in week (0 is Sunday) and hours.
+    """
+    local = offsets.local(timestamps)
+    days = local // DAY_MS
+
+    years = days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+    # 1st January 1970 was Thursday.
+    weekdays = (days + 4) % 7
+    hours = (local // HOUR_MS) % 24
+
+    return years, weekdays, hours
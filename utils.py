@@ -1,9 +1,22 @@
-def separator(character: str = '-', length: int = 62) -> None:
+from typing import TextIO
+
+
+def separator(character: str = '-', length: int = 62, file: TextIO = None) -> None:
     """
     Prints separator using character '-' as default character with default
-    length of 62 characters.
+    length of 62 characters to specified file (standard output by default).
+    """
+    print(character * length, file=file)
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats duration in seconds as short human readable text (`45 s`, `2.5 min`, `3 h`).
     """
-    print(character * length)
+    for unit, length in (('d', 86400), ('h', 3600), ('min', 60)):
+        if seconds >= length:
+            return f'{round(seconds / length, 1):g} {unit}'
+    return f'{round(seconds, 1):g} s'
 
 
 def safe_div(a, b):
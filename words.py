@@ -0,0 +1,150 @@
+import heapq
+import re
+from collections import Counter
+from typing import Iterable, List, Tuple, Optional
+
+# Type of word with its count.
+WordCount = Tuple[str, int]
+
+
+class Tokenizer:
+    """
+    Splits texts of messages to words.
+
+    By default words are separated by whitespace and commas are removed. Words can be
+    also matched by custom regular expression, converted to lower case and filtered
+    by minimal length and list of stopwords.
+    """
+
+    def __init__(self, pattern: Optional[str] = None, lowercase: bool = False, stopwords: Iterable[str] = (),
+                 min_length: int = 1):
+        """
+        :param pattern: regular expression matching single word (whitespace separated words by default)
+        :param lowercase: whether words should be converted to lower case
+        :param stopwords: words which should be ignored
+        :param min_length: minimal length of word
+        """
+        self.regex = None if pattern is None else re.compile(pattern)
+        self.lowercase = lowercase
+        self.stopwords = frozenset(word.lower() for word in stopwords) if lowercase else frozenset(stopwords)
+        self.min_length = min_length
+
+    def tokenize(self, text: str) -> List[str]:
+        if self.lowercase:
+            text = text.lower()
+
+        if self.regex is None:
+            words = text.replace(',', '').split()
+        else:
+            words = self.regex.findall(text)
+
+        if self.stopwords or self.min_length > 1:
+            stopwords = self.stopwords
+            min_length = self.min_length
+            words = [word for word in words if len(word) >= min_length and word not in stopwords]
+
+        return words
+
+
+def load_stopwords(path: str, encoding: str = 'utf-8') -> List[str]:
+    """
+    Loads list of stopwords from text file containing one word per line.
+    """
+    with open(path, encoding=encoding) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def top_words(counts: Counter, count: Optional[int]) -> List[WordCount]:
+    """
+    Returns specified count of most used words (all words when count is None) ordered
+    by their count. Words used the same number of times are ordered by the word itself.
+    """
+    def key(item):
+        return item[1], item[0]
+
+    if count is None:
+        return sorted(counts.items(), key=key, reverse=True)
+    return heapq.nlargest(count, counts.items(), key=key)
+
+
+class WordCounter:
+    """
+    Exact counter of words.
+    """
+
+    approximate = False
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def update(self, words: Iterable[str]) -> None:
+        self.counts.update(words)
+
+    def merge(self, other: 'WordCounter') -> None:
+        self.counts.update(other.counts)
+
+    def state(self) -> dict:
+        return {'counts': dict(self.counts)}
+
+    def load(self, state: dict) -> None:
+        self.counts = Counter(state['counts'])
+
+    def top(self, count: Optional[int]) -> List[WordCount]:
+        return top_words(self.counts, count)
+
+
+class HeavyHittersCounter:
+    """
+    Approximate counter of most used words which keeps at most `capacity` words in memory.
+
+    Counter is the mergeable summary of Misra and Gries: whenever the number of tracked
+    words exceeds the capacity, count of the (capacity + 1)-th most used word is subtracted
+    from all words and words with non-positive counts are forgotten. Every word used more
+    than `error` times is guaranteed to be tracked, and its count is underestimated by at
+    most `error`, which is at most n / (capacity + 1) for n counted words.
+    """
+
+    approximate = True
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.error = 0
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def update(self, words: Iterable[str]) -> None:
+        """
+        Counts specified words and prunes the counter. Counter holds all distinct words of one
+        update until it is pruned, so large texts should be counted in several batches.
+        """
+        self.counts.update(words)
+        self.prune()
+
+    def merge(self, other: 'HeavyHittersCounter') -> None:
+        self.counts.update(other.counts)
+        self.error += other.error
+        self.prune()
+
+    def state(self) -> dict:
+        return {'counts': dict(self.counts), 'error': self.error}
+
+    def load(self, state: dict) -> None:
+        self.counts = Counter(state['counts'])
+        self.error = state.get('error', 0)
+        self.prune()
+
+    def prune(self) -> None:
+        if len(self.counts) <= self.capacity:
+            return
+
+        threshold = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.error += threshold
+        self.counts = Counter({word: count - threshold for word, count in self.counts.items() if count > threshold})
+
+    def top(self, count: Optional[int]) -> List[WordCount]:
+        return top_words(self.counts, count)